@@ -0,0 +1,105 @@
+"""Pool of agents over one dataset, shared by every session asking about it.
+
+An agent's python tool keeps the variables the LLM's code assigns, so two
+questions running on the same agent at once would see each other's
+variables. Each question therefore checks an agent out of the pool, and the
+pool only creates a new agent when every existing one is busy, up to
+``max_size``. All agents of a dataset work on the same frames: whenever an
+agent goes back into the pool its tool starts over from a shallow copy of
+them, which also releases whatever the last question computed. With
+pandas copy-on-write, code that modifies ``df`` only copies the columns it
+touches, and the shared frame is never changed.
+"""
+import threading
+from contextlib import contextmanager
+
+import pandas as pd
+from langchain_experimental.tools.python.tool import PythonAstREPLTool
+
+# Copy-on-write is always on from pandas 3; earlier versions need it switched on
+if int(pd.__version__.split(".")[0]) < 3:
+    pd.set_option("mode.copy_on_write", True)
+
+
+def _repl_tools(agents):
+    for agent in agents if isinstance(agents, tuple) else (agents,):
+        if agent is None:
+            continue
+        for tool in agent.tools:
+            if isinstance(tool, PythonAstREPLTool):
+                yield tool
+
+
+def _fresh(value):
+    return value.copy(deep=False) if isinstance(value, pd.DataFrame) else value
+
+
+class AgentPool:
+    """Agents built by ``factory()`` on demand, at most ``max_size`` at a time."""
+
+    def __init__(self, factory, max_size=4):
+        self.max_size = max(1, max_size)
+        self._factory = factory
+        self._idle = []
+        self._created = 0
+        # Each tool's variables as the agent was built, restored after every question
+        self._initial = {}
+        self._cond = threading.Condition()
+
+    def _create(self):
+        agents = self._factory()
+        for tool in _repl_tools(agents):
+            self._initial[id(tool)] = (dict(tool.globals or {}), dict(tool.locals or {}))
+        self._reset(agents)
+        return agents
+
+    def _reset(self, agents):
+        for tool in _repl_tools(agents):
+            initial_globals, initial_locals = self._initial[id(tool)]
+            tool.globals = {name: _fresh(value) for name, value in initial_globals.items()}
+            tool.locals = {name: _fresh(value) for name, value in initial_locals.items()}
+
+    def prime(self):
+        """Build the first agent now rather than on the first question."""
+        with self._cond:
+            if self._created:
+                return
+            self._created += 1
+        try:
+            agents = self._create()
+        except BaseException:
+            with self._cond:
+                self._created -= 1
+            raise
+        with self._cond:
+            self._idle.append(agents)
+            self._cond.notify()
+
+    @contextmanager
+    def checkout(self):
+        """Hold an agent for one question; waits while ``max_size`` agents are busy."""
+        with self._cond:
+            while not self._idle and self._created >= self.max_size:
+                self._cond.wait()
+            agents = self._idle.pop() if self._idle else None
+            if agents is None:
+                self._created += 1
+        if agents is None:
+            try:
+                agents = self._create()
+            except BaseException:
+                with self._cond:
+                    self._created -= 1
+                    self._cond.notify()
+                raise
+        try:
+            yield agents
+        finally:
+            self._reset(agents)
+            with self._cond:
+                self._idle.append(agents)
+                self._cond.notify()
+
+    def stats(self):
+        with self._cond:
+            return {"agents": self._created, "in_use": self._created - len(self._idle), "max": self.max_size}
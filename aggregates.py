@@ -0,0 +1,180 @@
+"""Precomputed count cubes over the categorical columns, for instant breakdown answers.
+
+At ingestion every low-cardinality column (those in the value dictionary)
+is factorized into small integer codes, and the counts for every single
+column and every pair of columns are computed from them with ``bincount``.
+Other column combinations are counted on first use and kept. Count
+questions ("Billable Status by Resource Pool", "how many On Notice in
+Digital Platform") are then answered from a few hundred cube rows instead
+of scanning the sheet. A refreshed sheet adjusts the counts by the rows
+that changed (see :meth:`AggregateCubes.refreshed`).
+"""
+import itertools
+import math
+import threading
+
+import numpy as np
+import pandas as pd
+
+from dataset_cache import frame_nbytes
+from query_planner import BLANK, COMMENTS_COLUMN, COUNT_COLUMN, NAME_COLUMN, describe_filters, normalize_text, sort_counts
+
+# At most this many columns (fewest distinct values first) are cubed
+CUBE_MAX_DIMS = 12
+# Combinations with more cells than this are counted with a group-by instead of bincount
+DENSE_MAX_CELLS = 1_000_000
+
+
+def cube_dims(df, value_dict):
+    dims = [c for c in value_dict if c in df.columns and c not in (NAME_COLUMN, COMMENTS_COLUMN)]
+    return sorted(dims, key=lambda c: len(value_dict[c]))[:CUBE_MAX_DIMS]
+
+
+class AggregateCubes:
+    """Group-by counts over the categorical columns of one sheet."""
+
+    def __init__(self, df, value_dict):
+        self.dims = cube_dims(df, value_dict)
+        self.rows = len(df)
+        self._codes = {}
+        self._labels = {}
+        self._cuboids = {}
+        self._lock = threading.Lock()
+        for col in self.dims:
+            if isinstance(df[col].dtype, pd.CategoricalDtype):
+                # Categoricals already carry their codes
+                codes, uniques = df[col].cat.codes.to_numpy().astype(np.int64), df[col].cat.categories
+            else:
+                codes, uniques = pd.factorize(df[col])
+            # Missing values get the last code and are shown as "(blank)"
+            codes[codes == -1] = len(uniques)
+            self._codes[col] = codes.astype(np.min_scalar_type(len(uniques)))
+            self._labels[col] = np.append(np.asarray(uniques, dtype=object), BLANK)
+        # The breakdowns asked for most often: every single column and every pair
+        for size in (1, 2):
+            for cols in itertools.combinations(self.dims, size):
+                self.cuboid(cols)
+
+    def _count_codes(self, cols, rows=None):
+        shape = [len(self._labels[c]) for c in cols]
+        codes = [(self._codes[c] if rows is None else self._codes[c][rows]).astype(np.int64) for c in cols]
+        if math.prod(shape) <= DENSE_MAX_CELLS:
+            counts = np.bincount(np.ravel_multi_index(codes, shape), minlength=math.prod(shape))
+            present = counts.nonzero()[0]
+            index = np.unravel_index(present, shape)
+            frame = pd.DataFrame({c: self._labels[c][i] for c, i in zip(cols, index)})
+            frame[COUNT_COLUMN] = counts[present]
+            return frame
+        grouped = pd.DataFrame(dict(zip(cols, codes))).groupby(list(cols), sort=False).size()
+        frame = grouped.reset_index(name=COUNT_COLUMN)
+        for c in cols:
+            frame[c] = self._labels[c][frame[c].to_numpy()]
+        return frame
+
+    def cuboid(self, cols):
+        """Counts grouped by ``cols``, computed once and then kept."""
+        key = tuple(sorted(cols, key=self.dims.index))
+        with self._lock:
+            cube = self._cuboids.get(key)
+        if cube is not None:
+            return cube
+        return self._store(key, self._count_codes(key))
+
+    def _store(self, key, frame):
+        # Normalized copies of the labels, matched the way apply_filters matches the sheet
+        normalized = {col: frame[col].map(lambda v: None if v == BLANK else normalize_text(v)) for col in key}
+        with self._lock:
+            return self._cuboids.setdefault(key, (frame, normalized))
+
+    def refreshed(self, df, value_dict, diff):
+        """Cubes of the next version of the sheet (see refresh.RowDiff).
+
+        Codes of unchanged rows are moved to their new positions and every
+        cuboid built so far gets the counts of the decoded rows added and
+        those of the dropped rows taken off. Rebuilt from scratch when the
+        set of cubed columns changed.
+        """
+        if set(cube_dims(df, value_dict)) != set(self.dims):
+            return AggregateCubes(df, value_dict)
+        cubes = AggregateCubes.__new__(AggregateCubes)
+        cubes.dims = self.dims
+        cubes.rows = len(df)
+        cubes._codes = {}
+        cubes._labels = {}
+        cubes._cuboids = {}
+        cubes._lock = threading.Lock()
+        kept = diff.source >= 0
+        decoded = diff.decoded
+        for col in self.dims:
+            labels = list(self._labels[col])
+            lookup = {label: code for code, label in enumerate(labels)}
+            new_codes = []
+            for value in df[col].take(decoded).tolist():
+                label = BLANK if pd.isna(value) else value
+                if label not in lookup:
+                    lookup[label] = len(labels)
+                    labels.append(label)
+                new_codes.append(lookup[label])
+            codes = np.empty(len(df), dtype=np.min_scalar_type(len(labels)))
+            codes[kept] = self._codes[col][diff.source[kept]]
+            codes[decoded] = new_codes
+            cubes._codes[col] = codes
+            cubes._labels[col] = np.asarray(labels, dtype=object)
+
+        dropped = diff.dropped
+        with self._lock:
+            cuboids = list(self._cuboids.items())
+        for key, (frame, _) in cuboids:
+            removed = self._count_codes(key, dropped)
+            removed[COUNT_COLUMN] = -removed[COUNT_COLUMN]
+            merged = pd.concat([frame, cubes._count_codes(key, decoded), removed], ignore_index=True)
+            merged = merged.groupby(list(key), sort=False)[COUNT_COLUMN].sum().reset_index()
+            cubes._store(key, merged[merged[COUNT_COLUMN] != 0].reset_index(drop=True))
+        return cubes
+
+    def covers(self, plan):
+        needed = set(plan["filters"]) | set(plan["group_by"])
+        return bool(self.dims) and needed <= set(self.dims)
+
+    def count(self, filters, group_by=()):
+        """Total count (no ``group_by``) or a Count table per combination of the ``group_by`` columns' values."""
+        group_by = list(group_by)
+        cols = list(filters) + [c for c in group_by if c not in filters]
+        if not cols:
+            return self.rows
+        frame, normalized = self.cuboid(cols)
+        mask = None
+        for col, values in filters.items():
+            wanted = {normalize_text(v) for v in values}
+            match = normalized[col].isin(wanted)
+            mask = match if mask is None else mask & match
+        matched = frame[mask] if mask is not None else frame
+        if not group_by:
+            return int(matched[COUNT_COLUMN].sum())
+        counts = matched.groupby(group_by, sort=False)[COUNT_COLUMN].sum().reset_index()
+        return sort_counts(counts[counts[COUNT_COLUMN] > 0])
+
+    def answer(self, plan):
+        """Response for a count plan from :func:`query_planner.plan_query`, or None if not covered."""
+        if plan["action"] != "count" or not self.covers(plan):
+            return None
+        if plan["group_by"]:
+            table = self.count(plan["filters"], plan["group_by"])
+            return {
+                "result": table.to_csv(index=False),
+                "is_structured": True,
+                "table": table,
+                "source": "cube",
+            }
+        total = self.count(plan["filters"])
+        return {
+            "result": f"{total} employees match {describe_filters(plan['filters'])}.",
+            "is_structured": False,
+            "table": None,
+            "source": "cube",
+        }
+
+    def nbytes(self):
+        with self._lock:
+            cubes = list(self._cuboids.values())
+        return sum(frame_nbytes(frame) for frame, _ in cubes) + sum(codes.nbytes for codes in self._codes.values())
@@ -0,0 +1,182 @@
+"""Headless batch mode: answer many questions about one workbook concurrently.
+
+    python batch.py workbook.xlsx questions.txt -o answers.jsonl --concurrency 8 --rate 60
+    python batch.py rmg_march.xlsx rmg_april.xlsx questions.txt    # several workbooks, one dataset
+
+``questions`` is a text file with one question per line, or a JSONL file
+with ``{"id": ..., "question": ...}`` records. Output is JSONL, or Parquet
+when the output path ends in ``.parquet``.
+"""
+import argparse
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pandas as pd
+from langchain_core.callbacks import BaseCallbackHandler
+
+from chat_engine import answer_query, load_dataset_files, make_dataset_cache, make_response_cache
+from metrics import export_metrics, start_metrics_server
+
+
+class TokenBucket:
+    """Blocking token bucket: ``rate`` acquisitions per second, bursts up to ``capacity``."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class RateLimitHandler(BaseCallbackHandler):
+    """Take a token from ``bucket`` before every LLM call, so agent steps and narrations all count."""
+
+    def __init__(self, bucket):
+        self.bucket = bucket
+
+    def on_llm_start(self, serialized, prompts, **kwargs):
+        self.bucket.acquire()
+
+    def on_chat_model_start(self, serialized, messages, **kwargs):
+        self.bucket.acquire()
+
+
+def read_questions(path):
+    path = Path(path)
+    if path.suffix == ".jsonl":
+        questions = []
+        with open(path, encoding="utf-8") as f:
+            for i, line in enumerate(f):
+                if line.strip():
+                    record = json.loads(line)
+                    questions.append((str(record.get("id", i)), record["question"]))
+        return questions
+    with open(path, encoding="utf-8") as f:
+        lines = [line.strip() for line in f]
+    return [(str(i), q) for i, q in enumerate(q for q in lines if q)]
+
+
+def run_batch(dataset, questions, concurrency=4, rate=None, retries=3, backoff=1.0, response_cache=None, on_result=None):
+    """Answer ``questions`` (a list of ``(id, question)``) with at most ``concurrency`` in flight.
+
+    ``rate`` caps LLM calls per second across all workers. Returns one
+    record per question, in input order.
+    """
+    callbacks = [RateLimitHandler(TokenBucket(rate))] if rate else None
+
+    def task(item):
+        qid, question = item
+        record = {"id": qid, "question": question}
+        started = time.perf_counter()
+        try:
+            response = answer_query(question, dataset, response_cache, callbacks, retries, backoff)
+            table = response.get("table")
+            record.update(
+                result=response["result"],
+                is_structured=response["is_structured"],
+                source=response.get("source"),
+                table=table.to_dict(orient="records") if table is not None else None,
+                elapsed=time.perf_counter() - started,
+                attempts=response["attempts"],
+                prompt_tokens=response["metrics"]["prompt_tokens"],
+                completion_tokens=response["metrics"]["completion_tokens"],
+                tool_calls=response["metrics"]["tool_calls"],
+                error=None,
+            )
+        except Exception as e:
+            record.update(result=None, is_structured=False, source=None, table=None, elapsed=None, attempts=retries + 1,
+                          prompt_tokens=None, completion_tokens=None, tool_calls=None, error=str(e))
+        if on_result is not None:
+            on_result(record)
+        return record
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        return list(pool.map(task, questions))
+
+
+def write_results(records, path):
+    path = Path(path)
+    if path.suffix == ".parquet":
+        frame = pd.DataFrame(records)
+        frame["table"] = frame["table"].map(lambda t: json.dumps(t, default=str) if t is not None else None)
+        frame.to_parquet(path, index=False)
+        return
+    with open(path, "w", encoding="utf-8") as f:
+        for record in records:
+            f.write(json.dumps(record, default=str) + "\n")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Answer a batch of questions about an Excel workbook.")
+    parser.add_argument("workbooks", nargs="+", help="Path(s) to the .xlsx file(s); all their sheets form one dataset")
+    parser.add_argument("questions", help="Questions file (.txt one per line, or .jsonl with id/question)")
+    parser.add_argument("-o", "--output", default="answers.jsonl", help="Output file (.jsonl or .parquet)")
+    parser.add_argument("-c", "--concurrency", type=int, default=4, help="Questions in flight at once")
+    parser.add_argument("--rate", type=float, default=None, help="Max LLM calls per minute (default: unlimited)")
+    parser.add_argument("--retries", type=int, default=3, help="Retries per failed LLM step")
+    parser.add_argument("--backoff", type=float, default=1.0, help="Initial retry delay in seconds")
+    parser.add_argument("--no-cache", action="store_true", help="Do not read or write the response cache")
+    parser.add_argument("--metrics-port", type=int, default=None, help="Serve /metrics on this local port while running")
+    args = parser.parse_args(argv)
+
+    start_metrics_server(args.metrics_port)
+    workbooks = [Path(path) for path in args.workbooks]
+    questions = read_questions(args.questions)
+    response_cache = None if args.no_cache else make_response_cache()
+
+    started = time.perf_counter()
+    dataset = load_dataset_files(
+        [(w.name, w.read_bytes()) for w in workbooks], make_dataset_cache(), response_cache, pool_size=args.concurrency
+    )
+    loaded = time.perf_counter()
+
+    done = 0
+    done_lock = threading.Lock()
+
+    def progress(record):
+        nonlocal done
+        with done_lock:
+            done += 1
+            status = "error" if record["error"] else record["source"]
+            print(f"[{done}/{len(questions)}] {status}: {record['question'][:70]}")
+
+    records = run_batch(
+        dataset,
+        questions,
+        concurrency=args.concurrency,
+        rate=args.rate / 60 if args.rate else None,
+        retries=args.retries,
+        backoff=args.backoff,
+        response_cache=response_cache,
+        on_result=progress,
+    )
+    write_results(records, args.output)
+    export_metrics()
+
+    finished = time.perf_counter()
+    errors = sum(1 for r in records if r["error"])
+    print(
+        f"Loaded workbook in {loaded - started:.1f}s, answered {len(records) - errors}/{len(records)} "
+        f"questions in {finished - loaded:.1f}s -> {args.output}"
+    )
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,304 @@
+"""Offline benchmark of the query path on synthetic RMG-shaped workbooks.
+
+    python benchmark.py                         # 1k, 10k, 100k and 1M rows
+    python benchmark.py --rows 1000 10000 -o bench.json
+    python benchmark.py --rows 10000 --compare previous.json
+
+No API key is needed: agents run against a deterministic fake chat model.
+For every workbook size each stage reports wall time, peak traced memory
+and estimated prompt tokens. Each stage runs twice: once timed, once under
+tracemalloc for its peak memory, since tracing slows pandas code down
+several times over. Results are written as JSON so runs from
+different versions can be compared with ``--compare``.
+"""
+import argparse
+import json
+import platform
+import random
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from pathlib import Path
+
+import pandas as pd
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from openpyxl import Workbook
+
+from chat_engine import (
+    create_agents,
+    get_enriched_prompt,
+    finish_llm_response,
+    handle_user_query,
+    read_workbook,
+    try_parse_csv_or_table,
+)
+from dataset_cache import frame_nbytes
+from ingest import compact_dtypes, infer_numeric_columns
+from name_index import EmployeeIndex, answer_from_index
+from query_planner import answer_locally
+from value_dictionary import build_value_dictionary, estimate_tokens
+
+DEFAULT_SIZES = [1_000, 10_000, 100_000, 1_000_000]
+WORKBOOK_DIR = Path(tempfile.gettempdir()) / "excel_ai_chat_bench"
+
+# A representative slice of the values seen in real RMG workbooks
+COLUMN_VALUES = {
+    "Resource Pool": [
+        "JavaScript", "CSS", "QA", "Java", "Project Management", "Finance", "Ruby", "Management",
+        "IT", "QA-Auto", "QA-Manual", "Graphics", ".Net", "Angular", "Mobile", "HR", "Recruitment",
+        "BA", "PHP", "Salesforce", "FrontEnd", "Research", "Content Writing", "Data Enrichment",
+        "React JS", "Marketing", "Workday", "Android", "Python", "DevOps", "AWS", "Data Engineering",
+    ],
+    "Primary Skills": [
+        "Vue JS", "QA-MANUAL", "Api testing", "Java", "Ruby/Rails", "nodejs", "UI/UX",
+        "Team Management", "QA-AUTO", ".Net Core", "Salesforce", "Project Management",
+        "Software Testing", "Android", "Recruitment", "Business Analysis", "Angular", "React JS",
+        "javascript", "AWS", "PHP", "Typescript", "Digital Marketing", "Python", "SQL", "MongoDB",
+        "Spring Boot", "Power BI", "selenium", "Kotlin",
+    ],
+    "Employment Status": ["3rd Party Contract", "Confirmed", "Probation", "On Notice", "Probation Extended", "Direct Contract"],
+    "Project Name": [
+        "0339-Rev-CCMH-Proj-CCMH", "0359-Rev-Parkofon-Proj-Sheeva-ai", "0328-Rev-AboveBoard-Proj-AboveBoard",
+        "5501-Inv-V2Solutions-Proj-Digital Engineering Bench", "6003-Inv-V2Solutions-OPS-Finance",
+        "5401-Inv-V2Solutions-Proj-Digital Experience Bench", "0408-Rev-Imdex-Proj-Imdex",
+        "0196-Rev-Shutterstock-Proj-Shutterstock", "0185-Rev-LendingTree-Proj-LendingTree",
+        "0407-Rev-HealthEdge-Proj-HealthEdge", "0327-Rev-Rubrik-Proj-Rubrik", "0361-Rev-Pacaso-Proj-Pacaso",
+        "5701-Inv-V2Solutions-Proj-Digital Platform Bench", "0354-Rev-Twitch-Proj-Twitch",
+        "0309-Rev-LyricFind-Proj-LyricFind", "0365-Rev-JustCall-Proj-JustCall", "0217-Rev-CureMD-Proj-CureMD",
+    ],
+    "Availability Status": ["Available for billing", "Mapped for future billing opportunity", "Not Available for billing", "Management"],
+    "Billable Status": ["Billable", "Non Billable"],
+    "Employment Type": ["Contractor", "FTE"],
+    "Sub Practice Area": [
+        "Salesforce S&M", "Digital Engineering", "Digital Platform", "Inside Sales", "Enterprise Sales",
+        "Sales", "Marketing", "Digital Engineering Bench", "Digital Experience Bench", "Content Service Bench",
+    ],
+    "Business Unit": ["V2Solutions", "Digital Platform", "Sales & Marketing"],
+}
+FIRST_NAMES = ["Aarav", "Priya", "Rahul", "Sneha", "Vikram", "Anjali", "Rohan", "Kavya", "Arjun", "Meera", "John", "Sara"]
+LAST_NAMES = ["Sharma", "Patel", "Iyer", "Khan", "Das", "Reddy", "Nair", "Gupta", "Smith", "Joshi"]
+COMMENT_PHRASES = [
+    "Strong communicator", "Needs upskilling in AWS", "Awaiting client interview", "Good fit for React projects",
+    "On bench since last month", "Released from project", "Shadowing on Salesforce", "Requested location change",
+]
+COLUMNS = ["Employee Name", *COLUMN_VALUES, "RMG Comments"]
+
+QUERIES = [
+    "list all Billable employees in Resource Pool Java",
+    "how many people are On Notice",
+    "show comments for {name}",
+    "which project has the most people on bench and why?",
+]
+# Sent straight to the agents (the local fast paths cannot answer it)
+LLM_QUERY = "show billable employees with their resource pool and project, and explain the split"
+
+# The fake agent runs one real pandas step; the resulting frame reaches the
+# caller through the frame channel, so the answer itself is one sentence.
+FAKE_ACTION = (
+    "Thought: I should filter the dataframe.\n"
+    "Action: python_repl_ast\n"
+    "Action Input: df[df['Billable Status'] == 'Billable'][['Employee Name', 'Resource Pool', 'Project Name']]"
+)
+FAKE_FINAL_ANSWER = "Thought: I now know the final answer.\nFinal Answer: Billable employees with their resource pool and project."
+
+
+def make_fake_llm(callbacks=None):
+    return FakeListChatModel(responses=[FAKE_ACTION, FAKE_FINAL_ANSWER], callbacks=callbacks)
+
+
+class PromptTokenCounter(BaseCallbackHandler):
+    """Estimate tokens sent to and received from the (fake) chat model."""
+
+    def __init__(self):
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.llm_calls = 0
+
+    def on_chat_model_start(self, serialized, messages, **kwargs):
+        self.llm_calls += 1
+        for batch in messages:
+            for message in batch:
+                self.prompt_tokens += estimate_tokens(str(message.content))
+
+    def on_llm_end(self, response, **kwargs):
+        for generations in response.generations:
+            for generation in generations:
+                self.completion_tokens += estimate_tokens(generation.text)
+
+
+# --- Synthetic data ---
+def generate_workbook(rows, path, seed=0):
+    """Write an RMG-shaped workbook with ``rows`` employees (streamed, so 1M rows fit in memory)."""
+    rng = random.Random(seed)
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Sheet1")
+    ws.append(COLUMNS)
+    for i in range(rows):
+        name = f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)} {i}"
+        values = [rng.choice(v) for v in COLUMN_VALUES.values()]
+        comment = f"  {rng.choice(COMMENT_PHRASES)}. {rng.choice(COMMENT_PHRASES)}.  " if rng.random() < 0.4 else None
+        ws.append([f" {name} ", *values, comment])
+    path.parent.mkdir(parents=True, exist_ok=True)
+    wb.save(path)
+    return path
+
+
+def workbook_for(rows, seed=0):
+    path = WORKBOOK_DIR / f"rmg_{rows}_{seed}.xlsx"
+    if not path.exists():
+        generate_workbook(rows, path, seed)
+    return path
+
+
+# --- Measurement ---
+# Rows of the table in the CSV and markdown answers try_parse_csv_or_table is timed on
+ANSWER_ROWS = 200
+
+
+def measure(results, rows, stage, fn, extra=None, setup=None):
+    """Time ``fn`` untraced, then run it again under tracemalloc for its peak memory.
+
+    ``setup`` makes a fresh argument for ``fn`` before each run, outside both
+    measurements, for stages that change their input. ``extra`` sees the
+    value of the timed run.
+    """
+    args = (setup(),) if setup is not None else ()
+    started = time.perf_counter()
+    value = fn(*args)
+    seconds = time.perf_counter() - started
+    record = {"rows": rows, "stage": stage, "seconds": round(seconds, 6)}
+    if extra is not None:
+        record.update(extra(value))
+
+    args = (setup(),) if setup is not None else ()
+    tracemalloc.start()
+    try:
+        fn(*args)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    record["peak_mb"] = round(peak / 2**20, 3)
+    results.append(record)
+    print(f"{rows:>9,} rows  {stage:<28} {seconds:9.4f}s  {record['peak_mb']:9.1f} MB"
+          + (f"  {record['prompt_tokens']:>7} prompt tokens" if "prompt_tokens" in record else "")
+          + (f"  {record['completion_tokens']:>5} completion tokens" if "completion_tokens" in record else ""))
+    return value
+
+
+def bench_size(rows, results, seed=0):
+    path = workbook_for(rows, seed)
+
+    df = measure(results, rows, "read_workbook", lambda: read_workbook(path))
+    raw = df
+    df = measure(results, rows, "infer_numeric_columns", infer_numeric_columns, setup=lambda: raw.copy())
+    text_mb = frame_nbytes(df) / 2**20
+    inferred = df
+    df = measure(
+        results, rows, "compact_dtypes", compact_dtypes, setup=lambda: inferred.copy(),
+        extra=lambda frame: {"frame_mb": round(frame_nbytes(frame) / 2**20, 3), "text_frame_mb": round(text_mb, 3)},
+    )
+    value_dict = measure(results, rows, "build_value_dictionary", lambda: build_value_dictionary(df))
+    index = measure(results, rows, "build_index", lambda: EmployeeIndex(df))
+    counter = PromptTokenCounter()
+    main_agent, comments_agent = measure(
+        results, rows, "create_agents", lambda: create_agents(path, make_fake_llm(callbacks=[counter]))
+    )
+
+    name = df["Employee Name"].iloc[len(df) // 2]
+    for i, template in enumerate(QUERIES):
+        query = template.format(name=name)
+        measure(
+            results, rows, f"get_enriched_prompt[q{i}]",
+            lambda: get_enriched_prompt(query, value_dict),
+            extra=lambda prompt: {"prompt_tokens": estimate_tokens(prompt)},
+        )
+        measure(results, rows, f"answer_from_index[q{i}]", lambda: answer_from_index(query, index))
+        measure(results, rows, f"answer_locally[q{i}]", lambda: answer_locally(query, df, value_dict))
+
+    response = measure(
+        results, rows, "handle_user_query",
+        lambda: handle_user_query(LLM_QUERY, main_agent, comments_agent, value_dict),
+        extra=lambda _: {
+            "prompt_tokens": counter.prompt_tokens,
+            "completion_tokens": counter.completion_tokens,
+            "llm_calls": counter.llm_calls,
+        },
+    )
+    measure(
+        results, rows, "finish_llm_response",
+        lambda: finish_llm_response(LLM_QUERY, {}, response),
+        extra=lambda r: {"table_rows": 0 if r["table"] is None else len(r["table"])},
+    )
+
+    # Answers where the LLM typed the table out itself
+    for kind, text in answer_tables(df).items():
+        measure(
+            results, rows, f"try_parse_csv_or_table[{kind}]",
+            lambda: try_parse_csv_or_table(text),
+            extra=lambda table: {"table_rows": 0 if table is None else len(table)},
+        )
+
+
+def answer_tables(df):
+    """A listing of ``df`` as an LLM writes it out: in a ```csv block and as a markdown table."""
+    table = df[["Employee Name", "Resource Pool", "Billable Status"]].head(ANSWER_ROWS).astype(str)
+    csv_text = f"Here are the employees:\n```csv\n{table.to_csv(index=False)}```"
+    lines = ["| " + " | ".join(table.columns) + " |", "|" + "---|" * table.shape[1]]
+    lines += ["| " + " | ".join(row) + " |" for row in table.itertuples(index=False)]
+    return {"csv": csv_text, "markdown": "\n".join(lines)}
+
+
+def git_version():
+    try:
+        return subprocess.run(
+            ["git", "describe", "--always", "--dirty"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current, previous_path):
+    with open(previous_path) as f:
+        previous = json.load(f)
+    before = {(r["rows"], r["stage"]): r for r in previous["results"]}
+    print(f"\nCompared with {previous_path} ({previous.get('version')}):")
+    for r in current:
+        old = before.get((r["rows"], r["stage"]))
+        if old and old["seconds"] > 0:
+            ratio = r["seconds"] / old["seconds"]
+            flag = "  <-- slower" if ratio > 1.2 else ""
+            print(f"{r['rows']:>9,} rows  {r['stage']:<28} {old['seconds']:9.4f}s -> {r['seconds']:9.4f}s  x{ratio:5.2f}{flag}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmark of the Excel chatbot query path.")
+    parser.add_argument("--rows", type=int, nargs="+", default=DEFAULT_SIZES, help="Workbook sizes to benchmark")
+    parser.add_argument("-o", "--output", default="benchmark_results.json", help="Where to write the JSON results")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the synthetic workbooks")
+    parser.add_argument("--compare", help="Previous results file to compare against")
+    args = parser.parse_args(argv)
+
+    results = []
+    for rows in args.rows:
+        bench_size(rows, results, args.seed)
+
+    report = {
+        "version": git_version(),
+        "created": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nWrote {len(results)} measurements to {args.output}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
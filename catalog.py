@@ -0,0 +1,345 @@
+"""Schema catalog and lazy sheet loading for datasets spanning several sheets and workbooks.
+
+A :class:`WorkbookSet` registers every sheet of every uploaded workbook but
+parses a sheet only when a question needs it. The catalog (columns, dtypes,
+row counts) comes from each sheet's header and first rows, is saved next to
+the workbook's snapshots and drives routing and the prompt's sheet guide.
+When a new version of a known workbook is uploaded, its sheets are refreshed
+from the previous version's snapshots (see :mod:`refresh`).
+"""
+import re
+import threading
+from collections import Counter
+from io import BytesIO
+from pathlib import PurePath
+
+import pandas as pd
+
+from dataset_cache import content_hash, frame_nbytes
+from ingest import RawSheet, compact_dtypes, infer_numeric_columns, read_sheet, scan_sheets, sheet_digests
+from metrics import span
+from refresh import RowDiff, refresh_frame
+from snapshot import (
+    has_snapshot,
+    previous_version,
+    read_catalog,
+    read_snapshot,
+    record_version,
+    write_catalog,
+    write_snapshot,
+)
+from value_dictionary import build_value_dictionary, refresh_value_dictionary
+
+# Rows read per sheet to build the catalog (column dtypes are inferred from them)
+CATALOG_SAMPLE_ROWS = 200
+# Words that never identify a sheet or workbook on their own
+GENERIC_WORDS = {"sheet", "data", "table", "list", "file", "report", "xlsx", "the", "and", "all", "for", "with"}
+# Columns / values shorter than this are not matched against the question
+MIN_MATCH_LEN = 4
+
+
+def _words(text):
+    # Crude singularisation so "skills" finds the "Skill" sheet
+    return {w[:-1] if w.endswith("s") and len(w) > 3 else w for w in re.findall(r"[a-z0-9]+", str(text).lower()) if len(w) > 2}
+
+
+def _mentions(text, phrase):
+    return re.search(r"(?<!\w)" + re.escape(phrase.lower()) + r"(?!\w)", text) is not None
+
+
+def dataset_key(blobs):
+    """Key of a dataset made of one or more workbooks (in upload order)."""
+    return combine_keys([content_hash(data) for data in blobs])
+
+
+def combine_keys(keys):
+    if len(keys) == 1:
+        return keys[0]
+    return content_hash("\0".join(keys).encode("ascii"))
+
+
+def schema_key(catalog):
+    """Key of a workbook's layout (sheet names and columns), shared by its versions."""
+    layout = "\n".join(f"{s['sheet']}\t" + "\t".join(s["columns"]) for s in catalog)
+    return "schema:" + content_hash(layout.encode("utf-8"))
+
+
+def scan_workbook(data):
+    """Catalog entries for every sheet of a workbook, from its header and first rows."""
+    sheets = []
+    digests = sheet_digests(BytesIO(data))
+    for sheet_name, stored_rows, sample in scan_sheets(BytesIO(data), CATALOG_SAMPLE_ROWS):
+        sample = infer_numeric_columns(sample)
+        exact = len(sample) < CATALOG_SAMPLE_ROWS
+        sheets.append({
+            "sheet": sheet_name,
+            "columns": [str(c) for c in sample.columns],
+            "dtypes": {str(c): str(t) for c, t in sample.dtypes.items()},
+            "rows": len(sample) if exact else stored_rows,
+            "rows_exact": exact,
+            "digest": digests.get(sheet_name),
+        })
+    return sheets
+
+
+def _write_fingerprints(raw, rows, key, name):
+    # Only when the fingerprints line up with the parsed frame (header first)
+    if raw.header_is_first_row and len(raw.fingerprints) == rows + 1:
+        write_snapshot(pd.DataFrame({"fingerprint": raw.fingerprints}), key, f"{name}.rows")
+
+
+class WorkbookSet:
+    """Every sheet of one or more workbooks; a sheet is parsed on first use.
+
+    ``files`` is a list of ``(name, bytes)``. With a single workbook sheets
+    are identified by their name, otherwise by ``"<file stem> / <sheet>"``.
+    The first sheet of the first workbook is the primary sheet the default
+    agents, name index and planner work on.
+
+    A workbook's previous version is the last other content uploaded under
+    the same file name or, failing that, with the same sheets and columns.
+    Sheets whose digest did not change are taken over from its snapshots
+    as they are; others are refreshed row by row and ``diffs`` records how.
+    """
+
+    def __init__(self, files):
+        self.files = [{"name": name, "key": content_hash(data), "data": data} for name, data in files]
+        self.key = dataset_key([f["data"] for f in self.files])
+        self.sheets = []
+        for f in self.files:
+            catalog = read_catalog(f["key"])
+            if catalog is None:
+                with span("scan_workbook"):
+                    catalog = scan_workbook(f["data"])
+                write_catalog(catalog, f["key"])
+            layout = schema_key(catalog)
+            f["previous"] = previous_version(f["name"], f["key"]) or previous_version(layout, f["key"])
+            previous_catalog = read_catalog(f["previous"]) if f["previous"] else None
+            f["previous_sheets"] = {s["sheet"]: dict(s, position=i) for i, s in enumerate(previous_catalog or [])}
+            record_version(f["name"], f["key"])
+            record_version(layout, f["key"])
+            for position, entry in enumerate(catalog):
+                sheet_id = entry["sheet"] if len(self.files) == 1 else f"{PurePath(f['name']).stem} / {entry['sheet']}"
+                while any(s["id"] == sheet_id for s in self.sheets):
+                    sheet_id += "'"
+                self.sheets.append(dict(entry, id=sheet_id, workbook=f["name"], workbook_key=f["key"], position=position))
+        self._by_id = {s["id"]: s for s in self.sheets}
+        self._frames = {}
+        self._value_dicts = {}
+        # Sheet id -> RowDiff against the previous version, for sheets refreshed from it
+        self.diffs = {}
+        # One lock per sheet, so parsing one sheet does not hold up questions about the others
+        self._locks = {s["id"]: threading.Lock() for s in self.sheets}
+        # Called after a sheet is loaded, e.g. to re-measure the dataset cache entry
+        self.on_load = None
+
+    @property
+    def primary(self):
+        return self.sheets[0]["id"]
+
+    @property
+    def workbook_keys(self):
+        return {f["key"] for f in self.files}
+
+    @property
+    def previous_key(self):
+        """Dataset key of the previous version (other files as they are), or None."""
+        if not any(f["previous"] for f in self.files):
+            return None
+        return combine_keys([f["previous"] or f["key"] for f in self.files])
+
+    def is_loaded(self, sheet_id):
+        return sheet_id in self._frames
+
+    def changes_pending(self):
+        """Sheets of updated workbooks that may hold new values but have not been refreshed yet."""
+        pending = []
+        for s in self.sheets:
+            f = next(f for f in self.files if f["key"] == s["workbook_key"])
+            if not f["previous"] or s["id"] in self.diffs:
+                continue
+            old = f["previous_sheets"].get(s["sheet"])
+            if old is None or not s.get("digest") or old.get("digest") != s["digest"]:
+                pending.append(s["id"])
+        return pending
+
+    # --- Lazy loading ---
+    def sheet(self, sheet_id):
+        """The parsed sheet, from its snapshot or the workbook on first use."""
+        df = self._frames.get(sheet_id)
+        if df is not None:
+            return df
+        with self._locks[sheet_id]:
+            df = self._frames.get(sheet_id)
+            if df is not None:
+                return df
+            entry = self._by_id[sheet_id]
+            name = f"sheet{entry['position']}"
+            if has_snapshot(entry["workbook_key"], name):
+                with span("read_snapshot"):
+                    df = read_snapshot(entry["workbook_key"], name)
+            else:
+                df = self._refresh(entry)
+            if df is None:
+                data = next(f["data"] for f in self.files if f["key"] == entry["workbook_key"])
+                with span("read_sheet"):
+                    df = read_sheet(BytesIO(data), sheet_name=entry["sheet"])
+                with span("infer_numeric_columns"):
+                    df = infer_numeric_columns(df)
+                with span("compact_dtypes"):
+                    df = compact_dtypes(df)
+                with span("fingerprint_rows"):
+                    raw = RawSheet(BytesIO(data), entry["sheet"], keep_rows=False)
+                with span("write_snapshot"):
+                    write_snapshot(df, entry["workbook_key"], name)
+                    _write_fingerprints(raw, len(df), entry["workbook_key"], name)
+            # The full sheet replaces the sampled schema
+            entry.update(
+                columns=[str(c) for c in df.columns],
+                dtypes={str(c): str(t) for c, t in df.dtypes.items()},
+                rows=len(df),
+                rows_exact=True,
+            )
+            self._frames[sheet_id] = df
+        if self.on_load is not None:
+            self.on_load()
+        return df
+
+    def _refresh(self, entry):
+        # The sheet from its previous version's snapshot plus the rows that changed, or None
+        f = next(f for f in self.files if f["key"] == entry["workbook_key"])
+        old = f["previous_sheets"].get(entry["sheet"])
+        if old is None:
+            return None
+        old_name = f"sheet{old['position']}"
+        if not has_snapshot(f["previous"], old_name):
+            return None
+        name = f"sheet{entry['position']}"
+        has_fingerprints = has_snapshot(f["previous"], f"{old_name}.rows")
+        if entry.get("digest") and old.get("digest") == entry["digest"]:
+            with span("read_snapshot"):
+                df = read_snapshot(f["previous"], old_name)
+                fingerprints = read_snapshot(f["previous"], f"{old_name}.rows") if has_fingerprints else None
+            diff = RowDiff.unchanged(len(df))
+        else:
+            if not has_fingerprints:
+                return None
+            with span("read_snapshot"):
+                previous = read_snapshot(f["previous"], old_name)
+                previous_fingerprints = read_snapshot(f["previous"], f"{old_name}.rows")["fingerprint"].to_numpy()
+            with span("fingerprint_rows"):
+                raw = RawSheet(BytesIO(f["data"]), entry["sheet"], previous_fingerprints)
+            with span("refresh_rows"):
+                refreshed = refresh_frame(raw, previous, previous_fingerprints)
+            if refreshed is None:
+                return None
+            df, diff = refreshed
+            fingerprints = pd.DataFrame({"fingerprint": raw.fingerprints})
+        with span("write_snapshot"):
+            write_snapshot(df, entry["workbook_key"], name)
+            if fingerprints is not None:
+                write_snapshot(fingerprints, entry["workbook_key"], f"{name}.rows")
+        self.diffs[entry["id"]] = diff
+        return df
+
+    def value_dict(self, sheet_id, previous=None):
+        """Value dictionary of a sheet; ``previous`` (the previous version's) is refreshed when the sheet was."""
+        if sheet_id in self._value_dicts:
+            return self._value_dicts[sheet_id]
+        df = self.sheet(sheet_id)
+        with self._locks[sheet_id]:
+            if sheet_id not in self._value_dicts:
+                diff = self.diffs.get(sheet_id)
+                with span("build_value_dictionary"):
+                    if previous is not None and diff is not None:
+                        self._value_dicts[sheet_id] = refresh_value_dictionary(previous, df, diff)
+                    else:
+                        self._value_dicts[sheet_id] = build_value_dictionary(df)
+            return self._value_dicts[sheet_id]
+
+    def nbytes(self):
+        frames = sum(frame_nbytes(df) for df in list(self._frames.values()))
+        return frames + sum(len(f["data"]) for f in self.files)
+
+    # --- Routing and prompting ---
+    def route(self, query):
+        """Sheets a question touches, in catalog order.
+
+        A sheet is picked when the question names it (or its workbook) or
+        mentions a column only that sheet has. The primary sheet joins the
+        pick when the question also mentions one of its columns or values;
+        if nothing matches, the question goes to the primary sheet alone.
+        """
+        if len(self.sheets) == 1:
+            return [self.primary]
+        text = query.lower()
+        words = _words(query)
+
+        named_files = set()
+        if len(self.files) > 1:
+            # Only the part of a file name that differs between files ("march" in rmg_march.xlsx)
+            file_words = {f["key"]: _words(PurePath(f["name"]).stem) - GENERIC_WORDS for f in self.files}
+            shared = set.intersection(*file_words.values())
+            named_files = {key for key, fw in file_words.items() if (fw - shared) & words}
+        candidates = [s for s in self.sheets if not named_files or s["workbook_key"] in named_files]
+
+        # Sheet-name words shared by most sheets ("Employee ...") say nothing
+        name_counts = Counter(w for s in self.sheets for w in _words(s["sheet"]))
+        common = {w for w, n in name_counts.items() if n > 1 and n >= len(self.sheets) / 2}
+        column_counts = Counter(c.lower() for s in self.sheets for c in set(s["columns"]))
+
+        picked = []
+        for s in candidates:
+            by_name = bool((_words(s["sheet"]) - GENERIC_WORDS - common) & words)
+            by_column = any(
+                column_counts[c.lower()] == 1 and len(c) >= MIN_MATCH_LEN and _mentions(text, c) for c in s["columns"]
+            )
+            if by_name or by_column:
+                picked.append(s["id"])
+
+        if not picked:
+            if named_files:
+                # The first sheet of each workbook the question names
+                return [s["id"] for s in candidates if s["position"] == 0]
+            return [self.primary]
+        if self.primary not in picked and not named_files and self._mentions_primary(text):
+            picked.insert(0, self.primary)
+        return picked
+
+    def _mentions_primary(self, text):
+        primary = self._by_id[self.primary]
+        if any(len(c) >= MIN_MATCH_LEN and _mentions(text, c) for c in primary["columns"]):
+            return True
+        if not self.is_loaded(self.primary):
+            return False
+        for values in self.value_dict(self.primary).values():
+            if any(len(v) >= MIN_MATCH_LEN and _mentions(text, v) for v in values):
+                return True
+        return False
+
+    def describe(self, sheet_ids):
+        """Prompt text mapping ``df1``..``dfN`` of a multi-sheet agent to their sheets."""
+        lines = [f"The data spans {len(sheet_ids)} sheet(s), available in python as " +
+                 ", ".join(f"df{i}" for i in range(1, len(sheet_ids) + 1)) + ":"]
+        for i, sheet_id in enumerate(sheet_ids, start=1):
+            s = self._by_id[sheet_id]
+            rows = f"{s['rows']:,} rows" if s["rows"] is not None else "row count unknown"
+            lines.append(f"- df{i} = sheet \"{s['sheet']}\" of {s['workbook']} ({rows}); columns: {', '.join(s['columns'])}")
+        if len(sheet_ids) > 1:
+            shared = set(self._by_id[sheet_ids[0]]["columns"]).intersection(*(self._by_id[i]["columns"] for i in sheet_ids[1:]))
+            if shared:
+                lines.append(f"Join sheets on their shared columns ({', '.join(sorted(shared))}) when the question needs more than one.")
+        return "\n".join(lines)
+
+    def summary(self):
+        """One row per registered sheet, for display."""
+        return [
+            {
+                "sheet": s["id"],
+                "workbook": s["workbook"],
+                "rows": s["rows"],
+                "columns": len(s["columns"]),
+                "loaded": self.is_loaded(s["id"]),
+            }
+            for s in self.sheets
+        ]
@@ -0,0 +1,581 @@
+import os
+import random
+import re
+import threading
+import time
+from contextlib import closing, contextmanager
+from pathlib import Path
+
+import pandas as pd
+from langchain_experimental.agents.agent_toolkits import create_pandas_dataframe_agent
+from langchain_google_genai import ChatGoogleGenerativeAI
+
+from agent_pool import AgentPool
+from aggregates import AggregateCubes
+from catalog import WorkbookSet, dataset_key
+from dataset_cache import DatasetCache
+from frame_channel import FrameCollector, capture_frames, resolve_table
+from ingest import compact_dtypes, infer_numeric_columns, read_sheet
+from metrics import MetricsCallbackHandler, span, trace_query
+from name_index import EmployeeIndex, answer_from_index
+from query_planner import NARRATION_WORDS, answer_locally, describe_filters, plan_query
+from response_cache import ResponseCache
+from snapshot import prune_snapshots
+from streaming import stream_agent_run
+from value_dictionary import format_guide, select_guide
+
+# Query path shared by the Streamlit app and headless entry points (batch runs).
+# Nothing in here touches Streamlit.
+
+LLM_MODEL = os.getenv("LLM_MODEL", "gemini-2.5-flash-preview-05-20")
+# Bump whenever get_enriched_prompt changes so stale cached answers are not reused.
+PROMPT_TEMPLATE_VERSION = "5"
+
+# --- Dataset Cache Settings ---
+# Upper bound for parsed workbooks kept in memory across reruns and sessions.
+DATASET_CACHE_MAX_MB = int(os.getenv("DATASET_CACHE_MAX_MB", "512"))
+# Workbooks nobody asked about for this long are dropped from memory; 0 keeps them
+DATASET_IDLE_MINUTES = float(os.getenv("DATASET_IDLE_MINUTES", "30"))
+
+# --- Response Cache Settings ---
+RESPONSE_CACHE_PATH = Path(os.getenv("RESPONSE_CACHE_PATH", "response_cache.sqlite3"))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "5000"))
+RESPONSE_CACHE_TTL_HOURS = float(os.getenv("RESPONSE_CACHE_TTL_HOURS", "168"))
+
+# Output of an agent that gave up (iteration or time limit) instead of answering
+AGENT_STOPPED_PREFIX = "Agent stopped due to"
+
+# --- Multi-Sheet Settings ---
+# Agents kept per dataset for questions spanning other sheets (one per sheet combination)
+SHEET_AGENTS_MAX = int(os.getenv("SHEET_AGENTS_MAX", "8"))
+
+# --- Agent Pool Settings ---
+# Questions about one dataset that can run on the agents at the same time
+AGENT_POOL_SIZE = int(os.getenv("AGENT_POOL_SIZE", "4"))
+
+
+def make_dataset_cache():
+    return DatasetCache(max_bytes=DATASET_CACHE_MAX_MB * 1024 * 1024, idle_seconds=DATASET_IDLE_MINUTES * 60)
+
+
+def make_response_cache():
+    return ResponseCache(
+        RESPONSE_CACHE_PATH,
+        PROMPT_TEMPLATE_VERSION,
+        max_entries=RESPONSE_CACHE_MAX_ENTRIES,
+        ttl_seconds=RESPONSE_CACHE_TTL_HOURS * 3600,
+    )
+
+
+# Text columns with few distinct values are categoricals in the frames the agents work on
+CATEGORICAL_HINT = (
+    "Text columns with few distinct values are pandas categoricals: use .astype(str) on them before "
+    "fillna with a new value, string concatenation or assigning new text, and count distinct values "
+    "with .nunique() rather than len(value_counts()).\n"
+)
+
+
+# Define helper functions
+def get_enriched_prompt(query, value_dict=None, sheet_guide=None):
+    query_lower = query.lower()
+
+    # Keywords that *strongly* imply needing tabular output
+    csv_keywords = ["list", "show", "filter", "table", "display", "all employees", "summary of", "csv","tabular", "structured", "answer in table format", "answer in csv format", "answer in tabular format", "answer in structured format"]
+
+
+    # Only the columns/values relevant to this query, within the token budget
+    guide_text = format_guide(select_guide(query, value_dict or {}))
+    # Which df1..dfN holds which sheet, for questions spanning several sheets
+    if sheet_guide:
+        guide_text = f"{sheet_guide}\n{guide_text}"
+    guide_text = f"{CATEGORICAL_HINT}{guide_text}"
+
+    if any(kw in query_lower for kw in csv_keywords):
+        context = (
+            "You are a data analyst with access to a dataset. "
+            "Compute the result with the python tool so that the last expression is the resulting DataFrame "
+            "(only the columns the user needs). The tool shows the full table to the user and replies with a table id. "
+            "Do NOT retype the rows as CSV or markdown. "
+            "Your Final Answer must be one short sentence summarizing the result followed by the table id, "
+            "e.g. `Final Answer: 12 employees are on bench in Java. [table: T1]`\n"
+            "Ensure exact matching by converting both dataset and input to lowercase and removing whitespace.\n"
+            f"{guide_text}\n\n"
+
+        )
+    else:
+        context = (
+            "You are a data analyst with access to a dataset. "
+            "Respond to the user's query in natural language. "
+            "If My Query asks for comment.**return the full comment exactly as it appears in the data without any truncation or summarization.**. Do not add your own explanation. Just return the full comment."
+            "Ensure exact match filtering where possible by converting both dataset values and user inputs to lowercase and trimming whitespace."
+            "Only use CSV format if the user explicitly asks for tabular or structured output."
+            "If a table the python tool returned answers the question, cite its id like [table: T1] instead of copying its rows."
+            f"{guide_text}\n\n"
+
+        )
+
+    return f"{context}\n\nUser Query: {query}"
+
+
+
+# Breakdown questions that need interpreting get the exact figures from the cubes
+# and a single LLM call to put them into words, instead of an agent run.
+NARRATION_PROMPT = (
+    "You are a data analyst. The figures below were computed exactly from the full dataset "
+    "({condition}). Do not recompute, estimate or invent numbers.\n\n"
+    "{figures}\n\n"
+    "Answer the user's question in a few sentences using only these figures.\n\n"
+    "User Query: {query}"
+)
+
+
+def read_workbook(excel_file):
+    # Streams the first sheet in chunks and strips whitespace column-wise
+    with span("read_workbook"):
+        return read_sheet(excel_file)
+
+
+def create_agents(excel_file, llm=None):
+    return build_agents(compact_dtypes(infer_numeric_columns(read_workbook(excel_file))), llm)
+
+
+def make_llm(llm=None):
+    return llm if llm is not None else ChatGoogleGenerativeAI(model=LLM_MODEL)
+
+
+def build_agents(df, llm=None):
+    with span("create_agents"):
+        return _build_agents(df, llm)
+
+
+def _build_agents(df, llm=None):
+    # Agents work on in-memory frames; no temporary CSVs are written
+    df_main = df.drop(columns=['RMG Comments'], errors='ignore')
+    df_comments = df[['Employee Name', 'RMG Comments']] if 'RMG Comments' in df.columns else pd.DataFrame()
+
+    # Initialize LLM
+    llm = make_llm(llm)
+
+    # Create agents
+    main_agent = create_pandas_dataframe_agent(
+        llm, df_main, verbose=True, allow_dangerous_code=True
+    )
+    comments_agent = None
+    if not df_comments.empty:
+        comments_agent = create_pandas_dataframe_agent(
+            llm, df_comments, verbose=True, allow_dangerous_code=True
+        )
+
+    # DataFrame results reach the caller directly instead of being retyped by the LLM
+    capture_frames(main_agent)
+    if comments_agent is not None:
+        capture_frames(comments_agent)
+
+    return main_agent, comments_agent
+
+
+# --- Load Workbooks (once per distinct content) ---
+def load_dataset_files(files, dataset_cache, response_cache=None, llm=None, pool_size=None):
+    """Register every sheet of the uploaded workbooks and build the default agents.
+
+    ``files`` is a list of ``(name, bytes)``. Only the primary sheet (the
+    first sheet of the first workbook) is parsed here; other sheets are
+    parsed when a question touches them. ``pool_size`` (default
+    ``AGENT_POOL_SIZE``) caps the agent runs on the dataset at one time.
+    """
+    files = list(files)
+    key = dataset_key([data for _, data in files])
+    name = ", ".join(file_name for file_name, _ in files)
+    pool_size = pool_size or AGENT_POOL_SIZE
+
+    def build():
+        workbooks = WorkbookSet(files)
+        # Parsed once per workbook content; after that (eviction, restart) read from its snapshot
+        df = workbooks.sheet(workbooks.primary)
+        prune_snapshots(keep=workbooks.workbook_keys)
+        llm_ = make_llm(llm)
+        # Every session asking about this dataset shares these agents and the frame under them
+        agents = AgentPool(lambda: build_agents(df, llm_), max_size=pool_size)
+        agents.prime()
+
+        # A refreshed version reuses the previous version's index, cubes and value dictionary
+        diff = workbooks.diffs.get(workbooks.primary)
+        previous = dataset_cache.peek(workbooks.previous_key) if diff is not None and workbooks.previous_key else None
+        if previous is not None and len(previous["df"]) != diff.old_rows:
+            previous = None
+        value_dict = workbooks.value_dict(workbooks.primary, previous["value_dict"] if previous else None)
+        if previous is not None:
+            with span("refresh_index"):
+                index = previous["index"].refreshed(df, diff)
+            with span("refresh_cubes"):
+                cubes = previous["cubes"].refreshed(df, value_dict, diff)
+        else:
+            with span("build_index"):
+                index = EmployeeIndex(df)
+            with span("build_cubes"):
+                cubes = AggregateCubes(df, value_dict)
+
+        if response_cache is not None:
+            # Cached answers the changed rows cannot affect stay valid for the new version
+            if diff is not None and not workbooks.changes_pending():
+                response_cache.carry_over(workbooks.previous_key, key, lambda reads: not diff.affects(reads))
+            # A new version of a known workbook drops the answers cached for the old one
+            response_cache.register_workbook(name, key)
+        workbooks.on_load = lambda: dataset_cache.resize(key)
+        return {
+            "key": key,
+            "name": name,
+            "df": df,
+            "value_dict": value_dict,
+            "index": index,
+            "cubes": cubes,
+            "agents": agents,
+            "pool_size": pool_size,
+            "workbooks": workbooks,
+            "refresh": diff.summary() if diff is not None else None,
+            "nbytes": lambda: workbooks.nbytes() + cubes.nbytes(),
+            "llm": llm_,
+            "sheet_agents": {},
+            "lock": threading.Lock(),
+        }
+
+    return dataset_cache.get_or_build(key, build)
+
+
+def load_dataset_bytes(data, name, dataset_cache, response_cache=None, llm=None, pool_size=None):
+    """Single-workbook shortcut for :func:`load_dataset_files`."""
+    return load_dataset_files([(name, data)], dataset_cache, response_cache, llm, pool_size)
+
+
+# --- Sheet Routing ---
+def sheets_for_query(query, dataset):
+    """Sheets the question needs beyond the primary one, or None when the primary sheet suffices."""
+    workbooks = dataset.get("workbooks")
+    if workbooks is None:
+        return None
+    sheets = workbooks.route(query)
+    return None if sheets == [workbooks.primary] else sheets
+
+
+def build_sheet_agent(llm, frames):
+    with span("create_agents"):
+        agent = create_pandas_dataframe_agent(llm, frames, verbose=True, allow_dangerous_code=True)
+    return capture_frames(agent)
+
+
+def sheet_agents(dataset, sheets):
+    """Agent pool over ``sheets`` (as df1..dfN), parsing them and creating it on first use."""
+    key = tuple(sheets)
+    with dataset["lock"]:
+        pool = dataset["sheet_agents"].get(key)
+    if pool is None:
+        # Parsed outside the dataset's lock: questions about other sheets go on meanwhile
+        frames = [dataset["workbooks"].sheet(sheet_id) for sheet_id in sheets]
+        llm = dataset["llm"]
+        pool = AgentPool(lambda: build_sheet_agent(llm, frames), max_size=dataset["pool_size"])
+    with dataset["lock"]:
+        # A pool another question published meanwhile wins, so both share its agents
+        pool = dataset["sheet_agents"].pop(key, pool)
+        # Most recently used last; the oldest combination goes first
+        dataset["sheet_agents"][key] = pool
+        while len(dataset["sheet_agents"]) > SHEET_AGENTS_MAX:
+            dataset["sheet_agents"].pop(next(iter(dataset["sheet_agents"])))
+    return pool
+
+
+@contextmanager
+def checkout_agents(query, dataset):
+    """Hold ``(main_agent, comments_agent, value_dict, sheet_guide)`` for one handle_user_query call."""
+    sheets = sheets_for_query(query, dataset)
+    if sheets is None:
+        with dataset["agents"].checkout() as (main_agent, comments_agent):
+            yield main_agent, comments_agent, dataset["value_dict"], None
+        return
+    workbooks = dataset["workbooks"]
+    pool = sheet_agents(dataset, sheets)
+    value_dict = {}
+    for sheet_id in sheets:
+        value_dict.update(workbooks.value_dict(sheet_id))
+    with pool.checkout() as agent:
+        yield agent, agent, value_dict, workbooks.describe(sheets)
+
+# def handle_user_query(query, main_agent, comments_agent):
+#     final_query = get_enriched_prompt(query)
+#     agent = comments_agent if ('comment' in query.lower() or 'feedback' in query.lower()) else main_agent
+
+#     try:
+#         return agent.run(final_query)
+#     except ValueError as e:
+#         error_text = str(e)
+#         if "Could not parse LLM output:" in error_text:
+#             summary = error_text.split("Could not parse LLM output:", 1)[-1].strip()
+#             return f"[Summary Fallback] {summary}"
+#         else:
+#             raise e
+        
+
+# --- Answer a Query (local fast paths, then cached answers, then the LLM agents) ---
+def answer_without_llm(query, dataset, response_cache=None):
+    # The index and planner only know the primary sheet
+    if sheets_for_query(query, dataset) is None:
+        # Exact name lookups and comment retrieval
+        with span("answer_from_index"):
+            response = answer_from_index(query, dataset["index"])
+        if response is not None:
+            return response
+        # Simple filter/list/count questions (counts straight from the cubes)
+        with span("answer_locally"):
+            response = answer_locally(query, dataset["df"], dataset["value_dict"], dataset.get("cubes"))
+        if response is not None:
+            return response
+    if response_cache is not None:
+        with span("response_cache"):
+            return response_cache.get(dataset["key"], query)
+    return None
+
+
+def cube_breakdown(query, dataset):
+    """Exact figures from the cubes for a breakdown question that also asks for interpretation, or None."""
+    cubes = dataset.get("cubes")
+    if cubes is None or sheets_for_query(query, dataset) is not None:
+        return None
+    plan = plan_query(query, list(dataset["df"].columns), dataset["value_dict"], narration_words=NARRATION_WORDS)
+    if plan is None or not plan["narrate"]:
+        return None
+    response = cubes.answer(plan)
+    if response is None:
+        return None
+    response["condition"] = describe_filters(plan["filters"]) or "all rows"
+    # The columns the figures depend on, so a refresh knows when they go stale
+    response["reads"] = [*plan["filters"], *plan["group_by"]]
+    return response
+
+
+def stream_narration(query, dataset, breakdown, callbacks=None):
+    """Yield the LLM's wording of ``breakdown`` chunk by chunk."""
+    figures = breakdown["table"].to_csv(index=False) if breakdown["table"] is not None else breakdown["result"]
+    prompt = NARRATION_PROMPT.format(condition=breakdown["condition"], figures=figures, query=query)
+    with span("narrate"):
+        for chunk in dataset["llm"].stream(prompt, config={"callbacks": [MetricsCallbackHandler(), *(callbacks or [])]}):
+            if isinstance(chunk.content, str) and chunk.content:
+                yield chunk.content
+
+
+def finish_narration(query, dataset, breakdown, text, response_cache=None):
+    response = {
+        "result": clean_llm_output(text),
+        "is_structured": breakdown["table"] is not None,
+        "table": breakdown["table"],
+        "source": "cube+llm",
+    }
+    if response_cache is not None:
+        response_cache.put(dataset["key"], query, response, reads=breakdown["reads"])
+    return response
+
+
+def finish_llm_response(query, dataset, response, response_cache=None):
+    # Only real answers are cached; a parse fallback or a stopped agent may well succeed next time
+    failed = response.get("failed") or str(response["result"]).startswith(AGENT_STOPPED_PREFIX)
+    frames = response.get("frames") or {}
+    with span("clean_llm_output"):
+        result, table = resolve_table(clean_llm_output(response["result"]), frames)
+    if table is None:
+        # The LLM typed the table out itself
+        with span("try_parse_csv_or_table"):
+            table = try_parse_csv_or_table(result)
+    if table is None and response["is_structured"] and frames:
+        table = next(reversed(frames.values()))
+    if not result and table is not None:
+        result = f"Table with {len(table)} rows."
+    response = {
+        "result": result,
+        "is_structured": response["is_structured"],
+        "table": table,
+        "source": "llm",
+    }
+    if response_cache is not None and not failed:
+        response_cache.put(dataset["key"], query, response)
+    return response
+
+
+def answer_query(query, dataset, response_cache=None, callbacks=None, retries=0, backoff=1.0):
+    """Answer one question; ``response["metrics"]`` holds its stage breakdown.
+
+    Runs :func:`answer_query_stream` to the end, so both take the same path.
+    """
+    for event in answer_query_stream(query, dataset, response_cache, callbacks, retries, backoff):
+        if event["type"] == "final":
+            return event["response"]
+
+
+def answer_query_stream(query, dataset, response_cache=None, callbacks=None, retries=0, backoff=1.0):
+    """Answer one question, yielding agent events while the LLM works.
+
+    The last event is ``{"type": "final", "response": ...}``;
+    ``response["metrics"]`` holds the stage breakdown and
+    ``response["attempts"]`` the LLM attempts made. ``callbacks`` are extra
+    callback handlers for every LLM call (the batch rate limit). A failed
+    LLM attempt is retried up to ``retries`` times with exponential backoff;
+    events of a failed attempt have already been yielded.
+    """
+    attempts = 0
+    with trace_query(query) as trace:
+        response = answer_without_llm(query, dataset, response_cache)
+        # Breakdowns the cubes cover only need one LLM call for the wording
+        breakdown = cube_breakdown(query, dataset) if response is None else None
+        while response is None:
+            attempts += 1
+            try:
+                if breakdown is not None:
+                    text = ""
+                    for chunk in stream_narration(query, dataset, breakdown, callbacks):
+                        text += chunk
+                        yield {"type": "token", "text": chunk}
+                    response = finish_narration(query, dataset, breakdown, text, response_cache)
+                else:
+                    # Closing the stream early stops the agent before it goes back to the pool
+                    with checkout_agents(query, dataset) as agents, \
+                            closing(stream_user_query(query, *agents, callbacks=callbacks)) as events:
+                        for event in events:
+                            if event["type"] == "final":
+                                response = finish_llm_response(query, dataset, event["response"], response_cache)
+                            else:
+                                yield event
+            except Exception:
+                if attempts > retries:
+                    raise
+                # Exponential backoff with jitter so parallel workers do not retry in lockstep
+                time.sleep(backoff * 2 ** (attempts - 1) * (1 + random.random()))
+        trace.source = response["source"]
+    response["metrics"] = trace.to_dict()
+    response["attempts"] = attempts
+    yield {"type": "final", "response": response}
+
+
+# --- Run Query + Detect Intent ---
+def route_query(query, main_agent, comments_agent, value_dict=None, sheet_guide=None):
+    with span("get_enriched_prompt"):
+        final_query = get_enriched_prompt(query, value_dict, sheet_guide)
+    use_comments = 'comment' in query.lower() or 'feedback' in query.lower()
+    is_structured = any(kw in query.lower() for kw in ["list", "table", "csv", "show", "display", "filter"])
+
+    agent = comments_agent if use_comments else main_agent
+    return agent, final_query, is_structured
+
+
+def parse_failure_summary(error):
+    error_text = str(error)
+    if "Could not parse LLM output:" in error_text:
+        return error_text.split("Could not parse LLM output:", 1)[-1].strip()
+    return None
+
+
+def handle_user_query(query, main_agent, comments_agent, value_dict=None, sheet_guide=None, callbacks=None):
+    agent, final_query, is_structured = route_query(query, main_agent, comments_agent, value_dict, sheet_guide)
+
+    collector = FrameCollector()
+    try:
+        with span("agent.run"):
+            result = agent.run(final_query, callbacks=[MetricsCallbackHandler(), collector, *(callbacks or [])])
+        return {"result": result, "is_structured": is_structured, "frames": collector.frames}
+    except ValueError as e:
+        summary = parse_failure_summary(e)
+        if summary is not None:
+            return {"result": summary, "is_structured": False, "failed": True}
+        else:
+            raise e
+
+
+def stream_user_query(query, main_agent, comments_agent, value_dict=None, sheet_guide=None, callbacks=None):
+    """Streaming variant of handle_user_query.
+
+    Yields ``step``/``observation``/``token`` events as the agent works and
+    finally ``{"type": "final", "response": ...}`` with the dict
+    handle_user_query would have returned.
+    """
+    agent, final_query, is_structured = route_query(query, main_agent, comments_agent, value_dict, sheet_guide)
+
+    collector = FrameCollector()
+    try:
+        with span("agent.run"), closing(stream_agent_run(agent, final_query, callbacks=[MetricsCallbackHandler(), collector, *(callbacks or [])])) as events:
+            for event in events:
+                if event["type"] == "final":
+                    output = event["output"]
+                else:
+                    yield event
+        yield {"type": "final", "response": {"result": output, "is_structured": is_structured, "frames": collector.frames}}
+    except ValueError as e:
+        summary = parse_failure_summary(e)
+        if summary is not None:
+            yield {"type": "final", "response": {"result": summary, "is_structured": False, "failed": True}}
+        else:
+            raise e
+
+
+# def try_parse_csv(text):
+#     try:
+#         # Try reading entire response as CSV
+#         df = pd.read_csv(StringIO(text))
+#         if df.shape[1] > 1:
+#             return df
+#     except Exception:
+#         pass
+
+#     # Try extracting a CSV block
+#     csv_block = re.search(r"((?:[^\n]*,)+[^\n]*\n(?:.*\n?)+)", text)
+#     if csv_block:
+#         try:
+#             df = pd.read_csv(StringIO(csv_block.group(1)))
+#             if df.shape[1] > 1:
+#                 return df
+#         except Exception:
+#             pass
+#     return None
+def try_parse_csv_or_table(text):
+    from io import StringIO
+
+    # Try CSV code block
+    csv_block = re.search(r"```csv\n(.*?)```", text, re.DOTALL)
+    if csv_block:
+        try:
+            return pd.read_csv(StringIO(csv_block.group(1)))
+        except Exception:
+            pass
+
+    # Try plain CSV (markdown tables have no commas and would parse as one column)
+    if not text.lstrip().startswith("|"):
+        try:
+            df = pd.read_csv(StringIO(text))
+            if not df.empty and df.shape[1] > 0:
+                return df
+        except Exception:
+            pass
+
+    # Try markdown table (e.g. | Employee Name | ...)
+    try:
+        lines = text.strip().splitlines()
+        table_lines = [line for line in lines if '|' in line and not line.strip().startswith("#")]
+        # Drop the |---|---| separator row
+        table_lines = [line for line in table_lines if not re.fullmatch(r"[\s|:\-]+", line)]
+        if len(table_lines) >= 2:
+            raw_table = '\n'.join(table_lines)
+            df = pd.read_csv(StringIO(raw_table), sep="|", engine="python", skipinitialspace=True)
+            df = df.dropna(axis=1, how='all')  # Drop empty columns created by separators
+            df.columns = [col.strip() for col in df.columns]
+            df = df.map(lambda x: x.strip() if isinstance(x, str) else x)
+            return df
+    except Exception:
+        pass
+
+    return None
+
+
+
+# --- Cleanup Output ---
+def clean_llm_output(text: str) -> str:
+    text = text.replace("[Summary Fallback]", "").strip()
+    text = text.replace(
+        "For troubleshooting, visit: https://python.langchain.com/docs/troubleshooting/errors/OUTPUT_PARSING_FAILURE",
+        ""
+    ).strip()
+    return text
@@ -0,0 +1,183 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+
+def content_hash(data: bytes) -> str:
+    """Stable key for an uploaded workbook, independent of its file name."""
+    return hashlib.sha256(data).hexdigest()
+
+
+def frame_nbytes(df) -> int:
+    if df is None:
+        return 0
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+def entry_nbytes(entry) -> int:
+    # Entries that grow after they are built (lazily loaded sheets) report their own size
+    nbytes = entry.get("nbytes")
+    if callable(nbytes):
+        return nbytes()
+    return frame_nbytes(entry.get("df"))
+
+
+class DatasetCache:
+    """Process-wide LRU of ingested workbooks, bounded by approximate memory use.
+
+    Each entry is a dict holding at least ``df`` plus whatever the builder
+    attaches to it (agents, indexes, ...). Entries are keyed by the content
+    hash of the uploaded bytes, so re-uploading the same file or asking a
+    follow-up question never re-parses the workbook. With ``idle_seconds``
+    set, entries nobody asked for in that long are dropped as well (see
+    :meth:`evict_idle`).
+    """
+
+    def __init__(self, max_bytes: int, idle_seconds=None):
+        self.max_bytes = max_bytes
+        self.idle_seconds = idle_seconds or None
+        self._entries = OrderedDict()
+        self._sizes = {}
+        self._accessed = {}
+        self._lock = threading.RLock()
+        self._building = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    @property
+    def total_bytes(self) -> int:
+        with self._lock:
+            return sum(self._sizes.values())
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self._accessed[key] = time.monotonic()
+                self.hits += 1
+            return entry
+
+    def peek(self, key):
+        """The entry for ``key`` without counting a hit or refreshing its recency."""
+        with self._lock:
+            return self._entries.get(key)
+
+    def put(self, key, entry):
+        size = entry_nbytes(entry)
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            self._sizes[key] = size
+            self._accessed[key] = time.monotonic()
+            self._evict(keep=key)
+        self.evict_idle()
+        return entry
+
+    def get_or_build(self, key, builder):
+        """Return the cached entry for ``key``, calling ``builder()`` once on a miss.
+
+        Concurrent callers asking for the same key wait for the first build
+        instead of parsing the workbook in parallel.
+        """
+        entry = self.get(key)
+        if entry is not None:
+            return entry
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self._accessed[key] = time.monotonic()
+                self.hits += 1
+                return entry
+            event = self._building.get(key)
+            owner = event is None
+            if owner:
+                event = self._building[key] = threading.Event()
+                self.misses += 1
+
+        if not owner:
+            event.wait()
+            entry = self.get(key)
+            if entry is not None:
+                return entry
+            return self.get_or_build(key, builder)
+
+        try:
+            return self.put(key, builder())
+        finally:
+            with self._lock:
+                self._building.pop(key, None)
+            event.set()
+
+    def resize(self, key):
+        """Re-measure an entry that grew (e.g. loaded another sheet) and evict others if needed."""
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None:
+            return
+        size = entry_nbytes(entry)
+        with self._lock:
+            if key in self._entries:
+                self._sizes[key] = size
+                self._evict(keep=key)
+
+    def discard(self, key):
+        with self._lock:
+            self._sizes.pop(key, None)
+            self._accessed.pop(key, None)
+            return self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._sizes.clear()
+            self._accessed.clear()
+
+    def describe(self):
+        """``(key, entry, bytes, idle seconds)`` for every entry, least recently used first."""
+        now = time.monotonic()
+        with self._lock:
+            return [(key, entry, self._sizes.get(key, 0), now - self._accessed.get(key, now))
+                    for key, entry in self._entries.items()]
+
+    def evict_idle(self):
+        """Drop entries not used for ``idle_seconds``; returns their keys."""
+        if not self.idle_seconds:
+            return []
+        cutoff = time.monotonic() - self.idle_seconds
+        with self._lock:
+            # Least recently used first, so the scan stops at the first recent entry
+            idle = []
+            for key in self._entries:
+                if self._accessed.get(key, 0) > cutoff:
+                    break
+                idle.append(key)
+            for key in idle:
+                self._drop(key)
+        return idle
+
+    def _drop(self, key):
+        self._entries.pop(key, None)
+        self._sizes.pop(key, None)
+        self._accessed.pop(key, None)
+        self.evictions += 1
+
+    def _evict(self, keep=None):
+        # The newest entry is always kept, even if it alone exceeds the budget.
+        while sum(self._sizes.values()) > self.max_bytes and len(self._entries) > 1:
+            oldest = next(iter(self._entries))
+            if oldest == keep:
+                break
+            self._drop(oldest)
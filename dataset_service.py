@@ -0,0 +1,390 @@
+"""Dataset service shared by every Streamlit session and headless client.
+
+Each workbook is loaded once per process, whoever uploads it: sessions
+asking about the same content share one read-only frame, its index and
+cubes, and a pool of agents over it (see :mod:`agent_pool`). The whole
+process stays within ``DATASET_CACHE_MAX_MB``; workbooks nobody asked about
+for ``DATASET_IDLE_MINUTES`` are dropped before that.
+
+:class:`DatasetService` runs inside the calling process. To share one copy
+between several app servers and scripts, run it as a separate local process
+
+    python dataset_service.py --port 8765
+
+and set ``DATASET_SERVICE_URL=http://127.0.0.1:8765``: :func:`make_service`
+then returns a :class:`ServiceClient`, which has the same methods. The HTTP
+API (JSON; ``key`` is the dataset key returned when loading):
+
+    POST   /datasets               {"files": [{"name": ..., "data": <base64>}]} or {"paths": [...]}
+                                   (paths only within DATASET_SERVICE_DATA_DIR)
+    GET    /datasets               loaded datasets
+    GET    /datasets/<key>         one dataset (404 when not loaded)
+    GET    /datasets/<key>/memory  bytes per column of its primary sheet
+    DELETE /datasets/<key>
+    POST   /datasets/<key>/query   {"query": ..., "stream": false}; streamed answers are JSON lines
+    GET    /stats
+"""
+import argparse
+import base64
+import binascii
+import json
+import os
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+from pathlib import Path
+from urllib.parse import quote, urlsplit
+
+import pandas as pd
+
+from catalog import dataset_key
+from chat_engine import answer_query, answer_query_stream, load_dataset_files, make_dataset_cache, make_response_cache
+from ingest import memory_report
+from metrics import start_metrics_server
+
+# --- Service Settings ---
+# Use a dataset service running in another local process instead of an in-process one
+DATASET_SERVICE_URL = os.getenv("DATASET_SERVICE_URL")
+DATASET_SERVICE_PORT = int(os.getenv("DATASET_SERVICE_PORT", "8765"))
+# Directory whose workbooks HTTP clients may load by path; unset, they must send the files
+DATASET_SERVICE_DATA_DIR = os.getenv("DATASET_SERVICE_DATA_DIR")
+# How often idle datasets are looked for
+IDLE_SWEEP_SECONDS = 60
+
+
+class DatasetNotLoaded(KeyError):
+    """The dataset key is unknown, or the dataset was evicted; load the workbooks again."""
+
+    def __str__(self):
+        return f"Dataset {self.args[0]} is not loaded"
+
+
+def dataset_info(dataset):
+    """What a client needs to show a loaded dataset."""
+    return {
+        "key": dataset["key"],
+        "name": dataset["name"],
+        "rows": len(dataset["df"]),
+        "columns": [str(col) for col in dataset["df"].columns],
+        "sheets": dataset["workbooks"].summary(),
+        "refresh": dataset.get("refresh"),
+    }
+
+
+def response_to_json(response):
+    response = dict(response)
+    table = response.get("table")
+    response["table"] = table.to_json(orient="split", index=False, date_format="iso") if table is not None else None
+    return response
+
+
+def response_from_json(response):
+    if response.get("table") is not None:
+        # dtype=False keeps codes like "0339" as strings
+        response["table"] = pd.read_json(StringIO(response["table"]), orient="split", dtype=False, convert_dates=False)
+    return response
+
+
+class DatasetService:
+    """Loads each workbook once per process and answers questions on the shared copy."""
+
+    def __init__(self, dataset_cache=None, response_cache=None, llm=None):
+        self.datasets = dataset_cache if dataset_cache is not None else make_dataset_cache()
+        self.response_cache = response_cache
+        self.llm = llm
+        self._sweeper = None
+
+    def load_files(self, files):
+        """Load ``files`` (a list of ``(name, bytes)``) unless already loaded; returns :func:`dataset_info`."""
+        return dataset_info(load_dataset_files(files, self.datasets, self.response_cache, self.llm))
+
+    def load_paths(self, paths):
+        return self.load_files([(Path(p).name, Path(p).read_bytes()) for p in paths])
+
+    def dataset(self, key):
+        dataset = self.datasets.get(key)
+        if dataset is None:
+            raise DatasetNotLoaded(key)
+        return dataset
+
+    def info(self, key):
+        """:func:`dataset_info` for ``key``, or None when it is not loaded."""
+        dataset = self.datasets.get(key)
+        return dataset_info(dataset) if dataset is not None else None
+
+    def loaded(self):
+        return [
+            {
+                "key": key,
+                "name": dataset["name"],
+                "rows": len(dataset["df"]),
+                "mb": round(nbytes / 2**20, 1),
+                "idle_seconds": round(idle),
+                "agents": dataset["agents"].stats(),
+            }
+            for key, dataset, nbytes, idle in self.datasets.describe()
+        ]
+
+    def unload(self, key):
+        return self.datasets.discard(key) is not None
+
+    def memory(self, key):
+        """:func:`ingest.memory_report` of the dataset's primary sheet."""
+        return memory_report(self.dataset(key)["df"])
+
+    def ask(self, key, query):
+        return answer_query(query, self.dataset(key), self.response_cache)
+
+    def ask_stream(self, key, query):
+        """Events of :func:`chat_engine.answer_query_stream`; raises DatasetNotLoaded at once if ``key`` is not loaded."""
+        return answer_query_stream(query, self.dataset(key), self.response_cache)
+
+    def stats(self):
+        return {
+            "datasets": len(self.datasets),
+            "mb": round(self.datasets.total_bytes / 2**20, 1),
+            "max_mb": round(self.datasets.max_bytes / 2**20, 1),
+            "hits": self.datasets.hits,
+            "misses": self.datasets.misses,
+            "evictions": self.datasets.evictions,
+            "response_cache": self.response_cache.stats() if self.response_cache is not None else None,
+        }
+
+    def start_sweeper(self, interval=IDLE_SWEEP_SECONDS):
+        """Drop idle datasets from a daemon thread, even when no new workbook arrives."""
+        if self._sweeper is None and self.datasets.idle_seconds:
+            def sweep():
+                while True:
+                    time.sleep(interval)
+                    self.datasets.evict_idle()
+
+            self._sweeper = threading.Thread(target=sweep, daemon=True)
+            self._sweeper.start()
+        return self
+
+
+# --- Client ---
+class ServiceClient:
+    """:class:`DatasetService` methods, served by a dataset service in another local process."""
+
+    def __init__(self, url, timeout=600):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+
+    def _request(self, method, path, body=None):
+        data = json.dumps(body).encode("utf-8") if body is not None else None
+        request = urllib.request.Request(
+            self.url + path, data=data, method=method, headers={"Content-Type": "application/json"}
+        )
+        try:
+            return urllib.request.urlopen(request, timeout=self.timeout)
+        except urllib.error.HTTPError as e:
+            try:
+                body = json.loads(e.read())
+            except ValueError:
+                body = {}
+            if e.code == 404 and "key" in body:
+                raise DatasetNotLoaded(body["key"]) from None
+            raise RuntimeError(body.get("error", str(e))) from None
+
+    def _json(self, method, path, body=None):
+        with self._request(method, path, body) as response:
+            return json.loads(response.read())
+
+    def load_files(self, files):
+        files = list(files)
+        # Workbooks the service already holds are not sent again
+        info = self.info(dataset_key([data for _, data in files]))
+        if info is not None:
+            return info
+        payload = [{"name": name, "data": base64.b64encode(data).decode("ascii")} for name, data in files]
+        return self._json("POST", "/datasets", {"files": payload})
+
+    def load_paths(self, paths):
+        # Read here: the service only loads paths within its own data directory
+        return self.load_files([(Path(p).name, Path(p).read_bytes()) for p in paths])
+
+    def info(self, key):
+        try:
+            return self._json("GET", f"/datasets/{quote(key)}")
+        except DatasetNotLoaded:
+            return None
+
+    def loaded(self):
+        return self._json("GET", "/datasets")
+
+    def unload(self, key):
+        try:
+            return self._json("DELETE", f"/datasets/{quote(key)}")["unloaded"]
+        except DatasetNotLoaded:
+            return False
+
+    def memory(self, key):
+        return self._json("GET", f"/datasets/{quote(key)}/memory")
+
+    def ask(self, key, query):
+        return response_from_json(self._json("POST", f"/datasets/{quote(key)}/query", {"query": query}))
+
+    def ask_stream(self, key, query):
+        response = self._request("POST", f"/datasets/{quote(key)}/query", {"query": query, "stream": True})
+        return self._events(response)
+
+    def _events(self, response):
+        with response:
+            for line in response:
+                if not line.strip():
+                    continue
+                event = json.loads(line)
+                if event["type"] == "error":
+                    raise RuntimeError(event["error"])
+                if event["type"] == "final":
+                    event["response"] = response_from_json(event["response"])
+                yield event
+
+    def stats(self):
+        return self._json("GET", "/stats")
+
+
+def make_service():
+    """A :class:`ServiceClient` when ``DATASET_SERVICE_URL`` is set, otherwise an in-process service."""
+    if DATASET_SERVICE_URL:
+        return ServiceClient(DATASET_SERVICE_URL)
+    return DatasetService(make_dataset_cache(), make_response_cache()).start_sweeper()
+
+
+# --- HTTP Server ---
+class _ServiceHandler(BaseHTTPRequestHandler):
+    service = None
+
+    def _send_json(self, status, body):
+        data = json.dumps(body, default=str).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length)) if length else {}
+
+    def _route(self):
+        return [part for part in urlsplit(self.path).path.split("/") if part]
+
+    def _handle(self, method):
+        try:
+            parts = self._route()
+            if parts == ["stats"] and method == "GET":
+                return self._send_json(200, self.service.stats())
+            if parts[:1] != ["datasets"] or len(parts) > 3:
+                return self._send_json(404, {"error": f"No such endpoint: {method} {self.path}"})
+            if len(parts) == 1:
+                if method == "GET":
+                    return self._send_json(200, self.service.loaded())
+                if method == "POST":
+                    return self._send_json(200, self._load(self._body()))
+            key = parts[1]
+            if len(parts) == 2:
+                if method == "GET":
+                    info = self.service.info(key)
+                    if info is None:
+                        raise DatasetNotLoaded(key)
+                    return self._send_json(200, info)
+                if method == "DELETE":
+                    return self._send_json(200, {"unloaded": self.service.unload(key)})
+            if parts[2:] == ["memory"] and method == "GET":
+                return self._send_json(200, self.service.memory(key))
+            if parts[2:] == ["query"] and method == "POST":
+                body = self._body()
+                if not body.get("query"):
+                    raise ValueError("Missing field 'query'")
+                if body.get("stream"):
+                    return self._stream(self.service.ask_stream(key, body["query"]))
+                return self._send_json(200, response_to_json(self.service.ask(key, body["query"])))
+            return self._send_json(405, {"error": f"{method} not allowed on {self.path}"})
+        except DatasetNotLoaded as e:
+            return self._send_json(404, {"error": str(e), "key": e.args[0]})
+        except PermissionError as e:
+            return self._send_json(403, {"error": str(e)})
+        except (ValueError, binascii.Error, OSError) as e:
+            return self._send_json(400, {"error": str(e)})
+        except Exception as e:
+            return self._send_json(500, {"error": str(e)})
+
+    def _load(self, body):
+        if body.get("paths"):
+            return self.service.load_paths([data_path(p) for p in body["paths"]])
+        if not body.get("files"):
+            raise ValueError("Send 'files' or 'paths'")
+        files = [(f.get("name", "workbook.xlsx"), base64.b64decode(f.get("data", ""), validate=True)) for f in body["files"]]
+        return self.service.load_files(files)
+
+    def _stream(self, events):
+        # One JSON object per line, written as the answer is produced
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.end_headers()
+        try:
+            for event in events:
+                if event["type"] == "final":
+                    event = dict(event, response=response_to_json(event["response"]))
+                self.wfile.write(json.dumps(event, default=str).encode("utf-8") + b"\n")
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            events.close()
+        except Exception as e:
+            self.wfile.write(json.dumps({"type": "error", "error": str(e)}).encode("utf-8") + b"\n")
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+    def do_DELETE(self):
+        self._handle("DELETE")
+
+    def log_message(self, format, *args):
+        pass
+
+
+def data_path(path):
+    """``path`` resolved within ``DATASET_SERVICE_DATA_DIR``; PermissionError for anything else."""
+    if not DATASET_SERVICE_DATA_DIR:
+        raise PermissionError("Loading by path is disabled; send 'files', or set DATASET_SERVICE_DATA_DIR")
+    root = Path(DATASET_SERVICE_DATA_DIR).resolve()
+    resolved = (root / path).resolve()
+    if not resolved.is_relative_to(root):
+        raise PermissionError(f"{path} is outside the service's data directory")
+    return resolved
+
+
+def serve(service, port=None, host="127.0.0.1"):
+    """HTTP server for ``service``; call ``serve_forever()`` on it. Port 0 picks a free port."""
+    handler = type("ServiceHandler", (_ServiceHandler,), {"service": service})
+    return ThreadingHTTPServer((host, DATASET_SERVICE_PORT if port is None else port), handler)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve workbooks and questions about them to local clients.")
+    parser.add_argument("--host", default="127.0.0.1", help="Interface to listen on (default: local only)")
+    parser.add_argument("--port", type=int, default=DATASET_SERVICE_PORT, help="Port to listen on")
+    parser.add_argument("--metrics-port", type=int, default=None, help="Serve /metrics on this local port")
+    args = parser.parse_args(argv)
+
+    start_metrics_server(args.metrics_port)
+    service = DatasetService(make_dataset_cache(), make_response_cache()).start_sweeper()
+    server = serve(service, args.port, args.host)
+    print(f"Dataset service listening on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,102 @@
+"""Side channel that hands DataFrames computed by the agent straight to the caller.
+
+The pandas agent's python tool is swapped for :class:`DataFrameREPLTool`.
+Whenever the evaluated code yields a DataFrame (or Series) the tool gives it
+a table id, sends the real frame to any :class:`FrameCollector` among the
+run's callbacks and shows the LLM only its shape and a short preview. The
+prompt asks the LLM to cite the id (``[table: T3]``) next to a one-line
+summary instead of retyping the rows as CSV.
+"""
+import itertools
+import re
+from collections import OrderedDict
+
+import pandas as pd
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_experimental.tools.python.tool import PythonAstREPLTool
+
+TABLE_EVENT = "dataframe_result"
+# Results with at most this many rows are shown to the LLM in full
+PREVIEW_ROWS = 20
+TABLE_REF = re.compile(r"\[\s*table:?\s*(T\d+)\s*\]", re.IGNORECASE)
+
+_table_ids = itertools.count(1)
+
+
+def as_frame(result):
+    """DataFrame for a tool result, or None. Named indexes (group keys) become columns."""
+    if (
+        isinstance(result, pd.Series)
+        and isinstance(result.index, pd.CategoricalIndex)
+        and pd.api.types.is_integer_dtype(result.dtype)
+    ):
+        # value_counts() of a categorical also lists the categories no row has
+        result = result[result != 0]
+    if isinstance(result, pd.Series):
+        result = result.to_frame(name=result.name if result.name is not None else "value")
+    if not isinstance(result, pd.DataFrame):
+        return None
+    if any(name is not None for name in result.index.names):
+        return result.reset_index()
+    return result.reset_index(drop=True)
+
+
+def describe_frame(table_id, frame):
+    rows, cols = frame.shape
+    if rows <= PREVIEW_ROWS:
+        preview = frame.to_string(index=False)
+        shown = f"all {rows} rows"
+    else:
+        preview = frame.head(PREVIEW_ROWS // 4).to_string(index=False)
+        shown = f"first {PREVIEW_ROWS // 4} of {rows} rows"
+    return (
+        f"Table {table_id}: {rows} rows x {cols} columns (the user sees the full table; cite it as [table: {table_id}]). "
+        f"Showing {shown}:\n{preview}"
+    )
+
+
+class DataFrameREPLTool(PythonAstREPLTool):
+    """python_repl_ast that registers DataFrame results instead of printing them."""
+
+    def _run(self, query, run_manager=None):
+        result = super()._run(query, run_manager)
+        frame = as_frame(result)
+        if frame is None or run_manager is None:
+            return result
+        table_id = f"T{next(_table_ids)}"
+        run_manager.get_child().on_custom_event(
+            TABLE_EVENT, {"id": table_id, "frame": frame}, run_id=run_manager.run_id
+        )
+        return describe_frame(table_id, frame)
+
+
+def capture_frames(agent):
+    """Swap the agent's python tool for :class:`DataFrameREPLTool`, keeping its dataframe locals."""
+    tools = []
+    for tool in agent.tools:
+        if isinstance(tool, PythonAstREPLTool) and not isinstance(tool, DataFrameREPLTool):
+            tool = DataFrameREPLTool(globals=tool.globals, locals=tool.locals, description=tool.description)
+        tools.append(tool)
+    agent.tools = tools
+    return agent
+
+
+class FrameCollector(BaseCallbackHandler):
+    """Collect the frames registered during one agent run, in order."""
+
+    def __init__(self):
+        self.frames = OrderedDict()
+
+    def on_custom_event(self, name, data, *, run_id, **kwargs):
+        if name == TABLE_EVENT:
+            self.frames[data["id"]] = data["frame"]
+
+
+def resolve_table(text, frames):
+    """Split a final answer into (text without table refs, last cited frame or None)."""
+    refs = [ref.upper() for ref in TABLE_REF.findall(text)]
+    cleaned = TABLE_REF.sub("", text).strip()
+    for ref in reversed(refs):
+        if ref in frames:
+            return cleaned, frames[ref]
+    return cleaned, None
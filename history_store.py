@@ -0,0 +1,142 @@
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+
+import pandas as pd
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS history (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user TEXT NOT NULL,
+    assistant TEXT NOT NULL,
+    table_ref TEXT,
+    table_shape TEXT,
+    created REAL NOT NULL,
+    deleted INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS history_live ON history (deleted, id);
+"""
+
+# Tables are always stored as Parquet files; answer text longer than this is
+# replaced by a short placeholder since the table already holds it.
+INLINE_MAX_CHARS = 2000
+# Compact once this many tombstones have piled up and they are a quarter of all rows.
+COMPACT_MIN_DELETED = 200
+COMPACT_DELETED_RATIO = 0.25
+
+
+def _parquet_ready(table):
+    """``table`` in a form Parquet can store.
+
+    Answers like ``df[df["Employee Name"] == x].T`` or
+    ``df.describe(include="all")`` have non-string column names, labels in
+    the index and columns mixing text, numbers and dates; labels are kept as
+    a column and mixed columns are stored as text.
+    """
+    if not isinstance(table.index, pd.RangeIndex) and not pd.api.types.is_integer_dtype(table.index.dtype):
+        table = table.reset_index()
+    table = table.set_axis([str(c) for c in table.columns], axis=1)
+    for i, col in enumerate(table.columns):
+        values = table.iloc[:, i]
+        if values.dtype == object and pd.api.types.infer_dtype(values, skipna=True).startswith("mixed"):
+            table.isetitem(i, values.astype("string"))
+    return table
+
+
+class HistoryStore:
+    """Append-only chat history in SQLite.
+
+    Appends are single inserts, deletes only set a tombstone flag and the
+    sidebar reads one page of live entries at a time. Tombstoned rows (and
+    their table files) are purged by :meth:`compact`, which runs
+    automatically once enough of them accumulate.
+    """
+
+    def __init__(self, path, tables_dir=None):
+        self.path = Path(path)
+        self.tables_dir = Path(tables_dir) if tables_dir else self.path.with_name(self.path.stem + "_tables")
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(SCHEMA)
+
+    # --- Writes ---
+    def append(self, user, assistant, table=None):
+        table_ref = table_shape = None
+        if table is not None:
+            self.tables_dir.mkdir(parents=True, exist_ok=True)
+            table_ref = f"{uuid.uuid4().hex}.parquet"
+            _parquet_ready(table).to_parquet(self.tables_dir / table_ref, index=False)
+            table_shape = json.dumps(list(table.shape))
+            if len(assistant) > INLINE_MAX_CHARS:
+                assistant = f"[Table with {table.shape[0]} rows × {table.shape[1]} columns]"
+        with self._lock, self._conn:
+            cur = self._conn.execute(
+                "INSERT INTO history (user, assistant, table_ref, table_shape, created) VALUES (?, ?, ?, ?, ?)",
+                (user, assistant, table_ref, table_shape, time.time()),
+            )
+            return cur.lastrowid
+
+    def delete(self, entry_id):
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE history SET deleted = 1 WHERE id = ?", (entry_id,))
+            deleted, total = self._conn.execute("SELECT SUM(deleted), COUNT(*) FROM history").fetchone()
+        if deleted and deleted >= COMPACT_MIN_DELETED and deleted >= COMPACT_DELETED_RATIO * total:
+            self.compact()
+
+    def clear(self):
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE history SET deleted = 1")
+        self.compact()
+
+    def compact(self):
+        """Drop tombstoned rows and their table files, then reclaim the space."""
+        with self._lock:
+            with self._conn:
+                refs = [r[0] for r in self._conn.execute(
+                    "SELECT table_ref FROM history WHERE deleted = 1 AND table_ref IS NOT NULL"
+                )]
+                self._conn.execute("DELETE FROM history WHERE deleted = 1")
+            self._conn.execute("VACUUM")
+        for ref in refs:
+            (self.tables_dir / ref).unlink(missing_ok=True)
+
+    # --- Reads ---
+    def count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM history WHERE deleted = 0").fetchone()[0]
+
+    def page(self, limit=20, offset=0):
+        """Live entries, newest first."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, user, assistant, table_ref, table_shape, created FROM history"
+                " WHERE deleted = 0 ORDER BY id DESC LIMIT ? OFFSET ?",
+                (limit, offset),
+            ).fetchall()
+        return [dict(r) for r in rows]
+
+    def load_table(self, table_ref):
+        return pd.read_parquet(self.tables_dir / table_ref)
+
+    # --- Migration ---
+    def import_json(self, json_path):
+        """One-off import of the old chat_history.json list; the file is renamed afterwards."""
+        json_path = Path(json_path)
+        if not json_path.exists():
+            return 0
+        with open(json_path, "r") as f:
+            entries = json.load(f)
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT INTO history (user, assistant, created) VALUES (?, ?, ?)",
+                [(e.get("user", ""), e.get("assistant", ""), now) for e in entries],
+            )
+        json_path.rename(json_path.with_suffix(json_path.suffix + ".migrated"))
+        return len(entries)
@@ -0,0 +1,463 @@
+import datetime as dt
+import hashlib
+import re
+from collections import Counter
+from xml.etree.ElementTree import fromstring
+
+import numpy as np
+import pandas as pd
+from openpyxl import load_workbook
+from openpyxl.reader.excel import ExcelReader
+from openpyxl.styles.stylesheet import apply_stylesheet
+from openpyxl.xml.constants import ARC_STYLE, SHARED_STRINGS
+
+# Rows materialised per DataFrame chunk while streaming a sheet.
+INGEST_CHUNK_ROWS = 10_000
+
+
+def _cell_to_str(value):
+    # Mirrors pd.read_excel(dtype=str): integral floats lose their ".0".
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    if isinstance(value, dt.time):
+        return value.isoformat()
+    return str(value)
+
+
+def _trim(row):
+    # Trailing empty cells do not count towards a row's width, as in pd.read_excel
+    end = len(row)
+    while end and row[end - 1] is None:
+        end -= 1
+    return row[:end]
+
+
+def _header_names(header_row, width=0):
+    """Column names as pd.read_excel gives them, for a sheet at least ``width`` columns wide.
+
+    Names are kept as written; empty header cells and columns past the
+    header become ``Unnamed: <position>`` and repeats get ``.1``, ``.2``, ...
+    """
+    header_row = list(header_row) + [None] * (width - len(header_row))
+    names = []
+    seen = {}
+    for i, value in enumerate(header_row):
+        name = _cell_to_str(value)
+        name = name if name else f"Unnamed: {i}"
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}.{seen[name]}"
+        else:
+            seen[name] = 0
+        names.append(name)
+    return names
+
+
+def normalize_whitespace(df):
+    """Strip leading/trailing whitespace column-wise; whitespace-only cells become ``""``."""
+    for col in df.columns:
+        s = df[col]
+        if s.dtype == object or pd.api.types.is_string_dtype(s):
+            df[col] = s.str.strip()
+    return df
+
+
+def present_values(s):
+    """Mask of the values that count when inferring a column's type: not missing and not blank."""
+    return s.notna() & (s.astype(object) != "")
+
+
+def _chunk_frame(rows, columns):
+    width = len(columns)
+    df = pd.DataFrame.from_records([row + [None] * (width - len(row)) for row in rows], columns=columns)
+    return normalize_whitespace(df)
+
+
+def iter_sheet_chunks(excel_file, sheet_name=None, chunksize=INGEST_CHUNK_ROWS):
+    """Yield a sheet as string DataFrames of at most ``chunksize`` rows.
+
+    The workbook is opened read-only, so openpyxl streams rows from the
+    archive instead of building the whole sheet in memory. Cells match
+    ``pd.read_excel(dtype=str)`` with whitespace stripped, except that rows
+    with no value are skipped. A row reaching past the header adds
+    ``Unnamed: <position>`` columns from its chunk on.
+    """
+    wb = load_workbook(excel_file, read_only=True, data_only=True)
+    try:
+        ws = wb[sheet_name] if sheet_name is not None else wb.worksheets[0]
+        # Read-only sheets trust the stored dimensions, which are often wrong.
+        ws.reset_dimensions()
+        rows = ws.iter_rows(values_only=True)
+
+        header = next(rows, None)
+        if header is None:
+            return
+        header = _trim(header)
+        columns = _header_names(header)
+
+        buffer = []
+        emitted = False
+        for row in rows:
+            row = _trim(row)
+            if not row:
+                continue
+            if len(row) > len(columns):
+                columns = _header_names(header, len(row))
+            buffer.append([_cell_to_str(v) for v in row])
+            if len(buffer) >= chunksize:
+                yield _chunk_frame(buffer, columns)
+                emitted = True
+                buffer = []
+        if buffer or not emitted:
+            yield _chunk_frame(buffer, columns)
+    finally:
+        wb.close()
+
+
+def scan_sheets(excel_file, sample_rows=200):
+    """Yield ``(sheet_name, stored_rows, sample)`` for every sheet without reading it all.
+
+    ``sample`` holds the first ``sample_rows`` non-blank rows as a string
+    frame. ``stored_rows`` is the data row count recorded in the sheet's
+    dimension tag (None when the workbook does not record one); it is only
+    an estimate, since writers often get it wrong.
+    """
+    wb = load_workbook(excel_file, read_only=True, data_only=True)
+    try:
+        for ws in wb.worksheets:
+            max_row = ws.max_row
+            stored_rows = max_row - 1 if max_row else None
+            ws.reset_dimensions()
+            rows = ws.iter_rows(values_only=True)
+            header = next(rows, None)
+            if header is None:
+                yield ws.title, 0, pd.DataFrame()
+                continue
+            header = _trim(header)
+            columns = _header_names(header)
+            sample = []
+            for row in rows:
+                row = _trim(row)
+                if not row:
+                    continue
+                if len(row) > len(columns):
+                    columns = _header_names(header, len(row))
+                sample.append([_cell_to_str(v) for v in row])
+                if len(sample) >= sample_rows:
+                    break
+            yield ws.title, stored_rows, _chunk_frame(sample, columns)
+    finally:
+        wb.close()
+
+
+def read_sheet(excel_file, sheet_name=None, chunksize=INGEST_CHUNK_ROWS):
+    """Load one sheet (the first by default) as a whitespace-normalized string frame."""
+    chunks = list(iter_sheet_chunks(excel_file, sheet_name=sheet_name, chunksize=chunksize))
+    if not chunks:
+        return pd.DataFrame()
+    if len(chunks) == 1:
+        return chunks[0]
+    # Columns only grow from chunk to chunk
+    columns = chunks[-1].columns
+    return pd.concat([chunk.reindex(columns=columns) for chunk in chunks], ignore_index=True)
+
+
+def infer_numeric_columns(df):
+    """Convert string columns whose every non-missing value is numeric.
+
+    The agents used to load the data back from CSV, which inferred numbers
+    the same way; keeping that behaviour means generated pandas code such
+    as ``df[df["Experience"] > 5]`` still works.
+    """
+    for col in df.columns:
+        s = df[col]
+        if not (s.dtype == object or pd.api.types.is_string_dtype(s)):
+            continue
+        # Whitespace-only cells become missing numbers, as they did in the CSV
+        present = present_values(s)
+        if not present.any():
+            continue
+        numbers = pd.to_numeric(s, errors="coerce")
+        if numbers[present].notna().all():
+            df[col] = numbers
+    return df
+
+
+# --- Compact Dtypes ---
+# Text columns with at most this many distinct values per non-missing value become categoricals
+CATEGORY_MAX_RATIO = 0.5
+# Dates and datetimes as _cell_to_str writes them; text columns holding only these become datetimes
+ISO_DATE_PATTERN = r"\d{4}-\d{2}-\d{2}(?:[ T]\d{2}:\d{2}:\d{2}(?:\.\d+)?)?"
+# Values checked before a whole column is tested for dates
+DATE_PROBE_ROWS = 100
+# Arrow-backed strings with NaN for missing values (the default string dtype from pandas 3)
+try:
+    TEXT_DTYPE = pd.StringDtype("pyarrow", na_value=np.nan)
+except TypeError:
+    TEXT_DTYPE = pd.StringDtype("pyarrow_numpy")
+
+
+def _is_dates(text):
+    if not text.iloc[:DATE_PROBE_ROWS].str.fullmatch(ISO_DATE_PATTERN).all():
+        return False
+    return text.str.fullmatch(ISO_DATE_PATTERN).all()
+
+
+def compact_dtypes(df):
+    """Store text columns compactly: as datetimes, categoricals or Arrow-backed strings.
+
+    Runs after :func:`infer_numeric_columns`. A column holding only dates
+    becomes datetimes. A column whose values repeat (``CATEGORY_MAX_RATIO``)
+    becomes a categorical with sorted categories. Any other text becomes
+    Arrow-backed strings. Numeric columns are left alone, so arithmetic in
+    agent code cannot overflow a narrower integer type. Running it again on
+    a compacted frame that gained or lost rows decides the categoricals
+    afresh.
+    """
+    for col in df.columns:
+        s = df[col]
+        if isinstance(s.dtype, pd.CategoricalDtype):
+            s = s.cat.remove_unused_categories()
+            categories = s.cat.categories
+            if len(categories) > CATEGORY_MAX_RATIO * s.notna().sum():
+                df[col] = s.astype(TEXT_DTYPE)
+            else:
+                df[col] = s if categories.is_monotonic_increasing else s.cat.reorder_categories(categories.sort_values())
+            continue
+        if not (s.dtype == object or pd.api.types.is_string_dtype(s.dtype)):
+            continue
+        s = s.astype(TEXT_DTYPE)
+        present = s[present_values(s)]
+        if present.empty:
+            df[col] = s
+            continue
+        if _is_dates(present):
+            dates = pd.to_datetime(s, format="ISO8601", errors="coerce")
+            if dates.notna().sum() == len(present):
+                df[col] = dates
+                continue
+        if present.nunique() <= CATEGORY_MAX_RATIO * len(present):
+            # Categories come out sorted
+            df[col] = s.astype("category")
+        else:
+            df[col] = s
+    return df
+
+
+def _text_nbytes(s):
+    # As pd.read_excel(dtype=str) holds it: pandas' Arrow-backed str dtype
+    return int(s.astype(TEXT_DTYPE).memory_usage(index=False, deep=True))
+
+
+def memory_report(df):
+    """One row per column: its dtype, bytes in memory, and bytes had it been read as text (``str`` dtype)."""
+    report = []
+    for col in df.columns:
+        s = df[col]
+        nbytes = int(s.memory_usage(index=False, deep=True))
+        text_bytes = _text_nbytes(s)
+        report.append({
+            "column": str(col),
+            "dtype": str(s.dtype),
+            "bytes": nbytes,
+            "as_text_bytes": text_bytes,
+            "saved": round(100 * (1 - nbytes / text_bytes), 1) if text_bytes else 0.0,
+        })
+    return report
+
+
+# --- Raw Rows (incremental refresh) ---
+# Bytes of sheet XML scanned at a time
+RAW_CHUNK_BYTES = 1 << 20
+_ROOT_RE = re.compile(rb"<((?:\w+:)?worksheet)\b[^>]*>")
+_ROW_RE = re.compile(rb"<(?:\w+:)?row\b([^>]*?)(?:/>|>(.*?)</(?:\w+:)?row>)", re.S)
+_ROW_NUMBER_RE = re.compile(rb'\sr="(\d+)"')
+# Cell references lose their row number, so a row keeps its fingerprint when rows move
+_CELL_REF_RE = re.compile(rb'(\sr="[A-Z]+)\d+"')
+_ROW_END_RE = re.compile(rb"</(?:\w+:)?row>")
+_SHARED_CELL_RE = re.compile(rb'(<(?:\w+:)?c\b[^>]*?\st="s"[^>]*>\s*<(?:\w+:)?v>)(\d+)')
+# A row holds a value when a cell has a non-empty <v> or an inline string
+_HAS_VALUE_RE = re.compile(rb"<(?:\w+:)?v>[^<]|<(?:\w+:)?is\b")
+
+
+def _workbook_reader(excel_file, strings=True):
+    # The sheet list (and shared strings and styles), without openpyxl sizing every sheet
+    reader = ExcelReader(excel_file, read_only=True, data_only=True)
+    reader.read_manifest()
+    if strings:
+        reader.read_strings()
+    reader.read_workbook()
+    if strings:
+        apply_stylesheet(reader.archive, reader.wb)
+    return reader
+
+
+def _worksheet_parts(reader):
+    for sheet, rel in reader.parser.find_sheets():
+        if "worksheet" in rel.Type and rel.target in reader.valid_files:
+            yield sheet.name, rel.target
+
+
+def sheet_digests(excel_file):
+    """Digest per sheet of the archive members its values come from.
+
+    Read from the zip directory (CRCs) without decompressing anything; a
+    sheet whose digest is unchanged between two versions of a workbook
+    holds the same values.
+    """
+    reader = _workbook_reader(excel_file, strings=False)
+    try:
+        crcs = {info.filename: info.CRC for info in reader.archive.infolist()}
+        strings = reader.package.find(SHARED_STRINGS)
+        shared = [strings.PartName[1:]] if strings is not None else []
+        return {
+            name: hashlib.sha256(
+                " ".join(f"{part}:{crcs.get(part)}" for part in [path, ARC_STYLE, *shared]).encode()
+            ).hexdigest()[:32]
+            for name, path in _worksheet_parts(reader)
+        }
+    finally:
+        reader.archive.close()
+
+
+def _fingerprint(body, strings):
+    body = _CELL_REF_RE.sub(rb'\1"', body)
+    digest = hashlib.blake2b(digest_size=8)
+    if b't="s"' in body:
+        # Split into text, cell start, string index, text, ... and hash the strings themselves
+        parts = _SHARED_CELL_RE.split(body)
+        for i in range(0, len(parts) - 1, 3):
+            digest.update(parts[i])
+            digest.update(parts[i + 1])
+            digest.update(strings[int(parts[i + 2])])
+        digest.update(parts[-1])
+    else:
+        digest.update(body)
+    return int.from_bytes(digest.digest(), "little")
+
+
+def _row_parser(wb, shared_strings):
+    """openpyxl's cell decoder for single rows, or None if this openpyxl lacks it.
+
+    ``WorkSheetParser`` and the workbook's date formats are private openpyxl
+    API (requirements.txt pins the minor version); without them a refresh
+    falls back to parsing the sheet in full.
+    """
+    try:
+        from openpyxl.worksheet._reader import WorkSheetParser
+
+        return WorkSheetParser(
+            None, shared_strings, data_only=True, epoch=wb.epoch,
+            date_formats=wb._date_formats, timedelta_formats=wb._timedelta_formats,
+        )
+    except (ImportError, AttributeError, TypeError):
+        return None
+
+
+def _iter_rows(stream):
+    # (root element, row match) for each <row> of a sheet's XML, read a chunk at a time
+    buffer = b""
+    root = None
+    while True:
+        chunk = stream.read(RAW_CHUNK_BYTES)
+        buffer += chunk
+        if root is None:
+            root = _ROOT_RE.search(buffer)
+            if root is None:
+                if not chunk:
+                    return
+                continue
+            buffer = buffer[root.end():]
+        # Up to the last complete row; the rest waits for the next chunk
+        end = len(buffer) if not chunk else max((m.end() for m in _ROW_END_RE.finditer(buffer)), default=0)
+        for match in _ROW_RE.finditer(buffer, 0, end):
+            yield root, match
+        buffer = buffer[end:]
+        if not chunk:
+            return
+
+
+class RawSheet:
+    """A sheet's row fingerprints, and the raw XML of rows that may need decoding.
+
+    Only rows holding a value count (iter_sheet_chunks skips the others);
+    the header is row 0. A fingerprint hashes the row's XML with row numbers
+    dropped and shared strings resolved, so it survives rows moving and the
+    shared string table being renumbered.
+
+    The sheet is scanned a chunk at a time. ``previous_fingerprints`` (header
+    first) are those of the version the rows will be copied from: rows found
+    there are not kept, and with ``keep_rows=False`` no row is, which is all a
+    first parse needs. Rows with the same fingerprint share one copy.
+    """
+
+    def __init__(self, excel_file, sheet_name=None, previous_fingerprints=None, keep_rows=True):
+        reader = _workbook_reader(excel_file)
+        strings = [str(v).encode("utf-8") for v in reader.shared_strings]
+        # Rows of the previous version still to be matched, per fingerprint (see refresh._match)
+        remaining = Counter(previous_fingerprints[1:].tolist()) if previous_fingerprints is not None else Counter()
+        self._wb = reader.wb
+        self._shared_strings = reader.shared_strings
+        self._wrap = None
+        self._xml = {}
+        # iter_sheet_chunks takes row 1 as the header, even when it is empty
+        self.header_is_first_row = None
+        fingerprints = []
+        try:
+            parts = dict(_worksheet_parts(reader))
+            path = parts[sheet_name] if sheet_name is not None else next(iter(parts.values()))
+            with reader.archive.open(path) as stream:
+                for root, match in _iter_rows(stream):
+                    body = match.group(2)
+                    if not body or not _HAS_VALUE_RE.search(body):
+                        continue
+                    if self.header_is_first_row is None:
+                        number = _ROW_NUMBER_RE.search(match.group(1))
+                        self.header_is_first_row = number is None or number.group(1) == b"1"
+                        self._wrap = (root.group(0), b"</" + root.group(1) + b">")
+                    fingerprint = _fingerprint(body, strings)
+                    is_header = not fingerprints
+                    fingerprints.append(fingerprint)
+                    if remaining[fingerprint] > 0 and not is_header:
+                        remaining[fingerprint] -= 1
+                    elif (keep_rows or is_header) and fingerprint not in self._xml:
+                        self._xml[fingerprint] = match.group(0)
+        finally:
+            reader.archive.close()
+        self.fingerprints = np.array(fingerprints, dtype=np.uint64)
+        self._parser = None
+
+    @property
+    def decodable(self):
+        """Whether rows can be decoded with the installed openpyxl."""
+        if self._parser is None:
+            self._parser = _row_parser(self._wb, self._shared_strings)
+        return self._parser is not None
+
+    def records(self, positions):
+        """The rows at ``positions`` as lists of cell strings (trailing empty cells dropped)."""
+        if not self.decodable:
+            raise RuntimeError("this openpyxl version cannot decode single rows")
+        start, end = self._wrap
+        records = []
+        for pos in positions:
+            xml = self._xml[int(self.fingerprints[pos])]
+            _, cells = self._parser.parse_row(fromstring(start + xml + end)[0])
+            values = {cell["column"]: _cell_to_str(cell["value"]) for cell in cells}
+            records.append(_trim([values.get(col) for col in range(1, max(values, default=0) + 1)]))
+        return records
+
+    def columns(self):
+        return _header_names(self.records([0])[0]) if len(self.fingerprints) else []
+
+    def frame(self, positions, columns):
+        """Whitespace-normalized string frame of the rows at ``positions``, like iter_sheet_chunks builds.
+
+        None when a row reaches past ``columns``.
+        """
+        rows = self.records(positions)
+        if any(len(values) > len(columns) for values in rows):
+            return None
+        return _chunk_frame(rows, columns)
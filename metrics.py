@@ -0,0 +1,276 @@
+"""Per-stage timings and LLM usage for the query path, exported as OpenMetrics text.
+
+Stages are timed with :func:`span`; while a question is being answered
+inside :func:`trace_query` the spans, token counts and tool calls are also
+collected on a :class:`QueryTrace` so the UI can show the breakdown of the
+last query. Process-wide totals live in ``REGISTRY`` and are written to
+``METRICS_FILE`` and/or served on ``METRICS_PORT`` at ``/metrics``.
+"""
+import contextvars
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from value_dictionary import estimate_tokens
+
+# --- Metrics Settings ---
+# Text file rewritten after every query (e.g. for node_exporter's textfile collector)
+METRICS_FILE = os.getenv("METRICS_FILE")
+# Port for a local /metrics endpoint; 0 disables it
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_PREFIX = "excel_chat"
+SECONDS_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels) + "}"
+
+
+class MetricsRegistry:
+    """Thread-safe counters and histograms rendered in the OpenMetrics text format."""
+
+    def __init__(self, buckets=SECONDS_BUCKETS, prefix=METRICS_PREFIX):
+        self.buckets = tuple(buckets)
+        self.prefix = prefix
+        self.help = {}
+        self._counters = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def describe(self, name, text):
+        self.help[name] = text
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            hist = self._histograms.get(key)
+            if hist is None:
+                hist = self._histograms[key] = {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    hist["buckets"][i] += 1
+            hist["sum"] += value
+            hist["count"] += 1
+
+    def render(self):
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((k, dict(v, buckets=list(v["buckets"]))) for k, v in self._histograms.items())
+        lines = []
+        seen = set()
+
+        def header(name, kind):
+            if name not in seen:
+                seen.add(name)
+                lines.append(f"# TYPE {self.prefix}_{name} {kind}")
+                if name in self.help:
+                    lines.append(f"# HELP {self.prefix}_{name} {self.help[name]}")
+
+        for (name, labels), value in counters:
+            header(name, "counter")
+            lines.append(f"{self.prefix}_{name}_total{_labels(labels)} {value}")
+        for (name, labels), hist in histograms:
+            header(name, "histogram")
+            for bound, count in zip(self.buckets, hist["buckets"]):
+                lines.append(f"{self.prefix}_{name}_bucket{_labels(labels + (('le', bound),))} {count}")
+            lines.append(f"{self.prefix}_{name}_bucket{_labels(labels + (('le', '+Inf'),))} {hist['count']}")
+            lines.append(f"{self.prefix}_{name}_sum{_labels(labels)} {hist['sum']}")
+            lines.append(f"{self.prefix}_{name}_count{_labels(labels)} {hist['count']}")
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+REGISTRY.describe("stage_seconds", "Time spent in each stage of loading and answering.")
+REGISTRY.describe("query_seconds", "End-to-end time to answer a question, by answer source.")
+REGISTRY.describe("queries", "Questions answered, by answer source.")
+REGISTRY.describe("llm_calls", "Chat model calls made by the agents.")
+REGISTRY.describe("llm_tokens", "Prompt and completion tokens (estimated when the model reports none).")
+REGISTRY.describe("agent_tool_calls", "Tool calls (ReAct steps) made by the agents.")
+
+
+# --- Query Traces ---
+class QueryTrace:
+    """Stage timings and LLM usage of one question."""
+
+    def __init__(self, query):
+        self.query = query
+        self.stages = []
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.llm_calls = 0
+        self.tool_calls = 0
+        self.source = None
+        self.seconds = None
+        self._started = time.perf_counter()
+
+    def add_stage(self, stage, seconds):
+        self.stages.append({"stage": stage, "seconds": seconds})
+
+    def finish(self):
+        self.seconds = time.perf_counter() - self._started
+
+    def to_dict(self):
+        return {
+            "query": self.query,
+            "source": self.source,
+            "seconds": self.seconds,
+            "stages": list(self.stages),
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "llm_calls": self.llm_calls,
+            "tool_calls": self.tool_calls,
+        }
+
+
+_current_trace = contextvars.ContextVar("query_trace", default=None)
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+@contextmanager
+def span(stage):
+    """Time a stage into the registry and, if a question is being traced, into its trace."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - started
+        REGISTRY.observe("stage_seconds", seconds, stage=stage)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.add_stage(stage, seconds)
+
+
+@contextmanager
+def trace_query(query):
+    """Collect a :class:`QueryTrace` for one question; set ``trace.source`` before leaving."""
+    trace = QueryTrace(query)
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+        trace.finish()
+        source = trace.source or "error"
+        REGISTRY.inc("queries", source=source)
+        REGISTRY.observe("query_seconds", trace.seconds, source=source)
+        export_metrics()
+
+
+class MetricsCallbackHandler(BaseCallbackHandler):
+    """Count LLM calls, tokens and tool calls of an agent run.
+
+    Token counts come from the model's usage metadata when it reports them
+    and are estimated from the text otherwise. The trace is captured when
+    the handler is created, so it also works when the agent runs in a
+    worker thread.
+    """
+
+    def __init__(self, trace=None):
+        self.trace = trace if trace is not None else current_trace()
+        self._prompt_estimates = {}
+
+    def _add(self, attr, metric, value, **labels):
+        REGISTRY.inc(metric, value, **labels)
+        if self.trace is not None:
+            setattr(self.trace, attr, getattr(self.trace, attr) + value)
+
+    def on_llm_start(self, serialized, prompts, run_id=None, **kwargs):
+        self._prompt_estimates[run_id] = sum(estimate_tokens(p) for p in prompts)
+
+    def on_chat_model_start(self, serialized, messages, run_id=None, **kwargs):
+        self._prompt_estimates[run_id] = sum(
+            estimate_tokens(str(message.content)) for batch in messages for message in batch
+        )
+
+    def on_llm_end(self, response, run_id=None, **kwargs):
+        self._add("llm_calls", "llm_calls", 1)
+        prompt_tokens = completion_tokens = 0
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+                if usage:
+                    prompt_tokens += usage.get("input_tokens", 0)
+                    completion_tokens += usage.get("output_tokens", 0)
+                else:
+                    completion_tokens += estimate_tokens(generation.text)
+        if not prompt_tokens:
+            prompt_tokens = self._prompt_estimates.get(run_id, 0)
+        self._prompt_estimates.pop(run_id, None)
+        self._add("prompt_tokens", "llm_tokens", prompt_tokens, kind="prompt")
+        self._add("completion_tokens", "llm_tokens", completion_tokens, kind="completion")
+
+    def on_agent_action(self, action, **kwargs):
+        self._add("tool_calls", "agent_tool_calls", 1)
+
+    def on_llm_error(self, error, run_id=None, **kwargs):
+        self._prompt_estimates.pop(run_id, None)
+
+
+# --- Export ---
+_export_lock = threading.Lock()
+
+
+def export_metrics(path=None):
+    """Rewrite the metrics file (atomically) if one is configured."""
+    path = path or METRICS_FILE
+    if not path:
+        return
+    path = Path(path)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    with _export_lock:
+        tmp.write_text(REGISTRY.render(), encoding="utf-8")
+        os.replace(tmp, path)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def start_metrics_server(port=None, host="127.0.0.1"):
+    """Serve ``/metrics`` on a local port from a daemon thread (once per process)."""
+    global _server
+    port = METRICS_PORT if port is None else port
+    if not port:
+        return None
+    with _server_lock:
+        if _server is None:
+            _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+            threading.Thread(target=_server.serve_forever, daemon=True).start()
+    return _server
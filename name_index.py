@@ -0,0 +1,344 @@
+import bisect
+import copy
+import difflib
+import re
+from collections import defaultdict
+
+import numpy as np
+import pandas as pd
+
+NAME_COLUMN = "Employee Name"
+COMMENTS_COLUMN = "RMG Comments"
+
+# Similarity needed for a fuzzy name match (difflib ratio, 0..1).
+FUZZY_CUTOFF = 0.85
+# Longest name (in words) looked for inside a question.
+MAX_NAME_WORDS = 5
+# Employees listed when a partial name fits several of them.
+MAX_CANDIDATES = 20
+
+COMMENT_WORDS = ("comment", "feedback", "remark")
+DETAIL_WORDS = ("detail", "details", "info", "information", "record", "profile", "about")
+# Questions that need reasoning over the text rather than retrieval stay with the LLM.
+LLM_WORDS = (
+    "summar", "analy", "sentiment", "trend", "compare", "why", "overall", "common",
+    "theme", "insight", "recommend", "explain", "team", "department", "all ",
+)
+# Words of the question itself, never taken as a first or last name.
+QUERY_WORDS = {
+    "show", "give", "get", "list", "what", "which", "for", "the", "and", "of", "me", "is",
+    "are", "was", "has", "have", "does", "display", "find", "full", "rmg", "employee",
+} | set(COMMENT_WORDS) | {w + "s" for w in COMMENT_WORDS} | set(DETAIL_WORDS)
+SEARCH_PATTERN = re.compile(
+    r"\b(?:mention|mentions|mentioning|contain|contains|containing|about|with)\s+[\"']?(.+?)[\"']?\s*\??$"
+)
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+(?:['.-][a-z0-9]+)*")
+
+
+def normalize_name(value):
+    return " ".join(str(value).lower().split())
+
+
+def tokenize(text):
+    return _TOKEN_RE.findall(str(text).lower())
+
+
+class EmployeeIndex:
+    """In-memory lookup structures built once per dataset.
+
+    * normalized employee name -> row ids (exact lookups in O(1))
+    * sorted names for prefix lookups (O(log n + k))
+    * name token -> names, for first/last name only questions
+    * first two letters of each name token -> names, to narrow fuzzy matching
+    * comment token -> row ids, for retrieving comments by content
+
+    Row ids are row positions in a fresh index. An index refreshed for the
+    next version of the sheet keeps the ids of unchanged rows and maps ids
+    to their new positions, so only the changed rows are re-indexed.
+    """
+
+    def __init__(self, df, name_col=NAME_COLUMN, comments_col=COMMENTS_COLUMN):
+        self.df = df
+        self.name_col = name_col if name_col in df.columns else None
+        self.comments_col = comments_col if comments_col in df.columns else None
+
+        self.names = defaultdict(list)
+        self.name_tokens = defaultdict(set)
+        self.name_token_heads = defaultdict(set)
+        self.comment_tokens = defaultdict(set)
+        # Row id -> position in df (-1 once the row is gone)
+        self._positions = np.arange(len(df))
+
+        self._add_rows(self.df, range(len(df)), range(len(df)))
+        self.sorted_names = sorted(self.names)
+        for key in self.sorted_names:
+            self._add_name_tokens(key)
+
+    def _entries(self, df, positions):
+        # (position, normalized name, comment tokens) of the given rows
+        positions = list(positions)
+        names = df[self.name_col].take(positions).tolist() if self.name_col else [None] * len(positions)
+        comments = df[self.comments_col].take(positions).tolist() if self.comments_col else [None] * len(positions)
+        for name, comment in zip(names, comments):
+            key = normalize_name(name) if not pd.isna(name) else ""
+            tokens = set(tokenize(comment)) if not pd.isna(comment) else set()
+            yield key, tokens
+
+    def _add_rows(self, df, positions, ids, own=None):
+        # ``own`` collects the entries already copied from the index this one was refreshed from
+        for row_id, (key, tokens) in zip(ids, self._entries(df, positions)):
+            if key:
+                self._owned(self.names, key, list, own).append(row_id)
+            for token in tokens:
+                self._owned(self.comment_tokens, token, set, own).add(row_id)
+
+    def _remove_rows(self, df, positions, ids, own):
+        for row_id, (key, tokens) in zip(ids, self._entries(df, positions)):
+            if key and key in self.names:
+                self._owned(self.names, key, list, own).remove(row_id)
+            for token in tokens:
+                if token in self.comment_tokens:
+                    self._owned(self.comment_tokens, token, set, own).discard(row_id)
+
+    @staticmethod
+    def _owned(mapping, key, factory, own):
+        if own is None:
+            return mapping[key]
+        if (id(mapping), key) not in own:
+            own.add((id(mapping), key))
+            mapping[key] = factory(mapping.get(key, ()))
+        return mapping[key]
+
+    def _add_name_tokens(self, key, own=None):
+        for token in key.split():
+            self._owned(self.name_tokens, token, set, own).add(key)
+            self._owned(self.name_token_heads, token[:2], set, own).add(key)
+
+    def _remove_name_tokens(self, key, own):
+        for token in key.split():
+            self._owned(self.name_tokens, token, set, own).discard(key)
+            self._owned(self.name_token_heads, token[:2], set, own).discard(key)
+
+    def positions(self, row_ids):
+        """Sorted row positions of ``row_ids``."""
+        return sorted(int(p) for p in self._positions[list(row_ids)]) if row_ids else []
+
+    def rows(self, key):
+        """Row positions of a normalized name, in sheet order."""
+        return self.positions(self.names.get(key, ()))
+
+    def refreshed(self, df, diff):
+        """Index of the next version of the sheet (see refresh.RowDiff).
+
+        Entries are shared with this index and copied only where the
+        dropped or decoded rows touch them, so the work follows the change.
+        """
+        if len(self._positions) + len(diff.decoded) > 2 * len(df) + 1_000:
+            # Too many retired ids; start over with fresh ones
+            return EmployeeIndex(df, self.name_col or NAME_COLUMN, self.comments_col or COMMENTS_COLUMN)
+        index = copy.copy(self)
+        index.df = df
+        index.names = defaultdict(list, self.names)
+        index.name_tokens = defaultdict(set, self.name_tokens)
+        index.name_token_heads = defaultdict(set, self.name_token_heads)
+        index.comment_tokens = defaultdict(set, self.comment_tokens)
+        own = set()
+
+        live = np.flatnonzero(self._positions >= 0)
+        ids_by_position = np.full(diff.old_rows, -1, dtype=np.int64)
+        ids_by_position[self._positions[live]] = live
+        dropped, decoded = diff.dropped, diff.decoded
+        new_ids = np.arange(len(self._positions), len(self._positions) + len(decoded))
+        positions = np.full(len(self._positions) + len(decoded), -1, dtype=np.int64)
+        kept = diff.source >= 0
+        positions[ids_by_position[diff.source[kept]]] = np.flatnonzero(kept)
+        positions[new_ids] = decoded
+        index._positions = positions
+
+        before = {key for key, _ in self._entries(self.df, dropped) if key}
+        index._remove_rows(self.df, dropped, ids_by_position[dropped].tolist(), own)
+        index._add_rows(df, decoded, new_ids.tolist(), own)
+        after = {key for key, _ in index._entries(df, decoded) if key}
+
+        gone = {key for key in before if not index.names.get(key)}
+        new = {key for key in after if key not in self.names}
+        for key in gone:
+            index.names.pop(key, None)
+            index._remove_name_tokens(key, own)
+        for key in new:
+            index._add_name_tokens(key, own)
+        if gone or new:
+            index.sorted_names = list(self.sorted_names)
+            for key in gone:
+                del index.sorted_names[bisect.bisect_left(index.sorted_names, key)]
+            for key in new:
+                bisect.insort(index.sorted_names, key)
+        return index
+
+    # --- Name lookups ---
+    def lookup(self, name):
+        return self.rows(normalize_name(name))
+
+    def prefix(self, prefix, limit=50):
+        prefix = normalize_name(prefix)
+        if not prefix:
+            return []
+        start = bisect.bisect_left(self.sorted_names, prefix)
+        matches = []
+        for key in self.sorted_names[start:]:
+            if not key.startswith(prefix) or len(matches) >= limit:
+                break
+            matches.append(key)
+        return matches
+
+    def fuzzy(self, name, limit=5, cutoff=FUZZY_CUTOFF):
+        name = normalize_name(name)
+        # Only names where every word starts like one of the name's words
+        candidates = None
+        for token in name.split():
+            heads = self.name_token_heads.get(token[:2], set())
+            candidates = set(heads) if candidates is None else candidates & heads
+            if not candidates:
+                return []
+        return difflib.get_close_matches(name, list(candidates or ()), n=limit, cutoff=cutoff)
+
+    def _partial(self, key):
+        """``(name, candidates)`` for a partial or misspelt name.
+
+        One name when only one fits; otherwise ``candidates`` holds the names
+        it fits equally well (up to ``MAX_CANDIDATES + 1``), and no guess is made.
+        """
+        prefixed = self.prefix(key, limit=MAX_CANDIDATES + 1)
+        if len(prefixed) == 1:
+            return prefixed[0], []
+        if prefixed:
+            return None, prefixed
+        fuzzy = self.fuzzy(key, limit=MAX_CANDIDATES + 1)
+        if not fuzzy:
+            return None, []
+        ratios = [difflib.SequenceMatcher(None, key, name).ratio() for name in fuzzy]
+        best = [name for name, ratio in zip(fuzzy, ratios) if ratio == ratios[0]]
+        return (best[0], []) if len(best) == 1 else (None, best)
+
+    def resolve(self, name):
+        """Exact, then unique prefix, then best fuzzy match. Returns a normalized name or None."""
+        key = normalize_name(name)
+        if key in self.names:
+            return key
+        return self._partial(key)[0]
+
+    def match_name_in_query(self, query):
+        """``(name, candidates)``: the normalized employee name mentioned in ``query``, or
+        the names a partial one could mean (see :meth:`_partial`)."""
+        words = tokenize(query)
+        # Longest exact n-gram first, so "john smith" wins over "john"
+        for size in range(min(MAX_NAME_WORDS, len(words)), 0, -1):
+            for i in range(len(words) - size + 1):
+                gram = " ".join(words[i:i + size])
+                if gram in self.names:
+                    return gram, []
+        # Misspelt or partial full names (two- and three-word windows)
+        ambiguous = []
+        for size in (3, 2):
+            for i in range(len(words) - size + 1):
+                name, candidates = self._partial(" ".join(words[i:i + size]))
+                if name is not None:
+                    return name, []
+                ambiguous = ambiguous or candidates
+        # A lone first or last name, as long as exactly one employee has it
+        for word in words:
+            if word in QUERY_WORDS or len(word) < 3:
+                continue
+            owners = self.name_tokens.get(word, ())
+            if len(owners) == 1:
+                return next(iter(owners)), []
+        return None, ambiguous
+
+    def find_name_in_query(self, query):
+        """Return the normalized employee name mentioned in ``query``, if exactly one fits."""
+        return self.match_name_in_query(query)[0]
+
+    # --- Comment retrieval ---
+    def comments_for(self, name):
+        key = self.resolve(name)
+        if key is None or not self.comments_col:
+            return []
+        return self.rows(key)
+
+    def search_comments(self, text):
+        """Row positions whose comment contains every token of ``text``."""
+        tokens = tokenize(text)
+        if not tokens or not self.comments_col:
+            return []
+        postings = sorted((self.comment_tokens.get(t, set()) for t in tokens), key=len)
+        rows = set(postings[0])
+        for posting in postings[1:]:
+            rows &= posting
+            if not rows:
+                break
+        return self.positions(rows)
+
+
+def _comment_table(index, rows):
+    return index.df.iloc[rows][[index.name_col, index.comments_col]].reset_index(drop=True)
+
+
+def _candidates_answer(index, candidates, wants_comments):
+    # Several employees fit the name; list them all rather than pick one
+    shown = candidates[:MAX_CANDIDATES]
+    rows = sorted(row for key in shown for row in index.rows(key))
+    if wants_comments and index.comments_col:
+        table = _comment_table(index, rows)
+    else:
+        table = index.df.iloc[rows].drop(columns=[index.comments_col] if index.comments_col else []).reset_index(drop=True)
+    count = f"More than {MAX_CANDIDATES}" if len(candidates) > MAX_CANDIDATES else str(len(candidates))
+    result = f"{count} employees match that name; ask again with the full name of the one you mean."
+    return {"result": result, "is_structured": True, "table": table, "source": "index"}
+
+
+def answer_from_index(query, index):
+    """Answer name lookups and comment retrievals exactly, or return None."""
+    if index is None or not index.name_col:
+        return None
+    q = query.lower()
+    if any(word in q for word in LLM_WORDS):
+        return None
+
+    wants_comments = any(word in q for word in COMMENT_WORDS)
+    wants_details = any(re.search(rf"\b{w}\b", q) for w in DETAIL_WORDS)
+    if not (wants_comments or wants_details):
+        return None
+
+    name, candidates = index.match_name_in_query(query)
+    if name is None and candidates:
+        return _candidates_answer(index, candidates, wants_comments)
+    if wants_comments and index.comments_col:
+        if name is not None:
+            rows = index.rows(name)
+            comments = index.df.iloc[rows][index.comments_col].dropna().tolist()
+            display = index.df.iloc[rows[0]][index.name_col]
+            if not comments:
+                return {"result": f"No RMG comment recorded for {display}.", "is_structured": False, "table": None, "source": "index"}
+            if len(rows) == 1:
+                # The full comment, verbatim
+                return {"result": comments[0], "is_structured": False, "table": None, "source": "index"}
+            table = _comment_table(index, rows)
+            return {"result": table.to_csv(index=False), "is_structured": True, "table": table, "source": "index"}
+
+        match = SEARCH_PATTERN.search(q)
+        if match:
+            rows = index.search_comments(match.group(1))
+            if not rows:
+                return {"result": f"No RMG comments mention \"{match.group(1)}\".", "is_structured": False, "table": None, "source": "index"}
+            table = _comment_table(index, rows)
+            return {"result": table.to_csv(index=False), "is_structured": True, "table": table, "source": "index"}
+        return None
+
+    if wants_details and name is not None:
+        table = index.df.iloc[index.rows(name)]
+        if index.comments_col:
+            table = table.drop(columns=[index.comments_col])
+        table = table.reset_index(drop=True)
+        return {"result": table.to_csv(index=False), "is_structured": True, "table": table, "source": "index"}
+    return None
@@ -0,0 +1,273 @@
+import re
+
+import numpy as np
+import pandas as pd
+
+# Words that carry no filtering meaning in questions like
+# "list all Billable employees in Resource Pool Java".
+FILLER_WORDS = {
+    "a", "all", "an", "and", "answer", "any", "are", "as", "based", "by", "can", "column",
+    "columns", "count", "csv", "currently", "data", "dataset", "details", "display", "do",
+    "each", "employee", "employees", "every", "filter", "find", "for", "format", "from",
+    "get", "give", "has", "have", "how", "in", "is", "list", "many", "me", "members",
+    "name", "names", "number", "of", "on", "or", "people", "person", "please", "resource",
+    "resources", "show", "staff", "status", "structured", "table", "tabular", "that",
+    "the", "their", "there", "those", "total", "under", "what", "which", "who", "whose",
+    "with", "within", "you", "breakdown", "per", "wise", "across", "grouped", "group",
+}
+
+COUNT_PATTERNS = [r"\bhow many\b", r"\bcount\b", r"\bnumber of\b", r"\bheadcount\b", r"\btotal\b"]
+LIST_PATTERNS = [r"\blist\b", r"\bshow\b", r"\bdisplay\b", r"\bfilter\b", r"\btable\b", r"\bwho\b", r"\bwhich\b", r"\bcsv\b"]
+GROUP_PATTERN = r"\b(?:by|per|each|across|wise)\b"
+# Words asking for an interpretation of a breakdown rather than the bare numbers
+NARRATION_WORDS = {
+    "why", "explain", "summarize", "summarise", "summary", "insight", "insights", "trend", "trends",
+    "compare", "comparison", "most", "least", "highest", "lowest", "top", "largest", "smallest",
+    "biggest", "describe", "analyze", "analyse", "analysis", "distribution", "split", "percentage",
+    "share", "proportion", "ratio", "mostly", "fewest",
+}
+
+# Shorter values (IT, UI, QA, HR, ...) collide with ordinary words, so they
+# only count when written in the same case as the data.
+MIN_CASE_INSENSITIVE_LEN = 4
+
+NAME_COLUMN = "Employee Name"
+COMMENTS_COLUMN = "RMG Comments"
+COUNT_COLUMN = "Count"
+BLANK = "(blank)"
+# Columns a breakdown can be grouped by ("Billable Status by Resource Pool")
+MAX_GROUP_BY = 2
+
+
+def normalize_text(text):
+    return re.sub(r"\s+", " ", str(text)).strip().lower()
+
+
+def _phrase_pattern(phrase, ignore_case=True):
+    flags = re.IGNORECASE if ignore_case else 0
+    return re.compile(r"(?<!\w)" + re.escape(phrase) + r"(?!\w)", flags)
+
+
+def _find_spans(query, phrase, ignore_case=True):
+    return [m.span() for m in _phrase_pattern(phrase, ignore_case).finditer(query)]
+
+
+def _overlaps(span, taken):
+    return any(span[0] < end and start < span[1] for start, end in taken)
+
+
+def _mask(query, spans):
+    chars = list(query)
+    for start, end in spans:
+        for i in range(start, end):
+            chars[i] = " "
+    return "".join(chars)
+
+
+def plan_query(query, columns, value_map, narration_words=()):
+    """Match a question to a pandas filter/count/group-by, or return None.
+
+    ``value_map`` maps column names to their known categorical values. A
+    plan is only returned when every meaningful word of the question is
+    accounted for by an intent word, a column name or a known value, so
+    anything unusual is left to the LLM agent.
+
+    ``plan["group_by"]`` lists the columns a count is broken down by, in
+    the order the question names them: at most ``MAX_GROUP_BY`` named
+    columns that are not filtered on. A bare breakdown ("Billable Status by
+    Resource Pool") counts too.
+
+    Words in ``narration_words`` ("why", "most", ...) are then accepted
+    too: such a question becomes a count (grouped by the named, unfiltered
+    columns, even without "by") with ``plan["narrate"]`` set, meaning the
+    exact figures still need putting into words.
+    """
+    q = re.sub(r"\s+", " ", query).strip()
+    q_lower = q.lower()
+    if not q or "comment" in q_lower or "feedback" in q_lower:
+        return None
+
+    narrate = any(w in narration_words for w in re.findall(r"[a-z]+", q_lower))
+    is_count = narrate or any(re.search(p, q_lower) for p in COUNT_PATTERNS)
+    is_list = any(re.search(p, q_lower) for p in LIST_PATTERNS)
+    is_breakdown = bool(re.search(GROUP_PATTERN, q_lower))
+    if not (is_count or is_list or is_breakdown):
+        return None
+
+    # Column names mentioned in the query ("Resource Pool", "Billable Status", ...)
+    column_spans = {}
+    for col in sorted(columns, key=len, reverse=True):
+        spans = [s for s in _find_spans(q, col) if not _overlaps(s, [x for v in column_spans.values() for x in v])]
+        if spans:
+            column_spans[col] = spans
+    if not (is_count or is_list):
+        if not column_spans:
+            return None
+        is_count = True
+
+    # Candidate value matches, longest first so "Non Billable" beats "Billable"
+    candidates = []
+    for col, values in value_map.items():
+        if col not in columns:
+            continue
+        for value in values:
+            value = str(value).strip()
+            if not value:
+                continue
+            ignore_case = len(value) >= MIN_CASE_INSENSITIVE_LEN
+            for span in _find_spans(q, value, ignore_case):
+                candidates.append((span[1] - span[0], span, col, value))
+    candidates.sort(key=lambda c: -c[0])
+
+    taken_columns = [s for spans in column_spans.values() for s in spans]
+    by_span = {}
+    for _, span, col, value in candidates:
+        if _overlaps(span, taken_columns):
+            continue
+        if span in by_span:
+            by_span[span].append((col, value))
+        elif not _overlaps(span, by_span):
+            by_span[span] = [(col, value)]
+
+    filters = {}
+    used_spans = []
+    for span, matches in by_span.items():
+        cols = {col for col, _ in matches}
+        if len(cols) > 1:
+            # Same value in several columns ("Java", "Management"): only
+            # confident when the query names exactly one of those columns.
+            named = [c for c in cols if c in column_spans]
+            if len(named) != 1:
+                return None
+            matches = [m for m in matches if m[0] == named[0]]
+        col, value = matches[0]
+        filters.setdefault(col, [])
+        if value not in filters[col]:
+            filters[col].append(value)
+        used_spans.append(span)
+
+    # Group-by columns: named columns that are not themselves being filtered on
+    group_cols = [c for c in sorted(column_spans, key=lambda c: column_spans[c][0]) if c not in filters]
+    group_by = []
+    if is_count and is_breakdown:
+        if not 1 <= len(group_cols) <= MAX_GROUP_BY:
+            return None
+        group_by = group_cols
+    elif narrate:
+        if len(group_cols) > MAX_GROUP_BY:
+            return None
+        group_by = group_cols
+
+    if not filters and not group_by:
+        return None
+
+    # Every leftover word must be filler, otherwise the question says more than we understood
+    rest = _mask(q, used_spans + [s for spans in column_spans.values() for s in spans]).lower()
+    leftover = [w for w in re.findall(r"[a-z0-9]+", rest) if w not in FILLER_WORDS and w not in narration_words]
+    if leftover:
+        return None
+
+    wants_names = bool(re.search(r"\bnames?\b", q_lower)) and NAME_COLUMN in columns
+    return {
+        "action": "count" if is_count else "list",
+        "filters": filters,
+        "group_by": group_by,
+        "columns": [NAME_COLUMN] if wants_names else None,
+        "narrate": narrate,
+    }
+
+
+def _normalized(s):
+    return s.astype("string").str.strip().str.lower().str.replace(r"\s+", " ", regex=True)
+
+
+def _matches(s, wanted):
+    if isinstance(s.dtype, pd.CategoricalDtype):
+        # Each distinct value is normalized once; rows are matched by their code (-1, missing, never matches)
+        hits = _normalized(pd.Series(s.cat.categories)).isin(wanted).fillna(False).to_numpy(dtype=bool)
+        return pd.Series(np.append(hits, False)[s.cat.codes.to_numpy()], index=s.index)
+    return _normalized(s).isin(wanted).fillna(False).astype(bool)
+
+
+def apply_filters(df, filters):
+    mask = pd.Series(True, index=df.index)
+    for col, values in filters.items():
+        mask &= _matches(df[col], {normalize_text(v) for v in values})
+    return df[mask]
+
+
+def sort_counts(table):
+    """Largest counts first, ties in label order."""
+    cols = [c for c in table.columns if c != COUNT_COLUMN]
+    return table.sort_values(
+        [COUNT_COLUMN, *cols],
+        ascending=[False] + [True] * len(cols),
+        key=lambda s: s if s.name == COUNT_COLUMN else s.astype(str),
+        kind="stable",
+    ).reset_index(drop=True)
+
+
+def describe_filters(filters):
+    return "; ".join(f"{col} = {' or '.join(values)}" for col, values in filters.items())
+
+
+def execute_plan(plan, df):
+    """Run a plan from :func:`plan_query` and return a response dict like ``handle_user_query``."""
+    matched = apply_filters(df, plan["filters"])
+    condition = describe_filters(plan["filters"])
+
+    if plan["action"] == "count":
+        if plan["group_by"]:
+            cols = plan["group_by"]
+            # observed: categoricals would also list the categories no matched row has
+            table = matched.groupby(cols, dropna=False, observed=True, sort=False).size().reset_index(name=COUNT_COLUMN)
+            for col in cols:
+                table[col] = table[col].astype(object).fillna(BLANK)
+            table = sort_counts(table)
+            return {
+                "result": table.to_csv(index=False),
+                "is_structured": True,
+                "table": table,
+                "source": "planner",
+            }
+        return {
+            "result": f"{len(matched)} employees match {condition}.",
+            "is_structured": False,
+            "table": None,
+            "source": "planner",
+        }
+
+    if matched.empty:
+        return {
+            "result": f"No employees match {condition}.",
+            "is_structured": False,
+            "table": None,
+            "source": "planner",
+        }
+
+    # Comments are served by the comments agent, not in filter listings
+    table = matched[plan["columns"]] if plan["columns"] else matched.drop(columns=[COMMENTS_COLUMN], errors="ignore")
+    return {
+        "result": table.to_csv(index=False),
+        "is_structured": True,
+        "table": table.reset_index(drop=True),
+        "source": "planner",
+    }
+
+
+def answer_locally(query, df, value_map, cubes=None):
+    """Answer ``query`` straight from ``df`` when it can be planned confidently, else None.
+
+    Counts are read from the precomputed ``cubes`` when they cover the
+    columns involved.
+    """
+    if df is None or df.empty:
+        return None
+    plan = plan_query(query, list(df.columns), value_map)
+    if plan is None:
+        return None
+    if plan["action"] == "count" and cubes is not None:
+        response = cubes.answer(plan)
+        if response is not None:
+            return response
+    return execute_plan(plan, df)
@@ -0,0 +1,216 @@
+"""Incremental refresh of a sheet when a new version of its workbook is uploaded.
+
+When a sheet is parsed, the fingerprint of every row (see
+:class:`ingest.RawSheet`) is stored next to its snapshot. A new version of
+the workbook is only scanned at the byte level: rows whose fingerprint the
+previous version has are copied from the previous snapshot and only the
+others are decoded. The :class:`RowDiff` that comes out of it lets the name
+index, the cubes, the value dictionary and the response cache update
+instead of being rebuilt.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+from ingest import compact_dtypes, present_values
+from name_index import NAME_COLUMN
+
+# Identifies a row across versions, so an edited row counts as changed rather than removed and added
+REFRESH_KEY_COLUMN = os.getenv("REFRESH_KEY_COLUMN", NAME_COLUMN)
+# Values checked at a time when testing whether a text column became numeric
+NUMERIC_PROBE_ROWS = 1_000
+
+
+def _match(values, previous):
+    # Position in ``previous`` of each value (-1 if none); repeated values pair up in order
+    occurrence = pd.Series(values).groupby(values).cumcount().to_numpy()
+    previous_occurrence = pd.Series(previous).groupby(previous).cumcount().to_numpy()
+    index = pd.MultiIndex.from_arrays([previous, previous_occurrence])
+    return index.get_indexer(pd.MultiIndex.from_arrays([values, occurrence]))
+
+
+class RowDiff:
+    """How the rows of a sheet changed between two versions.
+
+    ``source[i]`` is the row of the previous frame that row ``i`` of the new
+    frame was copied from, or -1 for rows decoded from the new workbook. A
+    decoded row sharing its key with a dropped row is a changed row; other
+    decoded rows were added and other dropped rows were removed.
+    """
+
+    def __init__(self, source, old_rows, changed_columns=(), added=0, removed=0, changed=0):
+        self.source = source
+        self.old_rows = old_rows
+        self.changed_columns = set(changed_columns)
+        self.rows_added = added
+        self.rows_removed = removed
+        self.rows_changed = changed
+
+    @classmethod
+    def unchanged(cls, rows):
+        return cls(np.arange(rows), rows)
+
+    @property
+    def decoded(self):
+        """Positions in the new frame of the rows decoded from the new workbook."""
+        return np.flatnonzero(self.source < 0)
+
+    @property
+    def dropped(self):
+        """Positions in the previous frame of the rows not copied over."""
+        kept = np.zeros(self.old_rows, dtype=bool)
+        kept[self.source[self.source >= 0]] = True
+        return np.flatnonzero(~kept)
+
+    def new_positions(self):
+        """For every row of the previous frame, its position in the new frame (-1 when dropped)."""
+        positions = np.full(self.old_rows, -1, dtype=np.int64)
+        kept = self.source >= 0
+        positions[self.source[kept]] = np.flatnonzero(kept)
+        return positions
+
+    def affects(self, reads=None):
+        """Whether an answer computed from the columns ``reads`` may differ on the new version.
+
+        Added or removed rows can change any count or listing. Changed rows
+        affect answers that read a changed column, and every answer whose
+        columns are not known (``reads`` None): what an agent's answer
+        depended on cannot be told from the question.
+        """
+        if self.rows_added or self.rows_removed:
+            return True
+        if not self.rows_changed:
+            return False
+        return reads is None or bool(self.changed_columns & set(reads))
+
+    def summary(self):
+        return {
+            "added": self.rows_added,
+            "removed": self.rows_removed,
+            "changed": self.rows_changed,
+            "changed_columns": sorted(self.changed_columns),
+        }
+
+
+def _cast_like(decoded, previous):
+    # Decoded rows are strings; numeric and date columns of the previous frame keep their dtype if they can
+    for col in decoded.columns:
+        dtype = previous[col].dtype
+        if pd.api.types.is_datetime64_any_dtype(dtype):
+            values = pd.to_datetime(decoded[col], format="ISO8601", errors="coerce")
+        elif pd.api.types.is_numeric_dtype(dtype) and not pd.api.types.is_bool_dtype(dtype):
+            values = pd.to_numeric(decoded[col], errors="coerce")
+        else:
+            continue
+        if not values[present_values(decoded[col])].notna().all():
+            return None
+        decoded[col] = values
+    return decoded
+
+
+def _align_categories(previous, decoded):
+    # Categoricals stay categorical through concat only when both sides have the same categories
+    previous = previous.copy(deep=False)
+    for col in previous.columns:
+        if isinstance(previous[col].dtype, pd.CategoricalDtype):
+            categories = previous[col].cat.categories.union(pd.Index(decoded[col].dropna().unique()))
+            previous[col] = previous[col].cat.set_categories(categories)
+            decoded[col] = pd.Categorical(decoded[col], categories=categories)
+    return previous, decoded
+
+
+def _is_numeric_text(s):
+    present = s[present_values(s)]
+    if present.empty:
+        return False
+    for start in range(0, len(present), NUMERIC_PROBE_ROWS):
+        # Text columns usually show a non-number in the first chunk
+        if pd.to_numeric(present.iloc[start:start + NUMERIC_PROBE_ROWS], errors="coerce").isna().any():
+            return False
+    return True
+
+
+def _settle_dtypes(frame, decoded):
+    # Give columns the dtypes infer_numeric_columns would give the whole new sheet
+    for col in frame.columns:
+        s = frame[col]
+        if pd.api.types.is_float_dtype(s.dtype):
+            if s.notna().all() and (s % 1 == 0).all():
+                frame[col] = s.astype("int64")
+        elif isinstance(s.dtype, pd.CategoricalDtype):
+            # Only the values still present count
+            values = pd.Series(s.cat.remove_unused_categories().cat.categories)
+            if _is_numeric_text(values):
+                frame[col] = pd.to_numeric(s.astype(object), errors="coerce")
+        elif s.dtype == object or pd.api.types.is_string_dtype(s.dtype):
+            # A text column becomes numeric once its last text value is gone
+            new_values = decoded[col][present_values(decoded[col])]
+            if pd.to_numeric(new_values, errors="coerce").notna().all() and _is_numeric_text(s):
+                frame[col] = pd.to_numeric(s, errors="coerce")
+    return frame
+
+
+def _compare_pairs(previous, frame, dropped, decoded, key_column):
+    # Pair dropped and decoded rows by key to tell changed rows from added/removed ones
+    if key_column not in frame.columns or not len(dropped) or not len(decoded):
+        return set(), 0, 0
+    old_keys = previous[key_column].iloc[dropped].to_numpy(dtype=object)
+    new_keys = frame[key_column].iloc[decoded].to_numpy(dtype=object)
+    old_present = pd.notna(old_keys)
+    new_present = pd.notna(new_keys)
+    old_rows, new_rows = dropped[old_present], decoded[new_present]
+    match = _match(new_keys[new_present].astype(str), old_keys[old_present].astype(str))
+    paired = match >= 0
+    before = previous.iloc[old_rows[match[paired]]].reset_index(drop=True)
+    after = frame.iloc[new_rows[paired]].reset_index(drop=True)
+    differs = ~((before == after) | (before.isna() & after.isna()))
+    changed_rows = differs.any(axis=1).to_numpy()
+    changed_columns = {col for col in frame.columns if differs[col].any()}
+    return changed_columns, int(paired.sum()), int(changed_rows.sum())
+
+
+def refresh_frame(raw, previous, previous_fingerprints, key_column=None):
+    """``(frame, diff)`` for a new version of a sheet, reusing the unchanged rows of ``previous``.
+
+    ``raw`` is the new version's :class:`ingest.RawSheet`, ``previous`` the
+    previous version's frame and ``previous_fingerprints`` the fingerprints
+    stored with it (header first), which ``raw`` should have been scanned
+    with. Returns None when the header changed, a numeric column got a text
+    value, a row reaches past the header or openpyxl cannot decode single
+    rows; the sheet is then parsed in full.
+    """
+    key_column = key_column or REFRESH_KEY_COLUMN
+    if not raw.header_is_first_row or not len(raw.fingerprints) or len(previous_fingerprints) != len(previous) + 1:
+        return None
+    if raw.fingerprints[0] != previous_fingerprints[0]:
+        return None
+
+    source = _match(raw.fingerprints[1:], previous_fingerprints[1:])
+    decoded_positions = np.flatnonzero(source < 0)
+    if len(decoded_positions) and not raw.decodable:
+        return None
+    # Columns past the header last only while a row reaches them
+    if raw.decodable and len(previous.columns) > len(raw.columns()):
+        return None
+    decoded = raw.frame(decoded_positions + 1, list(previous.columns))
+    if decoded is None:
+        return None
+    decoded = _cast_like(decoded, previous)
+    if decoded is None:
+        return None
+    previous, decoded = _align_categories(previous, decoded)
+
+    take = source.copy()
+    take[decoded_positions] = len(previous) + np.arange(len(decoded_positions))
+    frame = pd.concat([previous, decoded], ignore_index=True).take(take).reset_index(drop=True)
+    frame = _settle_dtypes(frame, decoded)
+
+    dropped = RowDiff(source, len(previous)).dropped
+    changed_columns, paired, changed = _compare_pairs(previous, frame, dropped, decoded_positions, key_column)
+    frame = compact_dtypes(frame)
+    diff = RowDiff(
+        source, len(previous), changed_columns,
+        added=len(decoded_positions) - paired, removed=len(dropped) - paired, changed=changed,
+    )
+    return frame, diff
@@ -0,0 +1,160 @@
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+from io import StringIO
+
+import pandas as pd
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    dataset TEXT NOT NULL,
+    query TEXT NOT NULL,
+    result TEXT NOT NULL,
+    is_structured INTEGER NOT NULL,
+    table_json TEXT,
+    created REAL NOT NULL,
+    accessed REAL NOT NULL,
+    reads TEXT
+);
+CREATE INDEX IF NOT EXISTS responses_dataset ON responses (dataset);
+CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed);
+CREATE TABLE IF NOT EXISTS workbooks (
+    name TEXT PRIMARY KEY,
+    dataset TEXT NOT NULL
+);
+"""
+
+
+def normalize_query(query):
+    query = " ".join(query.lower().split())
+    return re.sub(r"[\s?.!]+$", "", query)
+
+
+class ResponseCache:
+    """SQLite-backed cache of final answers (text and parsed table).
+
+    Entries are keyed by dataset content hash, prompt template version and
+    normalized query, expire after ``ttl_seconds`` and are evicted least
+    recently used first beyond ``max_entries``.
+    """
+
+    def __init__(self, path, prompt_version, max_entries=5000, ttl_seconds=7 * 24 * 3600):
+        self.path = str(path)
+        self.prompt_version = str(prompt_version)
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(SCHEMA)
+            # Caches written before answers recorded the columns they read
+            if "reads" not in {row[1] for row in self._conn.execute("PRAGMA table_info(responses)")}:
+                self._conn.execute("ALTER TABLE responses ADD COLUMN reads TEXT")
+
+    def _key(self, dataset, query):
+        raw = f"{dataset}\0{self.prompt_version}\0{normalize_query(query)}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, dataset, query):
+        key = self._key(dataset, query)
+        now = time.time()
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT result, is_structured, table_json, created FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or now - row[3] > self.ttl_seconds:
+                if row is not None:
+                    self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            self.hits += 1
+
+        result, is_structured, table_json, _ = row
+        table = None
+        if table_json is not None:
+            # dtype=False keeps codes like "0339" as strings
+            table = pd.read_json(StringIO(table_json), orient="split", dtype=False, convert_dates=False)
+        return {"result": result, "is_structured": bool(is_structured), "table": table, "source": "cache"}
+
+    def put(self, dataset, query, response, reads=None):
+        """Cache ``response``; ``reads`` lists the columns it was computed from, when they are known."""
+        table = response.get("table")
+        table_json = table.to_json(orient="split", index=False, date_format="iso") if table is not None else None
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    self._key(dataset, query), dataset, normalize_query(query), response["result"],
+                    int(bool(response.get("is_structured"))), table_json, now, now,
+                    json.dumps(sorted(reads)) if reads is not None else None,
+                ),
+            )
+            self._evict(now)
+
+    def _evict(self, now):
+        self._conn.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl_seconds,))
+        self._conn.execute(
+            "DELETE FROM responses WHERE key IN ("
+            " SELECT key FROM responses ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        )
+
+    def invalidate(self, dataset):
+        with self._lock, self._conn:
+            return self._conn.execute("DELETE FROM responses WHERE dataset = ?", (dataset,)).rowcount
+
+    def carry_over(self, previous, dataset, keep):
+        """Copy answers cached for dataset ``previous`` to ``dataset`` where ``keep(reads)`` holds.
+
+        Used when ``dataset`` is a refreshed version of ``previous``;
+        ``reads`` are the columns the answer was computed from, or None when
+        they are not known (answers written by the agent).
+        """
+        with self._lock, self._conn:
+            rows = self._conn.execute(
+                "SELECT key, query, result, is_structured, table_json, created, accessed, reads FROM responses WHERE dataset = ?",
+                (previous,),
+            ).fetchall()
+            copied = 0
+            for key, query, result, is_structured, table_json, created, accessed, reads in rows:
+                # Answers of older prompt versions stay behind
+                if key != self._key(previous, query):
+                    continue
+                if not keep(json.loads(reads) if reads is not None else None):
+                    continue
+                self._conn.execute(
+                    "INSERT OR IGNORE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (self._key(dataset, query), dataset, query, result, is_structured, table_json, created, accessed, reads),
+                )
+                copied += 1
+        return copied
+
+    def register_workbook(self, name, dataset):
+        """Record the current version of a workbook, dropping answers cached for its previous version."""
+        with self._lock, self._conn:
+            row = self._conn.execute("SELECT dataset FROM workbooks WHERE name = ?", (name,)).fetchone()
+            self._conn.execute("INSERT OR REPLACE INTO workbooks VALUES (?, ?)", (name, dataset))
+            if row is not None and row[0] != dataset:
+                self._conn.execute("DELETE FROM responses WHERE dataset = ?", (row[0],))
+                return row[0]
+        return None
+
+    def stats(self):
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        total = self.hits + self.misses
+        return {
+            "entries": entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
@@ -0,0 +1,160 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.ipc as ipc
+
+# Managed directory for columnar workbook snapshots (one sub-directory per content hash).
+SNAPSHOT_DIR = Path(os.getenv("SNAPSHOT_DIR", Path(tempfile.gettempdir()) / "excel_ai_chat" / "snapshots"))
+SNAPSHOT_MAX_MB = int(os.getenv("SNAPSHOT_MAX_MB", "2048"))
+SNAPSHOT_MAX_AGE_DAYS = float(os.getenv("SNAPSHOT_MAX_AGE_DAYS", "7"))
+# Bump when the ingested frame changes shape or dtypes so stale snapshots are ignored.
+SNAPSHOT_FORMAT = 2
+
+
+def snapshot_path(key, name="data", root=None):
+    return Path(root or SNAPSHOT_DIR) / key / f"{name}.v{SNAPSHOT_FORMAT}.arrow"
+
+
+def has_snapshot(key, name="data", root=None):
+    return snapshot_path(key, name, root).exists()
+
+
+def write_snapshot(df, key, name="data", root=None):
+    """Persist ``df`` once as an uncompressed Arrow IPC file.
+
+    Uncompressed IPC buffers can be memory-mapped and wrapped without
+    copying, so re-opening a snapshot costs almost nothing compared to
+    re-parsing a CSV or the original workbook. Columns are written as one
+    chunk each: a column split into chunks has to be concatenated, that is
+    copied, when it is read back.
+    """
+    path = snapshot_path(key, name, root)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    table = pa.Table.from_pandas(df, preserve_index=False).combine_chunks()
+
+    # Write to a sibling temp file first so readers never see a partial snapshot.
+    fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+    os.close(fd)
+    try:
+        with pa.OSFile(tmp, "wb") as sink:
+            with ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(tmp, path)
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+    return path
+
+
+def read_snapshot_table(key, name="data", root=None):
+    path = snapshot_path(key, name, root)
+    source = pa.memory_map(str(path), "r")
+    table = ipc.open_file(source).read_all()
+    # Opening counts as use for the age/size based cleanup.
+    os.utime(path.parent)
+    return table
+
+
+def read_snapshot(key, name="data", root=None):
+    """The snapshot as a DataFrame.
+
+    Only text columns stay in the memory-mapped file; pandas wraps their
+    Arrow buffers as they are. Numbers, dates and categorical codes are
+    copied into writable arrays, which for a typical sheet of repeated
+    labels is a small fraction of its size.
+    """
+    return read_snapshot_table(key, name, root).to_pandas()
+
+
+def catalog_path(key, root=None):
+    return Path(root or SNAPSHOT_DIR) / key / f"catalog.v{SNAPSHOT_FORMAT}.json"
+
+
+def read_catalog(key, root=None):
+    """Sheet catalog saved for a workbook, or None."""
+    try:
+        with open(catalog_path(key, root), encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def write_catalog(catalog, key, root=None):
+    path = catalog_path(key, root)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(catalog, f)
+    os.replace(tmp, path)
+    return path
+
+
+def versions_path(root=None):
+    return Path(root or SNAPSHOT_DIR) / "versions.json"
+
+
+def _read_versions(root=None):
+    try:
+        with open(versions_path(root), encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def previous_version(name, key, root=None):
+    """Content hash of the last other version of workbook ``name`` seen, or None."""
+    previous = _read_versions(root).get(name)
+    return previous if previous != key else None
+
+
+def record_version(name, key, root=None):
+    """Remember ``key`` as the latest version of workbook ``name`` (by file name)."""
+    versions = _read_versions(root)
+    if versions.get(name) == key:
+        return
+    versions[name] = key
+    path = versions_path(root)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(versions, f)
+    os.replace(tmp, path)
+
+
+def prune_snapshots(max_bytes=None, max_age_seconds=None, keep=(), root=None):
+    """Delete snapshots older than the age limit, then least recently used ones over the size limit."""
+    root = Path(root or SNAPSHOT_DIR)
+    if not root.exists():
+        return []
+    if max_bytes is None:
+        max_bytes = SNAPSHOT_MAX_MB * 1024 * 1024
+    if max_age_seconds is None:
+        max_age_seconds = SNAPSHOT_MAX_AGE_DAYS * 24 * 3600
+
+    entries = []
+    for d in root.iterdir():
+        if not d.is_dir():
+            continue
+        try:
+            size = sum(f.stat().st_size for f in d.iterdir() if f.is_file())
+            entries.append((d.stat().st_mtime, size, d))
+        except FileNotFoundError:
+            continue
+    entries.sort()
+
+    now = time.time()
+    removed = []
+    total = sum(size for _, size, _ in entries)
+    for mtime, size, d in entries:
+        if d.name in keep:
+            continue
+        if now - mtime > max_age_seconds or total > max_bytes:
+            shutil.rmtree(d, ignore_errors=True)
+            total -= size
+            removed.append(d.name)
+    return removed
@@ -0,0 +1,175 @@
+import csv
+import queue
+import threading
+
+import pandas as pd
+from langchain_core.callbacks import BaseCallbackHandler
+
+FINAL_ANSWER_MARKER = "Final Answer:"
+_DONE = object()
+
+
+class RunCancelled(Exception):
+    """Raised inside an agent run whose stream was abandoned."""
+
+
+class AgentStreamHandler(BaseCallbackHandler):
+    """Turn agent callbacks into a queue of UI events.
+
+    Events are dicts with a ``type`` of ``"step"`` (the agent decided to run
+    a tool), ``"observation"`` (the tool output) or ``"token"`` (a piece of
+    the final answer). Tokens before ``Final Answer:`` in each LLM call are
+    the agent's reasoning and are not forwarded as answer text.
+
+    After :meth:`cancel` the run stops at its next LLM call, token or tool.
+    """
+
+    # Let RunCancelled through instead of logging it
+    raise_error = True
+
+    def __init__(self):
+        self.events = queue.Queue()
+        self._reset()
+        self.cancelled = threading.Event()
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def _check(self):
+        if self.cancelled.is_set():
+            raise RunCancelled()
+
+    def _reset(self):
+        self._buffer = ""
+        self._in_answer = False
+        self._answered = False
+
+    def on_llm_start(self, serialized, prompts, **kwargs):
+        self._check()
+        self._reset()
+
+    def on_chat_model_start(self, serialized, messages, **kwargs):
+        self._check()
+        self._reset()
+
+    def _answer(self, text):
+        # The space after "Final Answer:" may arrive in a later token than the marker
+        if not self._answered:
+            text = text.lstrip()
+        if text:
+            self._answered = True
+            self.events.put({"type": "token", "text": text})
+
+    def on_llm_new_token(self, token, **kwargs):
+        self._check()
+        if self._in_answer:
+            self._answer(token)
+            return
+        self._buffer += token
+        marker = self._buffer.find(FINAL_ANSWER_MARKER)
+        if marker != -1:
+            self._in_answer = True
+            self._answer(self._buffer[marker + len(FINAL_ANSWER_MARKER):])
+
+    def on_agent_action(self, action, **kwargs):
+        self._check()
+        self.events.put({"type": "step", "tool": action.tool, "input": str(action.tool_input), "log": action.log})
+
+    def on_tool_start(self, serialized, input_str, **kwargs):
+        self._check()
+
+    def on_tool_end(self, output, **kwargs):
+        self.events.put({"type": "observation", "text": str(output)})
+
+
+def stream_agent_run(agent, prompt, handler=None, callbacks=None):
+    """Run ``agent`` on ``prompt`` in a worker thread and yield its events as they happen.
+
+    ``callbacks`` are extra callback handlers passed to the run. The last
+    event is ``{"type": "final", "output": ...}``; errors raised by the
+    agent are re-raised in the caller's thread.
+
+    Closing the generator early cancels the run and waits for the worker
+    to stop, so the agent is idle again once ``close()`` returns and can
+    safely go back to its pool.
+    """
+    handler = handler or AgentStreamHandler()
+    outcome = {}
+
+    def worker():
+        try:
+            outcome["output"] = agent.run(prompt, callbacks=[handler, *(callbacks or [])])
+        except BaseException as e:
+            outcome["error"] = e
+        finally:
+            handler.events.put(_DONE)
+
+    thread = threading.Thread(target=worker, daemon=True)
+    thread.start()
+    try:
+        while True:
+            event = handler.events.get()
+            if event is _DONE:
+                break
+            yield event
+    except GeneratorExit:
+        handler.cancel()
+        thread.join()
+        raise
+    thread.join()
+
+    if "error" in outcome:
+        raise outcome["error"]
+    yield {"type": "final", "output": outcome["output"]}
+
+
+class IncrementalCSVParser:
+    """Parse a ```csv fenced block out of streamed text, one complete line at a time."""
+
+    def __init__(self):
+        self.text = ""
+        self.header = None
+        self.rows = []
+        self._pos = None
+        self.closed = False
+
+    def feed(self, chunk):
+        """Add streamed text; return the rows completed by it."""
+        if self.closed:
+            return []
+        self.text += chunk
+        if self._pos is None:
+            fence = self.text.find("```csv")
+            if fence == -1:
+                return []
+            newline = self.text.find("\n", fence)
+            if newline == -1:
+                return []
+            self._pos = newline + 1
+
+        new_rows = []
+        while True:
+            newline = self.text.find("\n", self._pos)
+            if newline == -1:
+                break
+            line = self.text[self._pos:newline]
+            self._pos = newline + 1
+            if line.strip().startswith("```"):
+                self.closed = True
+                break
+            if not line.strip():
+                continue
+            values = next(csv.reader([line]))
+            if self.header is None:
+                self.header = values
+            else:
+                self.rows.append(values)
+                new_rows.append(values)
+        return new_rows
+
+    def frame(self):
+        if self.header is None:
+            return None
+        width = len(self.header)
+        rows = [(r + [None] * width)[:width] for r in self.rows]
+        return pd.DataFrame(rows, columns=self.header)
@@ -0,0 +1,44 @@
+import io
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+# Snapshots written while testing stay out of the shared temp directory
+os.environ.setdefault("SNAPSHOT_DIR", tempfile.mkdtemp(prefix="excel_ai_chat_tests_"))
+
+from benchmark import generate_workbook, make_fake_llm  # noqa: E402
+from chat_engine import load_dataset_bytes  # noqa: E402
+from dataset_cache import DatasetCache  # noqa: E402
+from ingest import compact_dtypes, infer_numeric_columns, read_sheet  # noqa: E402
+from value_dictionary import build_value_dictionary  # noqa: E402
+
+ROWS = 300
+
+
+@pytest.fixture(scope="session")
+def workbook_bytes(tmp_path_factory):
+    path = generate_workbook(ROWS, tmp_path_factory.mktemp("workbooks") / "rmg.xlsx", seed=1)
+    return path.read_bytes()
+
+
+@pytest.fixture(scope="session")
+def sheet(workbook_bytes):
+    """The synthetic sheet as loaded (compact dtypes) and its value dictionary."""
+    df = compact_dtypes(infer_numeric_columns(read_sheet(io.BytesIO(workbook_bytes))))
+    return df, build_value_dictionary(df)
+
+
+@pytest.fixture
+def load_dataset(workbook_bytes):
+    """Load the synthetic workbook behind a fake LLM; keyword arguments go to load_dataset_bytes."""
+
+    def load(data=workbook_bytes, llm=None, **kwargs):
+        cache = DatasetCache(max_bytes=1024 * 1024 * 1024)
+        return load_dataset_bytes(data, "rmg.xlsx", cache, llm=llm or make_fake_llm(), **kwargs)
+
+    return load
@@ -0,0 +1,86 @@
+import threading
+import time
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.language_models.chat_models import SimpleChatModel
+
+from benchmark import FAKE_ACTION, FAKE_FINAL_ANSWER, LLM_QUERY, make_fake_llm
+from chat_engine import answer_query, answer_query_stream
+
+
+class SlowSecondCall(BaseCallbackHandler):
+    """Keep the agent busy in its second LLM call, after the first step was streamed."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def on_chat_model_start(self, serialized, messages, **kwargs):
+        self.calls += 1
+        if self.calls == 2:
+            time.sleep(0.5)
+
+
+class ScriptedChatModel(SimpleChatModel):
+    """The fake agent script, picked by what the prompt already holds, so runs can share it."""
+
+    delay: float = 0.2
+    in_use: list = []
+    pool: object = None
+
+    def _call(self, messages, stop=None, run_manager=None, **kwargs):
+        if self.pool is not None:
+            self.in_use.append(self.pool.stats()["in_use"])
+        time.sleep(self.delay)
+        return FAKE_FINAL_ANSWER if "the user sees the full table" in messages[-1].content else FAKE_ACTION
+
+    @property
+    def _llm_type(self):
+        return "scripted"
+
+
+def _workers():
+    return [t for t in threading.enumerate() if t.name.endswith("(worker)")]
+
+
+def test_abandoned_stream_releases_agent_after_run_ends(load_dataset):
+    dataset = load_dataset(llm=make_fake_llm(callbacks=[SlowSecondCall()]), pool_size=1)
+
+    events = answer_query_stream(LLM_QUERY, dataset)
+    assert next(events)["type"] == "step"
+    events.close()
+
+    assert not _workers()
+    assert dataset["agents"].stats() == {"agents": 1, "in_use": 0, "max": 1}
+    # The cancelled run never asked for its final answer; start the fake LLM's script over
+    dataset["llm"].i = 0
+    response = answer_query(LLM_QUERY, dataset)
+    assert response["source"] == "llm"
+    assert response["table"] is not None
+
+
+def test_pool_reuses_agents(load_dataset):
+    dataset = load_dataset(pool_size=2)
+    for _ in range(3):
+        answer_query(LLM_QUERY, dataset)
+    assert dataset["agents"].stats() == {"agents": 1, "in_use": 0, "max": 2}
+
+
+def test_concurrent_questions_share_the_pool(load_dataset):
+    llm = ScriptedChatModel()
+    dataset = load_dataset(llm=llm, pool_size=2)
+    llm.pool = dataset["agents"]
+    responses = []
+    threads = [threading.Thread(target=lambda: responses.append(answer_query(LLM_QUERY, dataset))) for _ in range(4)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    assert len(responses) == 4
+    assert all(r["source"] == "llm" and r["table"] is not None for r in responses)
+    # Two questions ran at a time, never more; the other two waited for an agent
+    assert max(llm.in_use) == 2
+    assert dataset["agents"].stats() == {"agents": 2, "in_use": 0, "max": 2}
+    assert elapsed < 4 * 2 * llm.delay
@@ -0,0 +1,60 @@
+import pandas as pd
+import pytest
+
+from aggregates import AggregateCubes
+from query_planner import NARRATION_WORDS, execute_plan, plan_query
+
+
+@pytest.fixture(scope="module")
+def cubes(sheet):
+    df, value_dict = sheet
+    return AggregateCubes(df, value_dict)
+
+
+def _plan(sheet, query):
+    df, value_dict = sheet
+    return plan_query(query, list(df.columns), value_dict, narration_words=NARRATION_WORDS)
+
+
+@pytest.mark.parametrize("query, filters, group_by", [
+    ("Billable Status by Resource Pool", {}, ["Billable Status", "Resource Pool"]),
+    ("count Employment Status by Business Unit", {}, ["Employment Status", "Business Unit"]),
+    ("how many employees by Billable Status and Resource Pool", {}, ["Billable Status", "Resource Pool"]),
+    ("how many Billable employees by Resource Pool", {"Billable Status": ["Billable"]}, ["Resource Pool"]),
+    ("how many FTE employees by Business Unit and Billable Status", {"Employment Type": ["FTE"]}, ["Business Unit", "Billable Status"]),
+    ("how many people are On Notice", {"Employment Status": ["On Notice"]}, []),
+])
+def test_cube_counts_match_the_sheet(sheet, cubes, query, filters, group_by):
+    df, _ = sheet
+    plan = _plan(sheet, query)
+    assert plan["action"] == "count"
+    assert plan["filters"] == filters
+    assert plan["group_by"] == group_by
+
+    from_cube = cubes.answer(plan)
+    from_sheet = execute_plan(plan, df)
+    assert from_cube["source"] == "cube"
+    if group_by:
+        assert list(from_cube["table"].columns) == [*group_by, "Count"]
+        pd.testing.assert_frame_equal(from_cube["table"], from_sheet["table"], check_dtype=False)
+    else:
+        assert from_cube["result"] == from_sheet["result"]
+
+
+def test_two_key_counts(sheet, cubes):
+    df, _ = sheet
+    table = cubes.count({}, ["Billable Status", "Business Unit"])
+    expected = df.groupby(["Billable Status", "Business Unit"], observed=True).size()
+    assert table.set_index(["Billable Status", "Business Unit"])["Count"].sort_index().to_dict() == expected.sort_index().to_dict()
+    assert table["Count"].is_monotonic_decreasing
+    assert cubes.count({"Billable Status": ["billable"]}) == int((df["Billable Status"] == "Billable").sum())
+
+
+def test_more_than_two_breakdown_columns_go_to_the_llm(sheet):
+    assert _plan(sheet, "how many by Billable Status, Business Unit and Employment Type") is None
+
+
+def test_narrated_breakdown(sheet):
+    plan = _plan(sheet, "compare Billable Status across Business Unit")
+    assert plan["narrate"]
+    assert plan["group_by"] == ["Billable Status", "Business Unit"]
@@ -0,0 +1,48 @@
+from langchain_core.callbacks import BaseCallbackHandler
+
+import batch
+from benchmark import LLM_QUERY
+from chat_engine import answer_query
+
+
+class FailFirstCall(BaseCallbackHandler):
+    raise_error = True
+
+    def __init__(self):
+        self.calls = 0
+
+    def on_chat_model_start(self, serialized, messages, **kwargs):
+        self.calls += 1
+        if self.calls == 1:
+            raise ConnectionError("model unavailable")
+
+
+def test_rate_limit_counts_llm_calls(load_dataset, monkeypatch):
+    acquired = []
+    monkeypatch.setattr(batch.TokenBucket, "acquire", lambda self: acquired.append(1))
+    dataset = load_dataset()
+    questions = [("0", LLM_QUERY), ("1", "how many people are On Notice"), ("2", LLM_QUERY + "?")]
+
+    records = batch.run_batch(dataset, questions, concurrency=2, rate=100)
+
+    assert [r["error"] for r in records] == [None, None, None]
+    assert [r["source"] for r in records] == ["llm", "cube", "llm"]
+    assert [r["attempts"] for r in records] == [1, 0, 1]
+    # The fake agent takes one action and then answers: two LLM calls per question
+    assert len(acquired) == 4
+
+
+def test_failed_llm_step_is_retried(load_dataset):
+    dataset = load_dataset()
+    response = answer_query(LLM_QUERY, dataset, callbacks=[FailFirstCall()], retries=1, backoff=0)
+    assert response["attempts"] == 2
+    assert response["table"] is not None
+
+
+def test_read_questions(tmp_path):
+    text = tmp_path / "questions.txt"
+    text.write_text("first\n\nsecond\n")
+    assert batch.read_questions(text) == [("0", "first"), ("1", "second")]
+    records = tmp_path / "questions.jsonl"
+    records.write_text('{"id": "a", "question": "first"}\n')
+    assert batch.read_questions(records) == [("a", "first")]
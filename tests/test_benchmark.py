@@ -0,0 +1,25 @@
+import tracemalloc
+
+from benchmark import ANSWER_ROWS, answer_tables, measure
+from chat_engine import try_parse_csv_or_table
+
+
+def test_timed_run_is_not_traced():
+    traced = []
+    fresh = iter(range(2))
+    results = []
+    measure(results, 10, "stage", lambda arg: traced.append((arg, tracemalloc.is_tracing())) or bytearray(1 << 20),
+            extra=lambda value: {"size": len(value)}, setup=lambda: next(fresh))
+    assert traced == [(0, False), (1, True)]
+    assert not tracemalloc.is_tracing()
+    [record] = results
+    assert record["size"] == 1 << 20
+    assert record["peak_mb"] >= 1
+
+
+def test_answer_tables_parse_in_full(sheet):
+    df, _ = sheet
+    for text in answer_tables(df).values():
+        table = try_parse_csv_or_table(text)
+        assert list(table.columns) == ["Employee Name", "Resource Pool", "Billable Status"]
+        assert len(table) == min(ANSWER_ROWS, len(df))
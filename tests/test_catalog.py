@@ -0,0 +1,121 @@
+import threading
+from io import BytesIO
+
+import pytest
+from openpyxl import Workbook
+
+import catalog
+import snapshot
+from catalog import WorkbookSet, dataset_key
+from chat_engine import sheet_agents
+
+EMPLOYEES = [
+    ["Employee Name", "Billable Status", "Resource Pool"],
+    ["Asha Rao", "Billable", "Java"],
+    ["Ben Ode", "Non Billable", "QA"],
+    ["Chen Li", "Billable", "Java"],
+]
+SKILLS = [
+    ["Employee Name", "Certification", "Level"],
+    ["Asha Rao", "AWS Architect", 3],
+    ["Ben Ode", "ISTQB", 2],
+]
+
+
+def _workbook(**sheets):
+    wb = Workbook()
+    wb.remove(wb.active)
+    for title, rows in sheets.items():
+        ws = wb.create_sheet(title)
+        for row in rows:
+            ws.append(row)
+    data = BytesIO()
+    wb.save(data)
+    return data.getvalue()
+
+
+@pytest.fixture
+def snapshots(tmp_path, monkeypatch):
+    monkeypatch.setattr(snapshot, "SNAPSHOT_DIR", tmp_path)
+
+
+@pytest.fixture
+def parses(monkeypatch):
+    """Sheet names read_sheet parsed, in order."""
+    parsed = []
+    read_sheet = catalog.read_sheet
+
+    def counting(excel_file, sheet_name=None, **kwargs):
+        parsed.append(sheet_name)
+        return read_sheet(excel_file, sheet_name=sheet_name, **kwargs)
+
+    monkeypatch.setattr(catalog, "read_sheet", counting)
+    return parsed
+
+
+def test_routes_questions_to_the_sheet_they_name(snapshots):
+    workbooks = WorkbookSet([("rmg.xlsx", _workbook(Employees=EMPLOYEES, Skills=SKILLS))])
+    assert workbooks.primary == "Employees"
+    assert workbooks.route("how many billable employees are there") == ["Employees"]
+    assert workbooks.route("which certification does Asha Rao hold") == ["Skills"]
+    assert workbooks.route("list the skills sheet") == ["Skills"]
+    # A column of the primary sheet brings it in next to the sheet named
+    assert workbooks.route("certification by resource pool") == ["Employees", "Skills"]
+
+
+def test_sheets_load_on_first_use(snapshots, parses):
+    data = _workbook(Employees=EMPLOYEES, Skills=SKILLS)
+    workbooks = WorkbookSet([("rmg.xlsx", data)])
+    assert parses == []
+    assert [s["loaded"] for s in workbooks.summary()] == [False, False]
+    skills = workbooks.sheet("Skills")
+    assert parses == ["Skills"]
+    assert list(skills["Certification"]) == ["AWS Architect", "ISTQB"]
+    assert workbooks.sheet("Skills") is skills
+    assert parses == ["Skills"]
+    assert workbooks.is_loaded("Skills") and not workbooks.is_loaded("Employees")
+    # Another session on the same content reads the snapshot instead
+    assert WorkbookSet([("rmg.xlsx", data)]).sheet("Skills").equals(skills)
+    assert parses == ["Skills"]
+
+
+def test_several_workbooks(snapshots):
+    march = _workbook(Employees=EMPLOYEES, Skills=SKILLS)
+    april = _workbook(Employees=EMPLOYEES[:3])
+    workbooks = WorkbookSet([("rmg_march.xlsx", march), ("rmg_april.xlsx", april)])
+    assert workbooks.key == dataset_key([march, april])
+    assert [s["id"] for s in workbooks.sheets] == ["rmg_march / Employees", "rmg_march / Skills", "rmg_april / Employees"]
+    assert workbooks.route("billable employees in april") == ["rmg_april / Employees"]
+    assert len(workbooks.sheet("rmg_april / Employees")) == 2
+
+
+def test_describe_maps_frames_to_sheets(snapshots):
+    workbooks = WorkbookSet([("rmg.xlsx", _workbook(Employees=EMPLOYEES, Skills=SKILLS))])
+    text = workbooks.describe(["Employees", "Skills"])
+    assert 'df1 = sheet "Employees" of rmg.xlsx (3 rows)' in text
+    assert 'df2 = sheet "Skills" of rmg.xlsx (2 rows); columns: Employee Name, Certification, Level' in text
+    assert "shared columns (Employee Name)" in text
+
+
+def test_sheet_agents_parse_outside_the_dataset_lock(snapshots, load_dataset):
+    dataset = load_dataset(_workbook(Employees=EMPLOYEES, Skills=SKILLS))
+    workbooks = dataset["workbooks"]
+    sheet = workbooks.sheet
+    locked = []
+
+    def watched(sheet_id):
+        locked.append(dataset["lock"].locked())
+        return sheet(sheet_id)
+
+    workbooks.sheet = watched
+    pools = []
+    threads = [threading.Thread(target=lambda: pools.append(sheet_agents(dataset, ["Employees", "Skills"])))
+               for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert locked and not any(locked)
+    # Every caller ends up with the pool that was published
+    assert len({id(pool) for pool in pools}) == 1
+    assert sheet_agents(dataset, ["Employees", "Skills"]) is pools[0]
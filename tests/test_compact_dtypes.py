@@ -0,0 +1,54 @@
+import pandas as pd
+from langchain_experimental.tools.python.tool import PythonAstREPLTool
+
+from chat_engine import get_enriched_prompt
+from frame_channel import as_frame
+from ingest import TEXT_DTYPE, compact_dtypes, memory_report
+
+
+def _run(agent, code):
+    repl = next(tool for tool in agent.tools if isinstance(tool, PythonAstREPLTool))
+    result = repl.run(code)
+    # Errors come back as their message
+    assert not isinstance(result, str), result
+    return bool(result)
+
+
+def test_repeated_text_becomes_categorical():
+    df = compact_dtypes(pd.DataFrame({
+        "Pool": ["Java", "QA", "Java", "QA", None, "Java"],
+        "Name": ["a", "b", "c", "d", "e", "f"],
+        "Joined": ["2021-04-01", "2019-01-15", None, "2020-02-02", "2022-03-03", "2023-07-30"],
+    }).astype(object))
+    assert isinstance(df["Pool"].dtype, pd.CategoricalDtype)
+    assert list(df["Pool"].cat.categories) == ["Java", "QA"]
+    assert df["Name"].dtype == TEXT_DTYPE
+    assert pd.api.types.is_datetime64_any_dtype(df["Joined"])
+    report = {row["column"]: row for row in memory_report(df)}
+    assert report["Pool"]["bytes"] < report["Pool"]["as_text_bytes"]
+
+
+def test_memory_report_compares_with_str_dtype():
+    df = compact_dtypes(pd.DataFrame({"Pool": ["Java", "QA", "Java", None] * 50, "Name": [f"n{i}" for i in range(200)]}, dtype=object))
+    report = {row["column"]: row for row in memory_report(df)}
+    as_read = pd.DataFrame({"Pool": ["Java", "QA", "Java", None] * 50}, dtype=str)
+    assert report["Pool"]["as_text_bytes"] == as_read["Pool"].memory_usage(index=False, deep=True)
+    assert report["Name"]["as_text_bytes"] == report["Name"]["bytes"]
+
+
+def test_agents_share_the_categorical_frame(load_dataset):
+    dataset = load_dataset()
+    with dataset["agents"].checkout() as (main_agent, _):
+        repl = next(tool for tool in main_agent.tools if isinstance(tool, PythonAstREPLTool))
+        assert repl.locals["df"]["Resource Pool"].dtype == dataset["df"]["Resource Pool"].dtype
+        assert _run(main_agent, "df['Resource Pool'].dtype == 'category'")
+        # What the prompt tells the agent to do before writing new text into a categorical
+        assert _run(main_agent, "df['Resource Pool'].astype(str).where(df['Resource Pool'] != 'Java').fillna('Unknown').eq('Unknown').sum() > 0")
+        assert _run(main_agent, "(df['Resource Pool'].astype(str) + ' team').iloc[0].endswith(' team')")
+    assert ".astype(str)" in get_enriched_prompt("list java employees", dataset["value_dict"])
+
+
+def test_tool_tables_leave_out_empty_categories():
+    df = compact_dtypes(pd.DataFrame({"Pool": ["Java", "QA", "Java", None] * 3}, dtype=object))
+    table = as_frame(df[df["Pool"] == "Java"]["Pool"].value_counts())
+    assert table.to_dict("list") == {"Pool": ["Java"], "count": [6]}
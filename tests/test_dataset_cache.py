@@ -0,0 +1,122 @@
+import threading
+
+import pytest
+
+from dataset_cache import DatasetCache
+
+
+def _entry(size):
+    return {"df": None, "nbytes": lambda: size}
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr("dataset_cache.time.monotonic", clock)
+    return clock
+
+
+def test_least_recently_used_is_evicted_first():
+    cache = DatasetCache(max_bytes=300)
+    for key in "abc":
+        cache.put(key, _entry(100))
+    # Asking for "a" makes "b" the oldest
+    assert cache.get("a") is not None
+    cache.put("d", _entry(100))
+    assert [key for key, *_ in cache.describe()] == ["c", "a", "d"]
+    assert cache.total_bytes == 300
+    assert cache.evictions == 1
+    assert (cache.hits, cache.misses) == (1, 0)
+
+
+def test_peek_does_not_refresh_recency():
+    cache = DatasetCache(max_bytes=200)
+    cache.put("a", _entry(100))
+    cache.put("b", _entry(100))
+    assert cache.peek("a") is not None
+    cache.put("c", _entry(100))
+    assert "a" not in cache
+    assert cache.hits == 0
+
+
+def test_newest_entry_is_kept_even_over_budget():
+    cache = DatasetCache(max_bytes=100)
+    cache.put("a", _entry(50))
+    cache.put("big", _entry(500))
+    assert [key for key, *_ in cache.describe()] == ["big"]
+
+
+def test_resize_evicts_others_when_an_entry_grows():
+    cache = DatasetCache(max_bytes=300)
+    sizes = {"a": 100, "b": 100}
+    for key in sizes:
+        cache.put(key, {"df": None, "nbytes": lambda key=key: sizes[key]})
+    sizes["b"] = 250
+    cache.resize("b")
+    assert len(cache) == 1 and "b" in cache
+    assert cache.total_bytes == 250
+
+
+def test_get_or_build_builds_once_for_concurrent_callers():
+    cache = DatasetCache(max_bytes=1000)
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def builder():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return _entry(10)
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_build("k", builder))) for _ in range(4)]
+    threads[0].start()
+    started.wait(5)
+    for thread in threads[1:]:
+        thread.start()
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert len(calls) == 1
+    assert len(results) == 4 and all(entry is results[0] for entry in results)
+    assert cache.misses == 1
+
+
+def test_idle_entries_are_dropped(clock):
+    cache = DatasetCache(max_bytes=1000, idle_seconds=60)
+    cache.put("a", _entry(10))
+    clock.now += 30
+    cache.put("b", _entry(10))
+    clock.now += 40
+    # "a" has been idle for 70 seconds, "b" for 40
+    assert cache.evict_idle() == ["a"]
+    assert cache.get("b") is not None
+    clock.now += 50
+    assert cache.evict_idle() == []
+    clock.now += 20
+    assert cache.evict_idle() == ["b"]
+    assert len(cache) == 0 and cache.total_bytes == 0
+
+
+def test_put_drops_idle_entries(clock):
+    cache = DatasetCache(max_bytes=1000, idle_seconds=60)
+    cache.put("a", _entry(10))
+    clock.now += 120
+    cache.put("b", _entry(10))
+    assert [key for key, *_ in cache.describe()] == ["b"]
+
+
+def test_idle_eviction_is_off_by_default(clock):
+    cache = DatasetCache(max_bytes=1000, idle_seconds=0)
+    cache.put("a", _entry(10))
+    clock.now += 10 ** 6
+    assert cache.evict_idle() == []
+    assert "a" in cache
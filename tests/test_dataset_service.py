@@ -0,0 +1,86 @@
+import json
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+
+import dataset_service
+from benchmark import LLM_QUERY, make_fake_llm
+from dataset_cache import DatasetCache
+from dataset_service import DatasetNotLoaded, DatasetService, ServiceClient, serve
+
+
+@pytest.fixture
+def client():
+    service = DatasetService(DatasetCache(max_bytes=1024 * 1024 * 1024), llm=make_fake_llm())
+    server = serve(service, port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield ServiceClient(f"http://127.0.0.1:{server.server_address[1]}", timeout=30)
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+
+def _post(client, path, body):
+    request = urllib.request.Request(client.url + path, data=json.dumps(body).encode(), method="POST")
+    try:
+        with urllib.request.urlopen(request, timeout=30) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read())
+
+
+def test_round_trip(client, workbook_bytes, sheet):
+    df, _ = sheet
+    info = client.load_files([("rmg.xlsx", workbook_bytes)])
+    assert info["rows"] == len(df)
+    assert info["columns"] == list(df.columns)
+    # Loading the same content again only asks whether the service has it
+    assert client.load_files([("copy.xlsx", workbook_bytes)]) == info
+    assert [d["key"] for d in client.loaded()] == [info["key"]]
+
+    report = {row["column"]: row for row in client.memory(info["key"])}
+    assert report["Billable Status"]["dtype"] == "category"
+
+    events = list(client.ask_stream(info["key"], LLM_QUERY))
+    assert events[0]["type"] == "step"
+    final = events[-1]
+    assert final["type"] == "final"
+    table = final["response"]["table"]
+    assert list(table.columns) == ["Employee Name", "Resource Pool", "Project Name"]
+    assert len(table) == (df["Billable Status"] == "Billable").sum()
+
+    answer = client.ask(info["key"], "how many employees are Billable")
+    assert str((df["Billable Status"] == "Billable").sum()) in answer["result"]
+    assert client.stats()["datasets"] == 1
+
+    assert client.unload(info["key"])
+    assert client.info(info["key"]) is None
+    with pytest.raises(DatasetNotLoaded):
+        client.ask(info["key"], "how many employees are Billable")
+
+
+def test_paths_only_within_the_data_directory(client, workbook_bytes, tmp_path, monkeypatch):
+    (tmp_path / "data").mkdir()
+    (tmp_path / "data" / "rmg.xlsx").write_bytes(workbook_bytes)
+    (tmp_path / "secret.xlsx").write_bytes(workbook_bytes)
+
+    status, body = _post(client, "/datasets", {"paths": [str(tmp_path / "data" / "rmg.xlsx")]})
+    assert status == 403 and "disabled" in body["error"]
+
+    monkeypatch.setattr(dataset_service, "DATASET_SERVICE_DATA_DIR", str(tmp_path / "data"))
+    for path in ["../secret.xlsx", str(tmp_path / "secret.xlsx"), "/etc/passwd"]:
+        status, body = _post(client, "/datasets", {"paths": [path]})
+        assert status == 403, path
+    status, body = _post(client, "/datasets", {"paths": ["rmg.xlsx"]})
+    assert status == 200 and body["name"] == "rmg.xlsx"
+
+
+def test_client_sends_local_paths_as_files(client, workbook_bytes, tmp_path):
+    path = tmp_path / "rmg.xlsx"
+    path.write_bytes(workbook_bytes)
+    assert client.load_paths([path])["name"] == "rmg.xlsx"
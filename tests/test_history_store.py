@@ -0,0 +1,101 @@
+import pandas as pd
+
+from history_store import HistoryStore
+
+
+def _frame():
+    return pd.DataFrame({
+        "Employee Name": ["Priya Shah", "Rahul Patel", "Sara Khan"],
+        "Billable Status": pd.Categorical(["Billable", "Non Billable", "Billable"]),
+        "Experience": [3.5, 7.0, None],
+        "Joined": pd.to_datetime(["2021-04-01", "2019-01-15", "2023-07-30"]),
+    })
+
+
+def _stored(tmp_path, table):
+    store = HistoryStore(tmp_path / "history.sqlite3")
+    store.append("question", "answer", table)
+    return store.load_table(store.page()[0]["table_ref"])
+
+
+def test_transposed_row_is_stored(tmp_path):
+    df = _frame()
+    loaded = _stored(tmp_path, df[df["Employee Name"] == "Rahul Patel"].T)
+    assert list(loaded.columns) == ["index", "1"]
+    assert loaded["index"].tolist() == list(df.columns)
+    assert loaded["1"].tolist()[:3] == ["Rahul Patel", "Non Billable", "7.0"]
+
+
+def test_describe_is_stored(tmp_path):
+    summary = _frame().describe(include="all")
+    loaded = _stored(tmp_path, summary)
+    assert loaded["index"].tolist() == [str(label) for label in summary.index]
+    assert loaded.shape == (len(summary), len(summary.columns) + 1)
+
+
+def test_plain_table_round_trips(tmp_path):
+    df = _frame()
+    filtered = df[df["Billable Status"] == "Billable"]
+    loaded = _stored(tmp_path, filtered)
+    pd.testing.assert_frame_equal(loaded, filtered.reset_index(drop=True), check_dtype=False, check_categorical=False)
+
+
+def test_page_is_newest_first_and_limited(tmp_path):
+    store = HistoryStore(tmp_path / "history.sqlite3")
+    ids = [store.append(f"q{i}", f"a{i}") for i in range(5)]
+    assert [e["user"] for e in store.page(limit=2)] == ["q4", "q3"]
+    assert [e["user"] for e in store.page(limit=2, offset=2)] == ["q2", "q1"]
+    assert [e["id"] for e in store.page()] == ids[::-1]
+    assert store.count() == 5
+
+
+def test_delete_leaves_a_tombstone_until_compacted(tmp_path):
+    store = HistoryStore(tmp_path / "history.sqlite3")
+    kept = store.append("q0", "a0", _frame())
+    gone = store.append("q1", "a1", _frame())
+    gone_ref = next(e["table_ref"] for e in store.page() if e["id"] == gone)
+    store.delete(gone)
+    assert [e["id"] for e in store.page()] == [kept]
+    assert store.count() == 1
+    # Still on disk until compaction
+    assert store._conn.execute("SELECT COUNT(*) FROM history").fetchone()[0] == 2
+    assert (store.tables_dir / gone_ref).exists()
+
+    store.compact()
+    assert store._conn.execute("SELECT COUNT(*) FROM history").fetchone()[0] == 1
+    assert not (store.tables_dir / gone_ref).exists()
+    assert store.load_table(store.page()[0]["table_ref"]).shape == _frame().shape
+
+
+def test_enough_tombstones_compact_automatically(tmp_path, monkeypatch):
+    monkeypatch.setattr("history_store.COMPACT_MIN_DELETED", 3)
+    store = HistoryStore(tmp_path / "history.sqlite3")
+    ids = [store.append(f"q{i}", f"a{i}") for i in range(8)]
+    for entry_id in ids[:2]:
+        store.delete(entry_id)
+    assert store._conn.execute("SELECT COUNT(*) FROM history").fetchone()[0] == 8
+    store.delete(ids[2])
+    assert store._conn.execute("SELECT COUNT(*) FROM history").fetchone()[0] == 5
+    assert [e["id"] for e in store.page()] == ids[:2:-1]
+
+
+def test_long_answers_with_a_table_are_not_stored_twice(tmp_path):
+    store = HistoryStore(tmp_path / "history.sqlite3")
+    store.append("q", "x" * 5000, _frame())
+    store.append("q", "x" * 5000)
+    with_table, without = store.page()[::-1]
+    assert with_table["assistant"] == "[Table with 3 rows × 4 columns]"
+    assert without["assistant"] == "x" * 5000
+
+
+def test_import_json_runs_once(tmp_path):
+    old = tmp_path / "chat_history.json"
+    old.write_text('[{"user": "q0", "assistant": "a0"}, {"user": "q1", "assistant": "a1"}]')
+    store = HistoryStore(tmp_path / "history.sqlite3")
+    assert store.import_json(old) == 2
+    assert not old.exists()
+    assert (tmp_path / "chat_history.json.migrated").exists()
+    assert [e["user"] for e in store.page()] == ["q1", "q0"]
+    # The next start finds nothing to import
+    assert store.import_json(old) == 0
+    assert store.count() == 2
@@ -0,0 +1,65 @@
+from io import BytesIO
+
+import pandas as pd
+import pytest
+from openpyxl import Workbook
+
+from ingest import TEXT_DTYPE, RawSheet, infer_numeric_columns, read_sheet, scan_sheets
+from refresh import refresh_frame
+
+ROWS = [
+    [" Employee Name ", "Pool", None, "Pool", "  ", "Experience"],
+    ["  Asha Rao ", " Java ", "x", 1, 2.0, 4],
+    ["Ben Ode", "   ", None, None, None, "   ", "extra", None, "far"],
+    [None, None, None],
+    ["Chen Li", None, 3.5, None, None, 7],
+    ["Dana Kim", "QA"],
+    ["Eve Moss", "QA", None, None, None, 2, None, "late"],
+]
+
+
+def _workbook(rows):
+    wb = Workbook()
+    for row in rows:
+        wb.active.append(row)
+    data = BytesIO()
+    wb.save(data)
+    return data.getvalue()
+
+
+@pytest.fixture(scope="module")
+def ragged():
+    return _workbook(ROWS)
+
+
+def _expected(data):
+    # What the app loaded before streaming ingestion: read_excel, whitespace stripped
+    df = pd.read_excel(BytesIO(data), dtype=str)
+    return df.dropna(how="all").reset_index(drop=True).apply(lambda s: s.str.strip())
+
+
+@pytest.mark.parametrize("chunksize", [2, 100])
+def test_read_sheet_matches_read_excel(ragged, chunksize):
+    expected = _expected(ragged)
+    df = read_sheet(BytesIO(ragged), chunksize=chunksize)
+    assert list(df.columns) == [" Employee Name ", "Pool", "Unnamed: 2", "Pool.1", "  ", "Experience",
+                                "Unnamed: 6", "Unnamed: 7", "Unnamed: 8"]
+    pd.testing.assert_frame_equal(df.astype(TEXT_DTYPE), expected.astype(TEXT_DTYPE))
+    assert df.loc[1, "Pool"] == ""
+    # Blank cells do not stop a column from being numeric
+    assert pd.api.types.is_numeric_dtype(infer_numeric_columns(df)["Experience"])
+
+
+def test_scan_sheets_sample_matches_read_excel(ragged):
+    [(_, _, sample)] = scan_sheets(BytesIO(ragged))
+    pd.testing.assert_frame_equal(sample.astype(TEXT_DTYPE), _expected(ragged).astype(TEXT_DTYPE))
+
+
+def test_row_past_the_header_falls_back_to_a_full_parse():
+    rows = [row[:6] for row in ROWS]
+    old = _workbook(rows)
+    first = RawSheet(BytesIO(old), keep_rows=False)
+    previous = read_sheet(BytesIO(old))
+    new = RawSheet(BytesIO(_workbook([*rows, ["Finn Ash", "QA", None, None, None, 1, "wide"]])),
+                   previous_fingerprints=first.fingerprints)
+    assert refresh_frame(new, previous, first.fingerprints) is None
@@ -0,0 +1,143 @@
+import re
+import socket
+import urllib.error
+import urllib.request
+
+import pytest
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, LLMResult
+
+import metrics
+from benchmark import LLM_QUERY
+from chat_engine import answer_query
+from metrics import MetricsCallbackHandler, MetricsRegistry, QueryTrace, export_metrics, span, trace_query
+
+LABEL = r'[a-z_]+="(?:[^"\\]|\\.)*"'
+SAMPLE = re.compile(rf"^[a-z_]+(\{{{LABEL}(,{LABEL})*\}})? \S+$")
+
+
+def _counter(text, line):
+    return next(float(l.rsplit(" ", 1)[1]) for l in text.splitlines() if l.startswith(line + " "))
+
+
+def test_render_is_openmetrics_text():
+    registry = MetricsRegistry(buckets=(0.1, 1), prefix="t")
+    registry.describe("queries", "Questions answered.")
+    registry.inc("queries", source="llm")
+    registry.inc("queries", 2, source="llm")
+    registry.inc("queries", source='cache "hit"\n')
+    registry.observe("seconds", 0.05, stage="parse")
+    registry.observe("seconds", 0.5, stage="parse")
+    registry.observe("seconds", 5, stage="parse")
+    text = registry.render()
+
+    lines = text.splitlines()
+    assert text.endswith("# EOF\n")
+    assert lines[:2] == ["# TYPE t_queries counter", "# HELP t_queries Questions answered."]
+    assert 't_queries_total{source="llm"} 3' in lines
+    assert 't_queries_total{source="cache \\"hit\\"\\n"} 1' in lines
+    assert "# TYPE t_seconds histogram" in lines
+    # Buckets are cumulative; +Inf is the count
+    assert [l.rsplit(" ", 1)[1] for l in lines if l.startswith("t_seconds_bucket")] == ["1", "2", "3"]
+    assert 't_seconds_bucket{stage="parse",le="+Inf"} 3' in lines
+    assert 't_seconds_sum{stage="parse"} 5.55' in lines
+    assert 't_seconds_count{stage="parse"} 3' in lines
+    assert all(SAMPLE.match(l) for l in lines if not l.startswith("#"))
+
+
+def test_spans_are_recorded_on_the_current_trace(monkeypatch):
+    registry = MetricsRegistry()
+    monkeypatch.setattr(metrics, "REGISTRY", registry)
+    with span("outside"):
+        pass
+    with trace_query("q") as trace:
+        with span("parse"):
+            pass
+        trace.source = "cache"
+    assert [s["stage"] for s in trace.stages] == ["parse"]
+    assert trace.seconds >= trace.stages[0]["seconds"]
+    text = registry.render()
+    assert 'excel_chat_stage_seconds_count{stage="outside"} 1' in text
+    assert 'excel_chat_queries_total{source="cache"} 1' in text
+    assert 'excel_chat_query_seconds_count{source="cache"} 1' in text
+
+
+def test_failed_queries_count_as_errors(monkeypatch):
+    registry = MetricsRegistry()
+    monkeypatch.setattr(metrics, "REGISTRY", registry)
+    try:
+        with trace_query("q"):
+            raise ValueError
+    except ValueError:
+        pass
+    assert 'excel_chat_queries_total{source="error"} 1' in registry.render()
+
+
+def test_callbacks_estimate_tokens_without_usage(monkeypatch):
+    registry = MetricsRegistry()
+    monkeypatch.setattr(metrics, "REGISTRY", registry)
+    trace = QueryTrace("q")
+    llm = FakeListChatModel(responses=["x" * 40])
+    llm.invoke("y" * 80, config={"callbacks": [MetricsCallbackHandler(trace)]})
+    assert (trace.llm_calls, trace.prompt_tokens, trace.completion_tokens) == (1, 21, 11)
+    text = registry.render()
+    assert _counter(text, 'excel_chat_llm_tokens_total{kind="prompt"}') == 21
+    assert _counter(text, "excel_chat_llm_calls_total") == 1
+
+
+def test_callbacks_prefer_reported_usage(monkeypatch):
+    monkeypatch.setattr(metrics, "REGISTRY", MetricsRegistry())
+    trace = QueryTrace("q")
+    handler = MetricsCallbackHandler(trace)
+    handler.on_llm_start({}, ["y" * 80], run_id="r")
+    message = AIMessage("x", usage_metadata={"input_tokens": 500, "output_tokens": 7, "total_tokens": 507})
+    handler.on_llm_end(LLMResult(generations=[[ChatGeneration(message=message)]]), run_id="r")
+    assert (trace.prompt_tokens, trace.completion_tokens) == (500, 7)
+    assert handler._prompt_estimates == {}
+
+
+def test_agent_run_is_traced(load_dataset, monkeypatch):
+    monkeypatch.setattr(metrics, "REGISTRY", MetricsRegistry())
+    response = answer_query(LLM_QUERY, load_dataset())
+    trace = response["metrics"]
+    assert trace["source"] == "llm"
+    # The fake model answers with one tool call, then the final answer
+    assert (trace["llm_calls"], trace["tool_calls"]) == (2, 1)
+    assert trace["prompt_tokens"] > 0 and trace["completion_tokens"] > 0
+    assert "agent.run" in {s["stage"] for s in trace["stages"]}
+
+
+def test_export_rewrites_the_file(tmp_path, monkeypatch):
+    registry = MetricsRegistry()
+    registry.inc("queries", source="llm")
+    monkeypatch.setattr(metrics, "REGISTRY", registry)
+    path = tmp_path / "excel_chat.prom"
+    export_metrics(path)
+    assert path.read_text() == registry.render()
+    assert list(tmp_path.iterdir()) == [path]
+
+    # Port 0 disables the endpoint
+    assert metrics.start_metrics_server(port=0) is None
+
+
+def test_metrics_endpoint(monkeypatch):
+    registry = MetricsRegistry()
+    registry.inc("queries", source="llm")
+    monkeypatch.setattr(metrics, "REGISTRY", registry)
+    monkeypatch.setattr(metrics, "_server", None)
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = metrics.start_metrics_server(port=port)
+    try:
+        assert metrics.start_metrics_server(port=port) is server
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics") as reply:
+            assert reply.headers["Content-Type"] == metrics.CONTENT_TYPE
+            assert reply.read().decode() == registry.render()
+        with pytest.raises(urllib.error.HTTPError) as error:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/other")
+        assert error.value.code == 404
+    finally:
+        server.shutdown()
+        server.server_close()
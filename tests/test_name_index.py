@@ -0,0 +1,50 @@
+import pandas as pd
+import pytest
+
+from name_index import EmployeeIndex, answer_from_index
+
+
+@pytest.fixture
+def index():
+    df = pd.DataFrame({
+        "Employee Name": ["Priya Shah", "Rahul Patel Senior", "Rahul Patel Junior", "Sara Khan", "Meera Nair"],
+        "Resource Pool": ["Java", "QA", "Java", "HR", "QA"],
+        "RMG Comments": ["Strong communicator", "Needs upskilling in AWS", None, "On bench since last month", "Awaiting client interview"],
+    })
+    return EmployeeIndex(df)
+
+
+def test_exact_name_returns_full_comment(index):
+    response = answer_from_index("show comments for Sara Khan", index)
+    assert response["result"] == "On bench since last month"
+    assert response["source"] == "index"
+
+
+def test_details_drop_comments(index):
+    response = answer_from_index("show details of priya shah", index)
+    assert response["table"].to_dict("records") == [{"Employee Name": "Priya Shah", "Resource Pool": "Java"}]
+
+
+def test_unique_prefix_and_misspelling(index):
+    assert index.resolve("meera") == "meera nair"
+    assert index.find_name_in_query("comments for Sara Kahn") == "sara khan"
+    assert index.find_name_in_query("comments for Rahul Patel Sen") == "rahul patel senior"
+
+
+def test_ambiguous_name_lists_every_match(index):
+    assert index.resolve("Rahul Patel") is None
+    assert index.match_name_in_query("show details of Rahul Patel") == (None, ["rahul patel junior", "rahul patel senior"])
+
+    response = answer_from_index("show details of Rahul Patel", index)
+    assert response["result"].startswith("2 employees match")
+    assert response["table"]["Employee Name"].tolist() == ["Rahul Patel Senior", "Rahul Patel Junior"]
+
+    comments = answer_from_index("show comments for Rahul Patel", index)
+    assert list(comments["table"].columns) == ["Employee Name", "RMG Comments"]
+    assert len(comments["table"]) == 2
+
+
+def test_comment_search(index):
+    response = answer_from_index("which comments mention client interview", index)
+    assert response["table"]["Employee Name"].tolist() == ["Meera Nair"]
+    assert answer_from_index("summarize comments for Sara Khan", index) is None
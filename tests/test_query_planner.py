@@ -0,0 +1,71 @@
+import pandas as pd
+import pytest
+
+from aggregates import AggregateCubes
+from query_planner import answer_locally, apply_filters, plan_query
+
+
+def _plan(sheet, query):
+    df, value_dict = sheet
+    return plan_query(query, list(df.columns), value_dict)
+
+
+def test_list_with_filters(sheet):
+    df, value_dict = sheet
+    query = "list all Billable employees in Resource Pool Java"
+    plan = _plan(sheet, query)
+    assert plan["action"] == "list"
+    assert plan["filters"] == {"Billable Status": ["Billable"], "Resource Pool": ["Java"]}
+
+    response = answer_locally(query, df, value_dict)
+    expected = df[(df["Billable Status"] == "Billable") & (df["Resource Pool"] == "Java")]
+    assert response["source"] == "planner"
+    assert response["table"]["Employee Name"].tolist() == expected["Employee Name"].tolist()
+    assert "RMG Comments" not in response["table"].columns
+
+
+def test_count(sheet):
+    df, value_dict = sheet
+    response = answer_locally("how many people are On Notice", df, value_dict)
+    count = int((df["Employment Status"] == "On Notice").sum())
+    assert response["result"] == f"{count} employees match Employment Status = On Notice."
+
+
+def test_count_from_cubes(sheet):
+    df, value_dict = sheet
+    cubes = AggregateCubes(df, value_dict)
+    from_cubes = answer_locally("how many Billable employees by Business Unit", df, value_dict, cubes)
+    from_sheet = answer_locally("how many Billable employees by Business Unit", df, value_dict)
+    assert from_cubes["source"] == "cube"
+    pd.testing.assert_frame_equal(from_cubes["table"], from_sheet["table"], check_dtype=False)
+
+
+def test_longest_value_wins(sheet):
+    assert _plan(sheet, "how many Non Billable employees")["filters"] == {"Billable Status": ["Non Billable"]}
+
+
+def test_names_only(sheet):
+    plan = _plan(sheet, "list names of Non Billable employees")
+    assert plan["columns"] == ["Employee Name"]
+
+
+def test_value_in_several_columns_needs_the_column_named(sheet):
+    # "Java" is both a Resource Pool and a Primary Skill
+    assert _plan(sheet, "how many Java employees") is None
+    assert _plan(sheet, "how many employees in Primary Skills Java")["filters"] == {"Primary Skills": ["Java"]}
+
+
+@pytest.mark.parametrize("query", [
+    "show comments for Billable employees",
+    "how many Billable employees joined last year",
+    "how many employees in qa",
+    "what is the average experience",
+])
+def test_left_to_the_llm(sheet, query):
+    assert _plan(sheet, query) is None
+
+
+def test_filters_ignore_case_and_spacing():
+    df = pd.DataFrame({"Pool": pd.Categorical(["Java", " java ", "QA", None])})
+    assert apply_filters(df, {"Pool": ["JAVA"]}).index.tolist() == [0, 1]
+    assert apply_filters(df.astype(object), {"Pool": ["java"]}).index.tolist() == [0, 1]
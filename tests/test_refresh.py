@@ -0,0 +1,146 @@
+import datetime as dt
+import random
+from io import BytesIO
+
+import pandas as pd
+import pytest
+from openpyxl import Workbook
+
+import snapshot
+from benchmark import COLUMN_VALUES, COLUMNS, COMMENT_PHRASES, FIRST_NAMES, LAST_NAMES
+from chat_engine import load_dataset_files
+from dataset_cache import DatasetCache
+from ingest import RawSheet
+from refresh import refresh_frame
+
+ROWS = 400
+HEADER = [*COLUMNS, "Experience", "Joined"]
+
+
+def _row(rng, i):
+    name = f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)} {i}"
+    comment = f"  {rng.choice(COMMENT_PHRASES)}.  " if rng.random() < 0.4 else None
+    experience = rng.randint(0, 20) if rng.random() < 0.95 else None
+    joined = dt.datetime(2020, 1, 1) + dt.timedelta(days=rng.randint(0, 1500))
+    return [f" {name} ", *(rng.choice(v) for v in COLUMN_VALUES.values()), comment, experience, joined]
+
+
+def _save(rows):
+    wb = Workbook()
+    ws = wb.active
+    ws.title = "Sheet1"
+    ws.append(HEADER)
+    for row in rows:
+        ws.append(row)
+    data = BytesIO()
+    wb.save(data)
+    return data.getvalue()
+
+
+@pytest.fixture(scope="module")
+def versions():
+    rng = random.Random(7)
+    v1 = [_row(rng, i) for i in range(ROWS)]
+    v2 = [list(row) for row in v1]
+    billable = HEADER.index("Billable Status")
+    for i in rng.sample(range(ROWS), 20):
+        v2[i][billable] = "Non Billable" if v2[i][billable] == "Billable" else "Billable"
+    for i in rng.sample(range(ROWS), 10):
+        v2[i][HEADER.index("RMG Comments")] = "Moved to Rubrik project"
+    removed = set(rng.sample(range(ROWS), 15))
+    v2 = [row for i, row in enumerate(v2) if i not in removed]
+    for k in range(15):
+        v2.insert(rng.randrange(len(v2)), _row(rng, ROWS + k))
+    # A row that now appears twice
+    v2.append(list(v2[3]))
+    return _save(v1), _save(v2)
+
+
+def _load(data, cache):
+    return load_dataset_files([("rmg.xlsx", data)], cache, llm=object())
+
+
+def test_refresh_matches_full_parse(versions, tmp_path, monkeypatch):
+    v1, v2 = versions
+    cache = DatasetCache(max_bytes=1024 * 1024 * 1024)
+    monkeypatch.setattr("chat_engine.make_llm", lambda llm=None: llm)
+    monkeypatch.setattr("chat_engine.build_agents", lambda df, llm=None: (None, None))
+    first = _load(v1, cache)
+    refreshed = _load(v2, cache)
+    assert refreshed["refresh"]["added"] >= 15
+    assert refreshed["refresh"]["removed"] == 15
+    assert refreshed["refresh"]["changed"] > 0
+    assert "Billable Status" in refreshed["refresh"]["changed_columns"]
+
+    monkeypatch.setattr(snapshot, "SNAPSHOT_DIR", tmp_path / "full")
+    full = _load(v2, DatasetCache(max_bytes=1024 * 1024 * 1024))
+    assert full["refresh"] is None
+
+    pd.testing.assert_frame_equal(refreshed["df"], full["df"])
+    assert refreshed["value_dict"] == full["value_dict"]
+
+    index, expected = refreshed["index"], full["index"]
+    assert index.sorted_names == expected.sorted_names
+    assert {key: index.rows(key) for key in index.names} == {key: expected.rows(key) for key in expected.names}
+    assert {t: index.positions(ids) for t, ids in index.comment_tokens.items() if ids} == {
+        t: expected.positions(ids) for t, ids in expected.comment_tokens.items()
+    }
+    # The previous version's index is left as it was
+    assert sum(len(ids) for ids in first["index"].names.values()) == len(first["df"])
+
+    cubes, expected_cubes = refreshed["cubes"], full["cubes"]
+    for key in expected_cubes._cuboids:
+        ordered = lambda frame: frame.sort_values(list(key)).reset_index(drop=True)  # noqa: E731
+        pd.testing.assert_frame_equal(ordered(cubes.cuboid(key)[0]), ordered(expected_cubes.cuboid(key)[0]), check_dtype=False)
+
+
+def test_raw_sheet_keeps_only_rows_to_decode(versions, tmp_path, monkeypatch):
+    v1, v2 = versions
+    first = RawSheet(BytesIO(v1), keep_rows=False)
+    assert len(first.fingerprints) == ROWS + 1
+    # Only the header's XML, for the column names
+    assert len(first._xml) == 1
+    monkeypatch.setattr("ingest.RAW_CHUNK_BYTES", 97)
+    assert (RawSheet(BytesIO(v1), keep_rows=False).fingerprints == first.fingerprints).all()
+
+    raw = RawSheet(BytesIO(v2), previous_fingerprints=first.fingerprints)
+    monkeypatch.setattr(snapshot, "SNAPSHOT_DIR", tmp_path)
+    previous = _load_frame(v1)
+    frame, diff = refresh_frame(raw, previous, first.fingerprints)
+    assert len(raw._xml) == len(set(raw.fingerprints[diff.decoded + 1].tolist())) + 1
+    assert len(frame) == len(raw.fingerprints) - 1
+
+
+def _load_frame(data):
+    from ingest import compact_dtypes, infer_numeric_columns, read_sheet
+
+    return compact_dtypes(infer_numeric_columns(read_sheet(BytesIO(data))))
+
+
+def test_carry_over_drops_answers_a_change_may_affect(versions, tmp_path, monkeypatch):
+    from response_cache import ResponseCache
+
+    v1 = versions[0]
+    rows = pd.read_excel(BytesIO(v1), dtype=object).values.tolist()
+    project = HEADER.index("Project Name")
+    row = next(r for r in rows if "Bench" not in r[project])
+    row[project] = "5501-Inv-V2Solutions-Proj-Digital Engineering Bench"
+    v3 = _save(rows)
+
+    monkeypatch.setattr(snapshot, "SNAPSHOT_DIR", tmp_path)
+    monkeypatch.setattr("chat_engine.make_llm", lambda llm=None: llm)
+    monkeypatch.setattr("chat_engine.build_agents", lambda df, llm=None: (None, None))
+    cache = DatasetCache(max_bytes=1024 * 1024 * 1024)
+    responses = ResponseCache(tmp_path / "cache.sqlite3", "test")
+    first = load_dataset_files([("rmg.xlsx", v1)], cache, responses, llm=object())
+    answer = {"result": "Some employees.", "is_structured": False, "table": None}
+    # Agent answers never say which columns they read
+    responses.put(first["key"], "who is on the bench", answer)
+    responses.put(first["key"], "billable split by department", answer, reads=["Billable Status", "Department"])
+    responses.put(first["key"], "bench count by project", answer, reads=["Project Name"])
+
+    second = load_dataset_files([("rmg.xlsx", v3)], cache, responses, llm=object())
+    assert second["refresh"]["changed_columns"] == ["Project Name"]
+    assert responses.get(second["key"], "who is on the bench") is None
+    assert responses.get(second["key"], "bench count by project") is None
+    assert responses.get(second["key"], "billable split by department") is not None
@@ -0,0 +1,41 @@
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+
+from benchmark import LLM_QUERY
+from chat_engine import AGENT_STOPPED_PREFIX, answer_query, answer_query_stream, finish_llm_response
+from response_cache import ResponseCache
+
+
+def _cache(tmp_path):
+    return ResponseCache(tmp_path / "cache.sqlite3", "test")
+
+
+def test_final_answer_is_cached(load_dataset, tmp_path):
+    cache = _cache(tmp_path)
+    dataset = load_dataset(response_cache=cache)
+    first = answer_query(LLM_QUERY, dataset, cache)
+    second = answer_query(LLM_QUERY, dataset, cache)
+    assert first["source"] == "llm"
+    assert second["result"] == first["result"]
+    assert cache.hits == 1
+
+
+def test_parse_failure_fallback_is_not_cached(load_dataset, tmp_path):
+    cache = _cache(tmp_path)
+    dataset = load_dataset(llm=FakeListChatModel(responses=["The split looks even to me."]), response_cache=cache)
+    response = answer_query(LLM_QUERY, dataset, cache)
+    assert response["result"]
+    assert cache.get(dataset["key"], LLM_QUERY) is None
+
+    events = list(answer_query_stream(LLM_QUERY, dataset, cache))
+    assert events[-1]["type"] == "final"
+    assert cache.get(dataset["key"], LLM_QUERY) is None
+
+
+def test_stopped_agent_is_not_cached(tmp_path):
+    cache = _cache(tmp_path)
+    dataset = {"key": "dataset"}
+    stopped = {"result": f"{AGENT_STOPPED_PREFIX} iteration limit or time limit.", "is_structured": False}
+    finish_llm_response("why", dataset, stopped, cache)
+    assert cache.get("dataset", "why") is None
+    finish_llm_response("why", dataset, {"result": "Because.", "is_structured": False}, cache)
+    assert cache.get("dataset", "why")["result"] == "Because."
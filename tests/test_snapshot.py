@@ -0,0 +1,78 @@
+import os
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from ingest import TEXT_DTYPE
+from snapshot import has_snapshot, prune_snapshots, read_snapshot, snapshot_path, write_snapshot
+
+ROWS = 50_000
+
+
+def _frame(rows=ROWS):
+    pools = np.array(["Java", "QA", "Python"])
+    return pd.DataFrame({
+        "Employee Name": pd.Series([f"Employee {i}" for i in range(rows)], dtype=TEXT_DTYPE),
+        "Resource Pool": pd.Categorical(pools[np.arange(rows) % 3]),
+        "Experience": np.arange(rows, dtype="int64"),
+        "Score": np.where(np.arange(rows) % 7 == 0, np.nan, np.arange(rows) / 3),
+        "Joined": pd.date_range("2020-01-01", periods=rows, freq="h"),
+    })
+
+
+def test_round_trip(tmp_path):
+    df = _frame()
+    # Written in pieces, as a sheet read in chunks is
+    df = pd.concat([df.iloc[:ROWS // 2], df.iloc[ROWS // 2:]], ignore_index=True)
+    write_snapshot(df, "k", "sheet0", root=tmp_path)
+    assert has_snapshot("k", "sheet0", root=tmp_path)
+    assert not has_snapshot("k", "sheet1", root=tmp_path)
+    pd.testing.assert_frame_equal(read_snapshot("k", "sheet0", root=tmp_path), df)
+
+
+def test_read_maps_text_instead_of_copying(tmp_path):
+    df = _frame()
+    write_snapshot(df, "k", root=tmp_path)
+    read_snapshot("k", root=tmp_path)
+    allocated = pa.total_allocated_bytes()
+    tracemalloc.start()
+    try:
+        loaded = read_snapshot("k", root=tmp_path)
+        copied = tracemalloc.get_traced_memory()[0] + pa.total_allocated_bytes() - allocated
+    finally:
+        tracemalloc.stop()
+    text = df["Employee Name"].memory_usage(index=False, deep=True)
+    numbers = df.drop(columns="Employee Name").memory_usage(index=False, deep=True).sum()
+    # Numbers, dates and codes are copied; the names are not
+    assert copied < numbers + text / 10
+    # The copies are writable and leave the file alone
+    loaded.loc[0, "Experience"] = -1
+    assert read_snapshot("k", root=tmp_path).loc[0, "Experience"] == 0
+
+
+def _age(tmp_path, key, seconds):
+    then = time.time() - seconds
+    os.utime(snapshot_path(key, root=tmp_path).parent, (then, then))
+
+
+def test_prune_drops_old_snapshots(tmp_path):
+    for key in ["old", "kept", "new"]:
+        write_snapshot(_frame(100), key, root=tmp_path)
+    _age(tmp_path, "old", 3600)
+    _age(tmp_path, "kept", 3600)
+    assert prune_snapshots(max_age_seconds=60, keep={"kept"}, root=tmp_path) == ["old"]
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["kept", "new"]
+
+
+def test_prune_keeps_within_size_least_recently_used_first(tmp_path):
+    for age, key in enumerate(["c", "b", "a"]):
+        write_snapshot(_frame(2000), key, root=tmp_path)
+        _age(tmp_path, key, 100 * (3 - age))
+    size = snapshot_path("a", root=tmp_path).stat().st_size
+    # Reading a snapshot counts as use
+    read_snapshot("c", root=tmp_path)
+    assert prune_snapshots(max_bytes=2 * size, max_age_seconds=3600, root=tmp_path) == ["b"]
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["a", "c"]
@@ -0,0 +1,82 @@
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+
+from benchmark import FAKE_ACTION, FAKE_FINAL_ANSWER, LLM_QUERY
+from chat_engine import answer_query_stream, checkout_agents, stream_user_query
+from streaming import IncrementalCSVParser
+
+CSV_ANSWER = (
+    "Thought: I now know the final answer.\n"
+    "Final Answer: Here they are:\n"
+    "```csv\n"
+    "Employee Name,Resource Pool\n"
+    "Priya Shah,Java\n"
+    "\"Khan, Sara\",QA\n"
+    "```\n"
+    "Two employees."
+)
+
+
+def _events(dataset, query=LLM_QUERY):
+    with checkout_agents(query, dataset) as agents:
+        return list(stream_user_query(query, *agents))
+
+
+def test_stream_user_query_events(load_dataset):
+    events = _events(load_dataset())
+    types = [e["type"] for e in events]
+    assert types[0] == "step"
+    assert types[1] == "observation"
+    assert set(types[2:-1]) == {"token"}
+    assert types[-1] == "final"
+
+    step = events[0]
+    assert step["tool"] == "python_repl_ast"
+    assert "Billable Status" in step["input"]
+    assert "Employee Name" in events[1]["text"]
+    # Only the text after "Final Answer:" is streamed, not the reasoning
+    answer = "".join(e["text"] for e in events if e["type"] == "token")
+    assert answer == FAKE_FINAL_ANSWER.split("Final Answer:", 1)[1].strip()
+    response = events[-1]["response"]
+    assert response["result"] == answer
+    assert len(response["frames"]) == 1
+
+
+def test_answer_query_stream_final_response(load_dataset):
+    events = list(answer_query_stream(LLM_QUERY, load_dataset()))
+    response = events[-1]["response"]
+    assert response["source"] == "llm"
+    assert list(response["table"].columns) == ["Employee Name", "Resource Pool", "Project Name"]
+    assert response["metrics"]["llm_calls"] == 2
+
+
+def test_streamed_csv_answer_parses_row_by_row(load_dataset):
+    dataset = load_dataset(llm=FakeListChatModel(responses=[FAKE_ACTION, CSV_ANSWER]))
+    parser = IncrementalCSVParser()
+    completed = []
+    for event in _events(dataset):
+        if event["type"] == "token":
+            completed.extend(parser.feed(event["text"]))
+    assert parser.header == ["Employee Name", "Resource Pool"]
+    assert completed == [["Priya Shah", "Java"], ["Khan, Sara", "QA"]]
+    assert parser.closed
+
+
+def test_csv_parser_waits_for_complete_lines():
+    parser = IncrementalCSVParser()
+    assert parser.feed("Sure, here is the table:\n``") == []
+    assert parser.feed("`csv\nName,Po") == []
+    assert parser.header is None
+    assert parser.feed("ol\nPriya,Ja") == []
+    assert parser.header == ["Name", "Pool"]
+    assert parser.feed("va\n\nSara\n") == [["Priya", "Java"], ["Sara"]]
+    assert parser.feed("```\nMeera,HR\n") == []
+    assert parser.closed
+    frame = parser.frame()
+    assert frame["Name"].tolist() == ["Priya", "Sara"]
+    assert frame["Pool"].isna().tolist() == [False, True]
+
+
+def test_csv_parser_without_table():
+    parser = IncrementalCSVParser()
+    assert parser.feed("No employees match.\n") == []
+    assert parser.frame() is None
@@ -0,0 +1,49 @@
+from value_dictionary import estimate_tokens, format_guide, select_guide
+
+VALUE_DICT = {
+    "Billable Status": ["Billable", "Non Billable"],
+    "Resource Pool": ["Java", "QA", "Python", "DevOps", "Data", "Mobile", "UI", "Cloud"],
+    "Project Name": [f"Project {i}" for i in range(40)],
+    "Department": ["Engineering", "Delivery", "HR"],
+}
+
+
+def test_mentioned_values_come_first_and_only_those_values():
+    guide = select_guide("how many billable people in the java pool?", VALUE_DICT)
+    assert list(guide)[:2] == ["Billable Status", "Resource Pool"]
+    assert guide["Billable Status"] == ["Billable"]
+    assert guide["Resource Pool"] == ["Java"]
+
+
+def test_values_match_whole_words_only():
+    guide = select_guide("show the qa team's data engineers", VALUE_DICT)
+    assert guide["Resource Pool"] == ["QA", "Data"]
+    # "Data" does not match inside "database"
+    assert "Resource Pool" not in select_guide("which database is used", VALUE_DICT)
+
+
+def test_named_columns_are_listed_in_full_before_small_columns():
+    guide = select_guide("list the project name of each engineer", VALUE_DICT, token_budget=10 ** 6)
+    assert list(guide) == ["Project Name", "Billable Status", "Department"]
+    assert guide["Project Name"] == VALUE_DICT["Project Name"]
+
+
+def test_unmentioned_large_columns_are_left_out():
+    guide = select_guide("who joined last year", VALUE_DICT, token_budget=10 ** 6)
+    assert list(guide) == ["Billable Status", "Department"]
+
+
+def test_budget_drops_lower_priority_lines():
+    budget = 40
+    guide = select_guide("billable split by project name", VALUE_DICT, token_budget=budget)
+    assert list(guide)[0] == "Billable Status"
+    assert "Project Name" in guide
+    assert len(guide["Project Name"]) < len(VALUE_DICT["Project Name"])
+    assert "Department" not in guide
+    # The budget covers the listed columns and values, not the heading
+    assert estimate_tokens("\n".join(format_guide(guide).splitlines()[1:])) <= budget
+
+
+def test_format_guide():
+    assert format_guide({}) == ""
+    assert format_guide({"Department": ["HR", "Delivery"]}).splitlines()[1:] == ["- Department: HR, Delivery"]
@@ -0,0 +1,125 @@
+import os
+import re
+
+import pandas as pd
+
+from ingest import present_values
+
+# A string column is treated as categorical when it has at most this many
+# distinct values and they repeat (distinct / non-missing <= ratio).
+VALUE_DICT_MAX_DISTINCT = int(os.getenv("VALUE_DICT_MAX_DISTINCT", "300"))
+VALUE_DICT_MAX_RATIO = 0.5
+# Free-text columns (comments, descriptions) are never listed.
+VALUE_DICT_MAX_AVG_LEN = 60
+
+# Approximate token budget for the column/value reference added to each prompt.
+PROMPT_GUIDE_TOKEN_BUDGET = int(os.getenv("PROMPT_GUIDE_TOKEN_BUDGET", "300"))
+# Columns this small are worth listing in full whenever the budget allows.
+SMALL_COLUMN_MAX_VALUES = 6
+
+
+def estimate_tokens(text):
+    # Rough rule of thumb for English text; good enough for budgeting.
+    return len(text) // 4 + 1
+
+
+def build_value_dictionary(df):
+    """Map each low-cardinality string column to its values, most frequent first."""
+    value_dict = {}
+    for col in df.columns:
+        s = df[col]
+        if not (s.dtype == object or pd.api.types.is_string_dtype(s) or isinstance(s.dtype, pd.CategoricalDtype)):
+            continue
+        # Whitespace-only cells are blank, not a value to match
+        s = s[present_values(s)]
+        if s.empty:
+            continue
+        counts = s.value_counts()
+        # Categoricals also count the categories no row has
+        counts = counts[counts > 0]
+        if len(counts) > VALUE_DICT_MAX_DISTINCT or len(counts) > VALUE_DICT_MAX_RATIO * len(s):
+            continue
+        # Mean length over the rows, from each distinct value's length and count
+        lengths = pd.Series(counts.index.astype(str), index=counts.index).str.len()
+        if (lengths * counts).sum() / counts.sum() > VALUE_DICT_MAX_AVG_LEN:
+            continue
+        value_dict[col] = [str(v) for v in counts.index]
+    return value_dict
+
+
+def refresh_value_dictionary(value_dict, df, diff):
+    """Value dictionary of the next version of a sheet (see refresh.RowDiff).
+
+    Only the columns whose values changed are recounted; added or removed
+    rows change every column's counts, so then it is rebuilt.
+    """
+    if diff.rows_added or diff.rows_removed:
+        return build_value_dictionary(df)
+    changed = [col for col in df.columns if col in diff.changed_columns]
+    fresh = build_value_dictionary(df[changed]) if changed else {}
+    refreshed = {}
+    for col in df.columns:
+        if col in diff.changed_columns:
+            if col in fresh:
+                refreshed[col] = fresh[col]
+        elif col in value_dict:
+            refreshed[col] = value_dict[col]
+    return refreshed
+
+
+def _mentions(query_lower, phrase):
+    return re.search(r"(?<!\w)" + re.escape(phrase.lower()) + r"(?!\w)", query_lower) is not None
+
+
+def select_guide(query, value_dict, token_budget=None):
+    """Pick the columns and values relevant to ``query`` within ``token_budget``.
+
+    Values literally mentioned in the query come first (that is what the
+    model needs to disambiguate), then columns named in the query, then
+    small columns listed in full. Lower-priority lines are dropped once the
+    budget is spent.
+    """
+    if token_budget is None:
+        token_budget = PROMPT_GUIDE_TOKEN_BUDGET
+    query_lower = query.lower()
+
+    matched, named, small = {}, [], []
+    for col, values in value_dict.items():
+        hits = [v for v in values if _mentions(query_lower, v)]
+        if hits:
+            matched[col] = hits
+        elif _mentions(query_lower, col):
+            named.append(col)
+        elif len(values) <= SMALL_COLUMN_MAX_VALUES:
+            small.append(col)
+
+    candidates = [(col, hits) for col, hits in matched.items()]
+    candidates += [(col, value_dict[col]) for col in named]
+    candidates += [(col, value_dict[col]) for col in small]
+
+    guide = {}
+    used = 0
+    for col, values in candidates:
+        chosen = []
+        cost = estimate_tokens(f"- {col}: ")
+        for value in values:
+            value_cost = estimate_tokens(value + ", ")
+            if used + cost + value_cost > token_budget:
+                break
+            chosen.append(value)
+            cost += value_cost
+        if chosen:
+            guide[col] = chosen
+            used += cost
+        if used >= token_budget:
+            break
+    return guide
+
+
+def format_guide(guide):
+    if not guide:
+        return ""
+    lines = ["**Column-to-Value Reference (for disambiguation):**"]
+    for col, values in guide.items():
+        lines.append(f"- {col}: {', '.join(values)}")
+    return "\n".join(lines)